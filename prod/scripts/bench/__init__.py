@@ -0,0 +1,3 @@
+"""
+Synthetic MRF generator and pipeline throughput benchmarks.
+"""
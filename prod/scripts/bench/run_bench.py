@@ -0,0 +1,373 @@
+"""
+Throughput benchmarks of the pipeline stages on synthetic files.
+
+A seeded TOC and in-network MRF (see synthetic.py) are generated into a work
+directory and served by a local HTTP server, so no payer endpoint is
+involved. Each stage then runs in a fresh process, which makes its peak RSS
+its own: TOC streaming, format detection, scraping, the relational
+transform, saving and the DuckDB analyzers. Every stage records wall and CPU
+seconds, rows/s, MB/s and peak RSS.
+
+Results are written to RESULTS_PATH and compared with the stored baseline
+for the same preset: a throughput drop or RSS increase beyond the tolerance
+is reported as a regression and fails the run. `--save-baseline` stores the
+current results as the new baseline.
+
+Run from prod/:
+    python -m scripts.bench.run_bench --preset small
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .synthetic import MRFSpec, TOCSpec, write_mrf, write_toc
+from ..fetch_from_toc import fetch_and_stream_toc
+from ..inn import analyze_relational, format_check
+from ..inn.scrapers import SCRAPERS
+from ..inn.scrapers.grouped_by_provider_reference import CPT_CODES
+from ..inn.utils.columnar import FLAT_RATE_SCHEMA
+from ..inn.transformers.relational import save_relational_tables, transform_to_relational
+from ..inn.utils.memory import peak_rss_bytes
+
+BENCH_DIR = Path("prod/data/bench")
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+RESULTS_PATH = BENCH_DIR / "last_run.json"
+TOLERANCE = 0.2  # allowed relative drop in throughput (or rise in peak RSS)
+ENTITY_NAME = "Synthetic Health Plan"
+
+PRESETS = {
+    "small": (MRFSpec(), TOCSpec()),
+    "medium": (MRFSpec(provider_groups=20000, billing_codes=2000, rates_per_code=20),
+               TOCSpec(reporting_structures=5000, distinct_files=2000)),
+    "large": (MRFSpec(provider_groups=100000, group_size=12, billing_codes=8000, rates_per_code=30),
+              TOCSpec(reporting_structures=50000, distinct_files=20000)),
+}
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address) -> None:
+        # Format detection hangs up after the head of a file (this server ignores Range)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+@contextlib.contextmanager
+def serve_directory(root: Path) -> Iterator[str]:
+    """
+    Serve `root` over HTTP on a free local port, standing in for a payer host.
+
+    Yields:
+        Base URL of the server
+    """
+    server = _QuietServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Stopwatch:
+    """
+    Wall and CPU seconds (all threads of the process) spent inside a with-block.
+    """
+
+    def __enter__(self) -> "Stopwatch":
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+
+
+def _result(watch: Stopwatch, rows: int, nbytes: int) -> Dict:
+    return {"wall": watch.wall, "cpu": watch.cpu, "rows": rows, "bytes": nbytes}
+
+
+def _scrape_table(source: str, format_style: str) -> pa.Table:
+    return pa.Table.from_batches(list(SCRAPERS[format_style].flat(source)), schema=FLAT_RATE_SCHEMA)
+
+
+def bench_toc(ctx: Dict) -> Dict:
+    """
+    fetch_and_stream_toc over HTTP; bytes are the TOC's uncompressed JSON.
+    """
+    with Stopwatch() as watch:
+        entries = fetch_and_stream_toc(ctx["toc_url"], max_urls=None)
+    return _result(watch, len(entries), ctx["toc"]["json_bytes"])
+
+
+def bench_detect_format(ctx: Dict) -> Dict:
+    """
+    detect_format_from_url over HTTP; bytes are the file as served (gzipped),
+    of which detection only reads a bounded prefix.
+    """
+    with Stopwatch() as watch:
+        detected = format_check.detect_format_from_url(ctx["mrf_url"])
+    if detected != ctx["format"]:
+        raise RuntimeError(f"Detected {detected} for the synthetic MRF, expected {ctx['format']}")
+    return _result(watch, 0, ctx["mrf"]["bytes"])
+
+
+def bench_scrape(ctx: Dict) -> Dict:
+    """
+    The format's flat scraper over HTTP; bytes are the MRF's uncompressed JSON.
+    """
+    with Stopwatch() as watch:
+        table = _scrape_table(ctx["mrf_url"], ctx["format"])
+    return _result(watch, table.num_rows, ctx["mrf"]["json_bytes"])
+
+
+def bench_transform(ctx: Dict) -> Dict:
+    """
+    transform_to_relational of the scraped flat table; bytes are its in-memory size.
+    """
+    flat = pq.read_table(ctx["flat_path"])
+    with Stopwatch() as watch:
+        transform_to_relational(flat, ctx["mrf_url"], ENTITY_NAME)
+    return _result(watch, flat.num_rows, flat.nbytes)
+
+
+def bench_save(ctx: Dict) -> Dict:
+    """
+    save_relational_tables to Parquet; bytes are the files written.
+    """
+    tables = transform_to_relational(pq.read_table(ctx["flat_path"]), ctx["mrf_url"], ENTITY_NAME)
+    with tempfile.TemporaryDirectory(dir=ctx["workdir"]) as out, Stopwatch() as watch:
+        paths = save_relational_tables(tables, out, "synthetic")
+        nbytes = sum(os.path.getsize(p) for p in paths)
+    return _result(watch, sum(t.num_rows for t in tables.values()), nbytes)
+
+
+def bench_analyze(ctx: Dict) -> Dict:
+    """
+    The relational analyzers (DuckDB over the saved Parquet files); bytes are the files read.
+    """
+    data_dir = Path(ctx["relational_dir"])
+    os.chdir(ctx["workdir"])  # analyze_rates writes its histogram to the working directory
+    with Stopwatch() as watch:
+        engine = analyze_relational.RelationalQueryEngine(data_dir)
+        analyze_relational.analyze_reporting_entities(engine)
+        analyze_relational.analyze_providers(engine)
+        analyze_relational.analyze_rates(engine)
+        analyze_relational.analyze_relationships(engine)
+    rows = pq.read_metadata(data_dir / "synthetic_negotiated_rates.parquet").num_rows
+    return _result(watch, rows, sum(p.stat().st_size for p in data_dir.glob("*.parquet")))
+
+
+BENCHMARKS: Dict[str, Callable[[Dict], Dict]] = {
+    "toc": bench_toc,
+    "detect_format": bench_detect_format,
+    "scrape": bench_scrape,
+    "transform": bench_transform,
+    "save": bench_save,
+    "analyze": bench_analyze,
+}
+
+
+def prepare(workdir: Path, mrf_spec: MRFSpec, toc_spec: TOCSpec, base_url: str) -> Dict:
+    """
+    Generate the synthetic files and the intermediate outputs later stages start from.
+
+    Returns:
+        Context handed to every benchmark
+    """
+    print(f"🧪 Generating synthetic files in {workdir}")
+    mrf_name = "synthetic_in_network.json.gz"
+    mrf = write_mrf(workdir / mrf_name, mrf_spec, target_codes=sorted(CPT_CODES))
+    toc = write_toc(workdir / "synthetic_index.json.gz", base_url, toc_spec, file_names=[mrf_name])
+    print(f"   MRF: {mrf['bytes'] / 1024 ** 2:.1f} MB gzipped, {mrf['json_bytes'] / 1024 ** 2:.1f} MB JSON, "
+          f"{mrf['providers']:,} providers, {mrf['negotiated_rates']:,} rates")
+    print(f"   TOC: {toc['bytes'] / 1024 ** 2:.1f} MB gzipped, {toc['listings']:,} listings")
+
+    ctx = {
+        "workdir": str(workdir),
+        "mrf": mrf,
+        "toc": toc,
+        "mrf_url": f"{base_url}/{mrf_name}",
+        "format": "inline_provider_groups" if mrf_spec.inline_groups else "grouped_by_provider_reference",
+        "toc_url": f"{base_url}/synthetic_index.json.gz",
+        "flat_path": str(workdir / "flat.parquet"),
+        "relational_dir": str(workdir / "relational"),
+    }
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        flat = _scrape_table(str(workdir / mrf_name), ctx["format"])
+        pq.write_table(flat, ctx["flat_path"])
+        save_relational_tables(transform_to_relational(flat, ctx["mrf_url"], ENTITY_NAME),
+                               ctx["relational_dir"], "synthetic")
+    return ctx
+
+
+def _measure(name: str, ctx: Dict) -> Dict:
+    """
+    Run one benchmark; called in a fresh worker process so peak RSS is its own.
+    """
+    os.environ["TQDM_DISABLE"] = "1"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = BENCHMARKS[name](ctx)
+    result["peak_rss"] = peak_rss_bytes()
+    return result
+
+
+def run_benchmarks(ctx: Dict, names: List[str], repeat: int = 1) -> Dict[str, Dict]:
+    """
+    Run each benchmark `repeat` times in fresh processes and keep its fastest run.
+
+    Workers are spawned rather than forked, so their peak RSS does not start
+    from the parent's.
+
+    Returns:
+        Benchmark name -> wall, cpu, rows, bytes, peak_rss, rows_per_s, mb_per_s
+    """
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                runs.append(executor.submit(_measure, name, ctx).result())
+        best = min(runs, key=lambda r: r["wall"])
+        wall = max(best["wall"], 1e-9)
+        best["rows_per_s"] = best["rows"] / wall if best["rows"] else None
+        best["mb_per_s"] = best["bytes"] / 1024 ** 2 / wall
+        results[name] = best
+        rows = f"{best['rows_per_s']:>12,.0f} rows/s" if best["rows_per_s"] else f"{'':>19}"
+        print(f"⏱️  {name:<14} {best['wall']:8.3f}s wall {best['cpu']:8.3f}s cpu {rows} "
+              f"{best['mb_per_s']:9.1f} MB/s {best['peak_rss'] / 1024 ** 2:8.0f} MB peak RSS")
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float = TOLERANCE) -> List[str]:
+    """
+    Regressions of `results` against `baseline`, as readable lines.
+
+    Throughput (rows/s, MB/s) may drop and peak RSS may rise by at most
+    `tolerance` (a fraction of the baseline value).
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ("rows_per_s", "mb_per_s"):
+            if base.get(metric) and current.get(metric) is not None \
+                    and current[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]:,.1f} < baseline {base[metric]:,.1f}")
+        if base.get("peak_rss") and current["peak_rss"] > base["peak_rss"] * (1 + tolerance):
+            regressions.append(f"{name}: peak_rss {current['peak_rss'] / 1024 ** 2:,.0f} MB > "
+                               f"baseline {base['peak_rss'] / 1024 ** 2:,.0f} MB")
+    return regressions
+
+
+def _load_json(path: Path) -> Dict:
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path: Path, data: Dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic MRFs")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small", help="Size of the synthetic files")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed")
+    parser.add_argument("--key-order", choices=["refs_first", "in_network_first"], default="refs_first",
+                        help="Whether provider_references come before or after in_network")
+    parser.add_argument("--inline-groups", action="store_true",
+                        help="List providers on each rate (inline provider_groups layout) instead of by reference")
+    parser.add_argument("--group-size", type=int, help="Smallest provider group (sizes are Pareto above it)")
+    parser.add_argument("--billing-codes", type=int, help="Billing codes in the MRF")
+    parser.add_argument("--rates-per-code", type=int, help="Mean negotiated_rates per billing code")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark (the fastest is kept)")
+    parser.add_argument("--workdir", type=Path, help="Keep the generated files here (temporary by default)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Allowed relative throughput drop or peak-RSS rise")
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH, help="Where to write this run's results")
+    args = parser.parse_args()
+
+    mrf_spec, toc_spec = PRESETS[args.preset]
+    overrides = {"group_size": args.group_size, "billing_codes": args.billing_codes,
+                 "rates_per_code": args.rates_per_code}
+    mrf_spec = mrf_spec._replace(seed=args.seed, refs_first=args.key_order == "refs_first",
+                                 inline_groups=args.inline_groups,
+                                 **{k: v for k, v in overrides.items() if v is not None})
+    toc_spec = toc_spec._replace(seed=args.seed)
+    # Results are only comparable for the same files
+    layout = "inline_groups" if args.inline_groups else args.key_order
+    key = f"{args.preset}-{layout}-seed{args.seed}" + "".join(
+        f"-{k}{v}" for k, v in overrides.items() if v is not None)
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        workdir.mkdir(parents=True, exist_ok=True)
+        base_url = stack.enter_context(serve_directory(workdir))
+        ctx = prepare(workdir, mrf_spec, toc_spec, base_url)
+        results = run_benchmarks(ctx, args.only or list(BENCHMARKS), args.repeat)
+
+    record = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "mrf_spec": mrf_spec._asdict(),
+        "toc_spec": toc_spec._asdict(),
+        "files": {"mrf": ctx["mrf"], "toc": ctx["toc"]},
+        "results": results,
+    }
+    _save_json(args.output, {key: record})
+    print(f"\n📝 Results saved to: {args.output}")
+
+    baselines = _load_json(args.baseline)
+    if args.save_baseline:
+        baselines[key] = record
+        _save_json(args.baseline, baselines)
+        print(f"📌 Baseline for {key} saved to: {args.baseline}")
+        return
+
+    if key not in baselines:
+        print(f"ℹ️  No baseline for {key} in {args.baseline}; run with --save-baseline to store one")
+        return
+    regressions = compare(results, baselines[key]["results"], args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regressions against the baseline of {baselines[key]['created']}:")
+        for line in regressions:
+            print(f"   {line}")
+        sys.exit(1)
+    print(f"\n✅ No regressions against the baseline of {baselines[key]['created']}")
+
+
+if __name__ == "__main__":
+    main()
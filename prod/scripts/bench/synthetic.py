@@ -0,0 +1,246 @@
+# prod/bench/synthetic.py
+"""
+Seeded generator of synthetic TOC and in-network MRF files.
+
+The files follow the Transparency in Coverage layouts the pipeline reads and
+are skewed the way real payer files are: provider group sizes and rates per
+billing code follow heavy-tailed (Pareto) distributions, a few in-network
+files are listed by many reporting structures, and only a small share of
+billing codes are ones the scraper keeps. Files are written item by item, so
+memory stays flat however large they are, and the same spec and seed always
+produce the same bytes.
+"""
+
+import gzip
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+PLACES_OF_SERVICE = ["11", "19", "21", "22", "23", "24", "81"]
+NPI_BASE = 1_000_000_000
+TIN_BASE = 100_000_000
+
+
+class MRFSpec(NamedTuple):
+    provider_groups: int = 2000
+    group_size: int = 8  # smallest group; sizes are Pareto-distributed above it
+    max_group_size: int = 5000
+    billing_codes: int = 400
+    rates_per_code: int = 12  # mean number of negotiated_rates per billing code
+    refs_per_rate: int = 3  # most provider_references on one rate
+    prices_per_rate: int = 2  # most negotiated_prices on one rate
+    target_boost: int = 10  # target codes are common services with this many times the rates
+    refs_first: bool = True  # provider_references before in_network (key order)
+    inline_groups: bool = False  # providers listed on each rate instead of in provider_references
+    seed: int = 0
+
+
+class TOCSpec(NamedTuple):
+    reporting_structures: int = 500
+    plans_per_structure: int = 3
+    files_per_structure: int = 4
+    distinct_files: int = 200  # listings draw (with Zipf skew) from this many files
+    seed: int = 0
+
+
+class CountingWriter:
+    """
+    Write-through wrapper counting the (uncompressed) bytes written.
+    """
+
+    def __init__(self, sink: BinaryIO):
+        self.sink = sink
+        self.count = 0
+
+    def write(self, b) -> int:
+        self.count += len(b)
+        return self.sink.write(b)
+
+
+@contextmanager
+def _open_output(path: Path, compresslevel: int):
+    with open(path, "wb") as f:
+        if path.suffix != ".gz":
+            yield f
+            return
+        # No name or timestamp in the header, so the same spec gives the same bytes
+        with gzip.GzipFile(filename="", mode="wb", fileobj=f, compresslevel=compresslevel, mtime=0) as gz:
+            yield gz
+
+
+def _pareto_sizes(rng: np.random.Generator, n: int, minimum: int, maximum: int, shape: float = 1.2) -> np.ndarray:
+    return np.minimum(np.floor((rng.pareto(shape, n) + 1) * minimum), maximum).astype(np.int64)
+
+
+def _billing_codes(rng: np.random.Generator, count: int, target_codes: Sequence[str]) -> List[str]:
+    codes = list(dict.fromkeys(target_codes))[:count]
+    taken = set(codes)
+    while len(codes) < count:
+        code = f"{rng.integers(10000, 99999)}"
+        if code not in taken:
+            taken.add(code)
+            codes.append(code)
+    # Targets land at random positions, not all at the front of the file
+    return [codes[i] for i in rng.permutation(len(codes))]
+
+
+def _iter_provider_references(spec: MRFSpec, rng: np.random.Generator, stats: Dict) -> Iterator[Dict]:
+    sizes = _pareto_sizes(rng, spec.provider_groups, spec.group_size, spec.max_group_size)
+    for group_id, size in enumerate(sizes, start=1):
+        npis = (NPI_BASE + rng.integers(0, 999_999_999, size)).tolist()
+        n_tins = int(min(size, rng.integers(1, 4)))
+        cuts = np.sort(rng.choice(np.arange(1, size), n_tins - 1, replace=False)) if n_tins > 1 else []
+        groups = []
+        for part in np.split(np.asarray(npis), cuts):
+            tin = f"{TIN_BASE + rng.integers(0, 899_999_999):09d}"
+            groups.append({"npi": part.tolist(), "tin": {"type": "ein", "value": tin}})
+        stats["providers"] += int(size)
+        yield {"provider_group_id": group_id, "provider_groups": groups}
+
+
+def _iter_in_network(spec: MRFSpec, rng: np.random.Generator, codes: List[str], targets: set,
+                     stats: Dict, inline: Optional[Dict[int, List[Dict]]] = None) -> Iterator[Dict]:
+    # Pareto(1.5) + 1 has mean 3, so this averages about rates_per_code
+    rate_counts = _pareto_sizes(rng, len(codes), max(1, round(spec.rates_per_code / 3)), 50 * spec.rates_per_code, 1.5)
+    for code, n_rates in zip(codes, rate_counts):
+        if code in targets:
+            n_rates *= spec.target_boost
+        rates = []
+        for _ in range(n_rates):
+            refs = rng.integers(1, spec.provider_groups + 1, rng.integers(1, spec.refs_per_rate + 1))
+            prices = []
+            for _ in range(rng.integers(1, spec.prices_per_rate + 1)):
+                pos = PLACES_OF_SERVICE[rng.integers(len(PLACES_OF_SERVICE))]
+                prices.append({
+                    "negotiated_type": "negotiated",
+                    "negotiated_rate": round(float(rng.lognormal(4.5, 0.6)), 2),
+                    "expiration_date": "9999-12-31",
+                    "service_code": [pos],
+                    "place_of_service": pos,  # as the scraper reads it
+                    "billing_class": "professional",
+                })
+            if inline is None:
+                rates.append({"provider_references": refs.tolist(), "negotiated_prices": prices})
+            else:
+                groups = [group for ref in refs.tolist() for group in inline[ref]]
+                rates.append({"provider_groups": groups, "negotiated_prices": prices})
+        stats["in_network_items"] += 1
+        stats["negotiated_rates"] += int(n_rates)
+        stats["target_rates"] += int(n_rates) if code in targets else 0
+        yield {
+            "negotiation_arrangement": "ffs",
+            "name": f"Service {code}",
+            "billing_code_type": "CPT",
+            "billing_code_type_version": "2025",
+            "billing_code": code,
+            "description": f"Synthetic service {code}",
+            "negotiated_rates": rates,
+        }
+
+
+def _write_array(out: CountingWriter, key: str, items: Iterator[Dict]) -> None:
+    out.write(f',"{key}":['.encode())
+    for i, item in enumerate(items):
+        out.write(((b"," if i else b"") + json.dumps(item, separators=(",", ":")).encode()))
+    out.write(b"]")
+
+
+def write_mrf(path: Union[str, Path], spec: MRFSpec = MRFSpec(), target_codes: Sequence[str] = (),
+              compresslevel: int = 6) -> Dict:
+    """
+    Write a synthetic in-network MRF (gzipped if `path` ends in .gz).
+
+    Args:
+        path: Output path
+        spec: Sizes, skew and key order of the file
+        target_codes: Billing codes to include among spec.billing_codes
+            (e.g. the scraper's CPT_CODES, so it has rates to keep)
+        compresslevel: gzip level
+
+    Returns:
+        Dict of counts: bytes (on disk), json_bytes (uncompressed),
+        provider_groups, providers, in_network_items, negotiated_rates and
+        target_rates (rates of the target codes)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(spec.seed)
+    codes = _billing_codes(rng, spec.billing_codes, target_codes)
+    stats = {"provider_groups": spec.provider_groups, "providers": 0, "in_network_items": 0,
+             "negotiated_rates": 0, "target_rates": 0}
+    refs_rng, rates_rng = (np.random.default_rng(s) for s in rng.integers(0, 2 ** 32, 2))
+    if spec.inline_groups:
+        # Same providers and rates as the referenced layout, copied onto each rate
+        inline = {ref["provider_group_id"]: ref["provider_groups"]
+                  for ref in _iter_provider_references(spec, refs_rng, stats)}
+        sections = [("in_network", _iter_in_network(spec, rates_rng, codes, set(target_codes), stats, inline))]
+    else:
+        sections = [
+            ("provider_references", _iter_provider_references(spec, refs_rng, stats)),
+            ("in_network", _iter_in_network(spec, rates_rng, codes, set(target_codes), stats)),
+        ]
+        if not spec.refs_first:
+            sections.reverse()
+
+    with _open_output(path, compresslevel) as f:
+        out = CountingWriter(f)
+        header = {
+            "reporting_entity_name": "Synthetic Health Plan",
+            "reporting_entity_type": "health insurance issuer",
+            "last_updated_on": "2025-05-01",
+            "version": "1.3.1",
+        }
+        out.write(json.dumps(header, separators=(",", ":"))[:-1].encode())
+        for key, items in sections:
+            _write_array(out, key, items)
+        out.write(b"}")
+    return {"bytes": path.stat().st_size, "json_bytes": out.count, **stats}
+
+
+def write_toc(path: Union[str, Path], base_url: str, spec: TOCSpec = TOCSpec(),
+              file_names: Optional[Sequence[str]] = None, compresslevel: int = 6) -> Dict:
+    """
+    Write a synthetic Table of Contents (gzipped if `path` ends in .gz).
+
+    Listings point at `{base_url}/{name}`; names come from `file_names` first
+    (e.g. generated MRFs) and are padded with in_network_NNNNN.json.gz. A few
+    files are listed by many structures, as in real TOCs.
+
+    Returns:
+        Dict of counts: bytes, json_bytes, reporting_structures, listings and
+        distinct_files (files actually listed)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(spec.seed)
+    names = list(file_names or [])
+    names += [f"in_network_{i:05d}.json.gz" for i in range(len(names), spec.distinct_files)]
+    # Zipf-like popularity: file k is listed with weight 1 / (k + 1)
+    weights = 1.0 / np.arange(1, len(names) + 1)
+    weights /= weights.sum()
+    listed = set()
+
+    def structures() -> Iterator[Dict]:
+        for s in range(spec.reporting_structures):
+            plans = [{
+                "plan_name": f"Synthetic Plan {s}-{p}",
+                "plan_id_type": "EIN",
+                "plan_id": f"{TIN_BASE + s:09d}",
+                "plan_market_type": "group" if p % 2 else "individual",
+            } for p in range(spec.plans_per_structure)]
+            picks = rng.choice(len(names), min(spec.files_per_structure, len(names)), replace=False, p=weights)
+            listed.update(int(i) for i in picks)
+            files = [{"description": f"in-network file {i}", "location": f"{base_url}/{names[i]}"} for i in picks]
+            yield {"reporting_plans": plans, "in_network_files": files}
+
+    with _open_output(path, compresslevel) as f:
+        out = CountingWriter(f)
+        header = {"reporting_entity_name": "Synthetic Health Plan", "reporting_entity_type": "health insurance issuer"}
+        out.write(json.dumps(header, separators=(",", ":"))[:-1].encode())
+        _write_array(out, "reporting_structure", structures())
+        out.write(b"}")
+    return {"bytes": path.stat().st_size, "json_bytes": out.count, "reporting_structures": spec.reporting_structures,
+            "listings": spec.reporting_structures * spec.files_per_structure, "distinct_files": len(listed)}
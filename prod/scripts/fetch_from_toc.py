@@ -1,26 +1,61 @@
 """
 Script to fetch and process Table of Contents (TOC) files for healthcare transparency data.
+
+A single TOC is streamed with `fetch_and_stream_toc`. For a full index
+refresh, `crawl_tocs` fetches a list of TOCs concurrently from a thread pool:
+each host gets its own pooled keep-alive session and a cap on concurrent
+requests, transient failures are retried with exponential backoff, and
+entries are merged into one manifest file as they are parsed.
+
+Manifests are deduplicated: each in-network file appears once, keyed by its
+location without signed-URL parameters, with the plans of every listing
+merged into an interned plan table (see toc.utils.manifest). With a .jsonl
+or .parquet output the crawl writes an append-only manifest that consumers
+can follow while it runs.
 """
 
 import argparse
 import gzip
 import ijson
-import json
+import io
 import requests
-from io import BytesIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from .toc.utils.manifest import ManifestBuilder, ManifestWriter, normalize_location
 
 TOC_URL = "https://d1hgtx7rrdl2cn.cloudfront.net/mrf/toc/FloridaBlue_Third-Party-Administrator_index.json"
-OUTPUT_FILE = Path("data/staging/in_network_manifest.json")
+OUTPUT_FILE = Path("data/staging/in_network_manifest.jsonl")
 MAX_URLS = 10
 
+# Crawler settings
+CRAWL_WORKERS = 16
+PER_HOST_LIMIT = 4  # concurrent requests (and pooled connections) per host
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 1.0  # seconds; doubles after every failed attempt
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REQUEST_TIMEOUT = (10, 300)  # (connect, read) seconds
+READ_BUFFER = 1024 * 1024
+
 def open_possibly_gzipped_response(response):
-    start = response.content[:2]
-    is_gz = start == b'\x1f\x8b'  # GZIP magic bytes
-    stream = BytesIO(response.content)
-    return gzip.open(stream, 'rt', encoding='utf-8') if is_gz else stream
+    """
+    Wrap a streamed response body as a binary file, gunzipping it on the fly if needed.
+    """
+    response.raw.decode_content = True  # undo Content-Encoding, if any
+    response.raw.auto_close = False  # stay readable at EOF so gzip can probe for more members
+    stream = io.BufferedReader(response.raw, READ_BUFFER)
+    is_gz = stream.peek(2)[:2] == b'\x1f\x8b'  # GZIP magic bytes
+    return gzip.GzipFile(fileobj=stream) if is_gz else stream
 
 def extract_plan_info(plan: dict) -> dict:
     """
@@ -39,66 +74,245 @@ def extract_plan_info(plan: dict) -> dict:
         "plan_market_type": plan.get("plan_market_type", "unknown")
     }
 
-def fetch_and_stream_toc(url: str) -> list:
+def iter_toc_entries(url: str, session: Optional[requests.Session] = None) -> Iterator[Dict]:
+    """
+    Stream a TOC and yield one manifest entry per in-network file.
+
+    Args:
+        url: URL of the TOC file
+        session: Optional requests session to reuse pooled connections
+
+    Yields:
+        Manifest entries (location, description, reporting entity, plans)
+    """
+    response = (session or requests).get(url, stream=True, timeout=REQUEST_TIMEOUT)
+    with response:
+        if response.status_code != 200:
+            raise requests.HTTPError(f"❌ Failed to download TOC: {response.status_code}", response=response)
+
+        f = open_possibly_gzipped_response(response)
+        for structure in ijson.items(f, "reporting_structure.item"):
+            # Extract entity information
+            entity_info = {
+                "reporting_entity_name": structure.get("reporting_entity_name", "Unknown"),
+                "reporting_entity_type": structure.get("reporting_entity_type", "Unknown"),
+                "last_updated": structure.get("last_updated", datetime.now().isoformat())
+            }
+
+            # Extract plan information
+            reporting_plans = []
+            for plan in structure.get("reporting_plans", []):
+                reporting_plans.append(extract_plan_info(plan))
+
+            # Process in-network files
+            for file in structure.get("in_network_files", []):
+                if "location" in file:
+                    yield {
+                        "location": file["location"],
+                        "description": file.get("description", ""),
+                        "reporting_entity": entity_info["reporting_entity_name"],
+                        "reporting_entity_type": entity_info["reporting_entity_type"],
+                        "last_updated": entity_info["last_updated"],
+                        "reporting_plans": reporting_plans
+                    }
+
+def fetch_and_stream_toc(url: str, max_urls: Optional[int] = MAX_URLS) -> list:
     """
     Fetch and stream a Table of Contents file, extracting relevant information.
     
     Args:
         url: URL of the TOC file
+        max_urls: Stop after this many in-network files (None for all)
         
     Returns:
-        List of dictionaries containing extracted information
+        List of dictionaries containing extracted information, one per file
+        with the plans of all its listings merged
     """
     print(f"📥 Streaming TOC from: {url}")
-    response = requests.get(url, stream=True)
-    if response.status_code != 200:
-        raise Exception(f"❌ Failed to download TOC: {response.status_code}")
-
-    f = open_possibly_gzipped_response(response)
-    parser = ijson.items(f, "reporting_structure.item")
-
-    urls = []
-    count = 0
-    for structure in tqdm(parser, desc="🔍 Scanning TOC"):
-        # Extract entity information
-        entity_info = {
-            "reporting_entity_name": structure.get("reporting_entity_name", "Unknown"),
-            "reporting_entity_type": structure.get("reporting_entity_type", "Unknown"),
-            "last_updated": structure.get("last_updated", datetime.now().isoformat())
-        }
-        
-        # Extract plan information
-        reporting_plans = []
-        for plan in structure.get("reporting_plans", []):
-            reporting_plans.append(extract_plan_info(plan))
-        
-        # Process in-network files
-        for file in structure.get("in_network_files", []):
-            if "location" in file:
-                urls.append({
-                    "location": file["location"],
-                    "description": file.get("description", ""),
-                    "reporting_entity": entity_info["reporting_entity_name"],
-                    "reporting_entity_type": entity_info["reporting_entity_type"],
-                    "last_updated": entity_info["last_updated"],
-                    "reporting_plans": reporting_plans
-                })
-                count += 1
-                if count >= MAX_URLS:
-                    return urls
-    return urls
-
-def save_staging_list(entries: list):
-    """
-    Save the extracted information to a JSON file.
+    manifest = ManifestBuilder()
+    for entry in tqdm(iter_toc_entries(url), desc="🔍 Scanning TOC"):
+        if max_urls and len(manifest) >= max_urls and entry["location"] not in manifest:
+            break
+        manifest.add(entry)
+    return manifest.entries()
+
+def save_staging_list(entries: list, output_file: Path = OUTPUT_FILE):
+    """
+    Save the extracted information to a deduplicated manifest.
     
     Args:
         entries: List of dictionaries to save
+        output_file: Manifest path (.json, .jsonl or .parquet)
     """
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(entries, f, indent=2)
-    print(f"✅ Saved {len(entries)} URLs to: {OUTPUT_FILE}")
+    with ManifestWriter(output_file) as writer:
+        for entry in entries:
+            writer.write(entry)
+    print(f"✅ Saved {writer.count} URLs ({len(writer.manifest.plans)} plans) to: {output_file}")
+
+class HostPool:
+    """
+    Per-host pooled sessions and concurrency limits for the crawler.
+
+    Every host gets one keep-alive `requests.Session` whose connection pool
+    holds `per_host` connections, and a semaphore so that no more than
+    `per_host` requests run against it at once, however many workers the
+    crawler has. Connection errors and RETRY_STATUSES responses are retried
+    by urllib3 with exponential backoff, honouring Retry-After.
+
+    Args:
+        per_host: Concurrent requests allowed per host
+        retries: Retries per request
+        backoff_factor: Base backoff delay in seconds
+    """
+
+    def __init__(self, per_host: int = PER_HOST_LIMIT, retries: int = MAX_RETRIES,
+                 backoff_factor: float = BACKOFF_FACTOR):
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._sessions: Dict[str, requests.Session] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _new_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, url: str) -> requests.Session:
+        host = self._host(url)
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._new_session()
+                self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._sessions[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        """
+        Hold one of the host's concurrency slots for the duration of a request.
+        """
+        self.session(url)
+        with self._slots[self._host(url)]:
+            yield
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+def crawl_toc(url: str, hosts: HostPool, writer: ManifestWriter, max_urls: Optional[int] = None,
+              retries: int = MAX_RETRIES, backoff_factor: float = BACKOFF_FACTOR) -> int:
+    """
+    Stream one TOC into the shared manifest.
+
+    Failures before the response starts are retried inside the session; a
+    connection dropped mid-body restarts the download after a backoff and
+    skips the entries that were already written, so no entry is duplicated.
+
+    Args:
+        url: URL of the TOC file
+        hosts: Shared per-host sessions and limits
+        writer: Shared manifest writer
+        max_urls: Stop after this many distinct in-network files (None for all)
+        retries: Restarts allowed after a mid-body failure
+        backoff_factor: Base backoff delay in seconds
+
+    Returns:
+        Number of distinct files listed by this TOC
+    """
+    written = 0
+    files = set()
+    for attempt in range(retries + 1):
+        seen = 0
+        try:
+            with hosts.slot(url):
+                for entry in iter_toc_entries(url, hosts.session(url)):
+                    seen += 1
+                    if seen <= written:
+                        continue
+                    key = normalize_location(entry["location"])
+                    if max_urls and len(files) >= max_urls and key not in files:
+                        break
+                    entry["toc_url"] = url
+                    writer.write(entry)
+                    files.add(key)
+                    written += 1
+            return len(files)
+        except requests.HTTPError:
+            raise
+        # The body is read from the raw urllib3 stream, so a dropped connection surfaces as urllib3's errors
+        except (requests.RequestException, ProtocolError, ReadTimeoutError, EOFError, ijson.IncompleteJSONError) as e:
+            if attempt == retries:
+                raise
+            delay = backoff_factor * (2 ** attempt)
+            print(f"🔁 Retrying {url} in {delay:.1f}s after: {e}")
+            time.sleep(delay)
+    return len(files)
+
+def crawl_tocs(urls: List[str], output_file: Path = OUTPUT_FILE, workers: int = CRAWL_WORKERS,
+               per_host: int = PER_HOST_LIMIT, max_urls: Optional[int] = None,
+               retries: int = MAX_RETRIES, backoff_factor: float = BACKOFF_FACTOR) -> Dict[str, Dict]:
+    """
+    Fetch many TOCs concurrently and merge their entries into one manifest.
+
+    Args:
+        urls: TOC URLs to crawl
+        output_file: Manifest path
+        workers: Threads fetching TOCs in parallel
+        per_host: Concurrent requests allowed per host
+        max_urls: Per-TOC limit on distinct in-network files (None for all)
+        retries: Retries per request
+        backoff_factor: Base backoff delay in seconds
+
+    Returns:
+        Dict mapping each TOC URL to {"status": "ok"|"failed", "entries", "error"}
+    """
+    urls = list(dict.fromkeys(urls))
+    hosts = HostPool(per_host, retries, backoff_factor)
+    writer = ManifestWriter(output_file)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(crawl_toc, url, hosts, writer, max_urls, retries, backoff_factor): url
+                for url in urls
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="🕸️ Crawling TOCs"):
+                url = futures[future]
+                try:
+                    results[url] = {"status": "ok", "entries": future.result(), "error": None}
+                except Exception as e:
+                    print(f"❌ {url}: {e}")
+                    results[url] = {"status": "failed", "entries": 0, "error": str(e)}
+    finally:
+        hosts.close()
+    writer.close()
+
+    failed = sum(1 for r in results.values() if r["status"] == "failed")
+    print(f"✅ Saved {writer.count} URLs ({writer.manifest.occurrences} listings) from {len(urls) - failed}/{len(urls)} TOCs to: {output_file}")
+    return results
+
+def read_url_list(path: str) -> List[str]:
+    """
+    Read TOC URLs from a file, one per line; blank lines and # comments are ignored.
+    """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
 
 def main():
     """
@@ -106,11 +320,26 @@ def main():
     """
     parser = argparse.ArgumentParser(description="Fetch and process Table of Contents files")
     parser.add_argument("--url", default=TOC_URL, help="URL of the TOC file to process")
-    parser.add_argument("--max-urls", type=int, default=MAX_URLS, help="Maximum number of URLs to process")
+    parser.add_argument("--urls-file", help="File with one TOC URL per line; crawls them all concurrently")
+    parser.add_argument("--max-urls", type=int, default=None,
+                        help=f"Maximum number of URLs per TOC (default {MAX_URLS} for --url, all for --urls-file; 0 for all)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE,
+                        help="Manifest path (.json, or append-only .jsonl / .parquet directory)")
+    parser.add_argument("--workers", type=int, default=CRAWL_WORKERS, help="TOCs fetched in parallel")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT, help="Concurrent requests per host")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Retries per request")
     args = parser.parse_args()
 
+    if args.urls_file:
+        urls = read_url_list(args.urls_file)
+        print(f"🚀 Crawling {len(urls)} TOCs ({args.workers} workers, {args.per_host} per host)...")
+        crawl_tocs(urls, args.output, workers=args.workers, per_host=args.per_host,
+                   max_urls=args.max_urls or None, retries=args.retries)
+        return
+
+    max_urls = MAX_URLS if args.max_urls is None else (args.max_urls or None)
     print("🚀 Starting TOC fetch (streamed with ijson)...")
-    entries = fetch_and_stream_toc(args.url)
+    entries = fetch_and_stream_toc(args.url, max_urls)
     
     print("\nExtracted entries:")
     for entry in entries:
@@ -120,7 +349,7 @@ def main():
         for plan in entry['reporting_plans']:
             print(f"  - {plan['plan_name']} ({plan['plan_market_type']})")
     
-    save_staging_list(entries)
+    save_staging_list(entries, args.output)
 
 if __name__ == "__main__":
     main()
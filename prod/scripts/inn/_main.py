@@ -1,39 +1,52 @@
 # prod/inn/_main.py
 
-import json
+import os
 import pyarrow.parquet as pq
 from pathlib import Path
 from . import format_check
-from .scrapers import grouped_by_provider_reference
+from .scrapers import SCRAPERS
+from .utils.cache import MRFCache, DEFAULT_CACHE_DIR
+from .utils.columnar import FLAT_RATE_SCHEMA
+from ..toc.utils.manifest import load_manifest
 
 MANIFEST_PATH = Path(r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\transparency_data\prod\data\staging\in_network_manifest.json")
 OUTPUT_FOLDER = Path("prod/scripts/data/processed/inn_rates/")
 OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
-
-SCRAPER_MAP = {
-    "grouped_by_provider_reference": grouped_by_provider_reference.stream_mrf_to_table
-}
+CACHE_DIR = DEFAULT_CACHE_DIR
 
 def main():
-    with open(MANIFEST_PATH) as f:
-        manifest = json.load(f)
+    manifest = load_manifest(MANIFEST_PATH)
 
+    cache = MRFCache(CACHE_DIR)
     for entry in manifest:
         url = entry["location"]
-        format_style = format_check.detect_format_from_url(url)
+        try:
+            local_path = str(cache.fetch(url))
+        except Exception as e:
+            print(f"❌ Failed to download {url}: {e}")
+            continue
+
+        format_style = format_check.detect_format_from_url(local_path)
         print(f"\n🔍 URL: {url}\n🧠 Format: {format_style}")
 
-        scraper = SCRAPER_MAP.get(format_style)
+        scraper = SCRAPERS.get(format_style)
         if not scraper:
             print("❌ No scraper registered for this format.")
             continue
 
+        out_file = OUTPUT_FOLDER / f"{Path(url).stem}.parquet"
+        tmp_file = out_file.with_name(f"{out_file.name}.tmp")
         try:
-            table = scraper(url)
-            out_file = OUTPUT_FOLDER / f"{Path(url).stem}.parquet"
-            pq.write_table(table, out_file)
-            print(f"✅ Saved to {out_file}")
+            # Write batches as they are produced instead of building the whole table
+            rows = 0
+            with pq.ParquetWriter(tmp_file, FLAT_RATE_SCHEMA) as writer:
+                for batch in scraper.flat(local_path):
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            os.replace(tmp_file, out_file)
+            print(f"✅ Saved {rows} rows to {out_file}")
         except Exception as e:
+            tmp_file.unlink(missing_ok=True)
             print(f"❌ Failed to process {url}: {e}")
 
 if __name__ == "__main__":
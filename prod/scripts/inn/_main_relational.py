@@ -2,17 +2,33 @@
 Main script for processing healthcare transparency data into relational format.
 """
 
-import json
+import argparse
 import logging
+import os
+import sys
+from collections import deque
+from contextlib import ExitStack
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, Dict, List
-import uuid
-import pandas as pd
+from typing import Collection, Optional, Dict, Iterable, Iterator, List
 import pyarrow as pa
 
 from . import format_check
-from .scrapers import grouped_by_provider_reference
-from .transformers.relational import transform_to_relational, save_relational_tables
+from .scrapers import SCRAPERS
+from .transformers.relational import (
+    compact_relational_dataset, entity_key, plan_key, save_relational_dataset, save_relational_tables,
+    stream_relational_tables, transform_to_relational,
+)
+from .transformers.rollup import RateRollup, refresh_rollup, update_rollup
+from .utils.columnar import FLAT_RATE_SCHEMA
+from .utils import metrics
+from .utils.cache import MRFCache, DEFAULT_CACHE_DIR
+from .utils.remote_refs import RemoteReferences
+from .utils.memory import MemoryHistory, available_memory_bytes, children_rss_bytes
+from .utils.run_state import RunState, fetch_fingerprint
+from ..toc.utils.manifest import iter_manifest, load_manifest, normalize_location
 
 # Configure logging
 logging.basicConfig(
@@ -22,13 +38,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Constants
-MANIFEST_PATH = Path("data/staging/in_network_manifest.json")
+MANIFEST_PATH = Path("data/staging/in_network_manifest.jsonl")
 OUTPUT_DIR = Path("prod/data/processed/relational/")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+DATASET_DIR = OUTPUT_DIR / "dataset"
+ROLLUP_DIR = OUTPUT_DIR / "rollup"
+CACHE_DIR = DEFAULT_CACHE_DIR
+REPORT_DIR = Path("prod/data/state/reports")
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 1))
+MEMORY_FRACTION = 0.8  # share of currently available RAM the pool may reserve
+# A fresh worker per entry keeps one file's heap from inflating the next's;
+# max_tasks_per_child needs Python 3.11, older versions reuse workers
+POOL_OPTIONS = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}
 
-SCRAPER_MAP = {
-    "grouped_by_provider_reference": grouped_by_provider_reference.stream_mrf_to_table
-}
 
 def extract_entity_and_plans(manifest_entry: Dict) -> tuple[Dict, List[Dict]]:
     """
@@ -41,10 +63,11 @@ def extract_entity_and_plans(manifest_entry: Dict) -> tuple[Dict, List[Dict]]:
         Tuple of (entity_info, plans_info)
     """
     # Extract entity info
-    entity_id = str(uuid.uuid4())
+    entity_name = manifest_entry.get("reporting_entity", "Unknown")
+    entity_id = entity_key(entity_name)
     entity_info = {
         "entity_id": entity_id,
-        "reporting_entity_name": manifest_entry.get("reporting_entity", "Unknown"),
+        "reporting_entity_name": entity_name,
         "type": "health_plan",  # Default type
         "last_updated": manifest_entry.get("last_updated", ""),
         "version": "2025" if "2025" in manifest_entry.get("location", "") else "2024"
@@ -53,55 +76,108 @@ def extract_entity_and_plans(manifest_entry: Dict) -> tuple[Dict, List[Dict]]:
     # Extract plan info
     plans_info = []
     for plan in manifest_entry.get("reporting_plans", []):
-        plan_id = str(uuid.uuid4())
+        plan_name = plan.get("plan_name", "Unknown")
+        market_type = plan.get("plan_market_type", "unknown")
         plans_info.append({
-            "plan_id": plan_id,
-            "plan_name": plan.get("plan_name", "Unknown"),
+            "plan_id": plan_key(entity_id, plan_name, market_type),
+            "plan_name": plan_name,
             "entity_id": entity_id,
-            "market_type": plan.get("plan_market_type", "unknown")
+            "market_type": market_type
         })
     
     # If no plans found, create a default plan
     if not plans_info:
-        plan_id = str(uuid.uuid4())
+        plan_name = Path(manifest_entry["location"]).stem
         plans_info.append({
-            "plan_id": plan_id,
-            "plan_name": Path(manifest_entry["location"]).stem,
+            "plan_id": plan_key(entity_id, plan_name, "unknown"),
+            "plan_name": plan_name,
             "entity_id": entity_id,
             "market_type": "unknown"
         })
     
     return entity_info, plans_info
 
-def process_url(url: str, manifest_entry: Optional[Dict] = None) -> None:
+def release_month(manifest_entry: Optional[Dict]) -> str:
+    """
+    YYYY-MM release of an entry, from its last_updated date or else the current month.
+    """
+    last_updated = (manifest_entry or {}).get("last_updated") or ""
+    try:
+        return datetime.strptime(last_updated[:7], "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        return datetime.now().strftime("%Y-%m")
+
+def process_url(url: str, manifest_entry: Optional[Dict] = None, cache: Optional[MRFCache] = None,
+                normalized: bool = False, write_index: bool = False, dataset: bool = False,
+                shard_workers: int = 1, spill_provider_map: bool = False) -> Optional[List[str]]:
     """
     Process a single URL into relational format.
     
     Args:
         url: URL to process
         manifest_entry: Optional manifest entry with additional metadata
+        cache: Optional MRF cache; the format is detected from a prefix of the
+            URL before it is downloaded into the cache, and scraping reads the
+            cached copy. Without a cache, detection and scraping share one stream
+        normalized: Emit provider_groups and group-keyed rates instead of one
+            rate row per NPI
+        write_index: Record a billing-code byte index next to the cached copy
+            so other codes can later be extracted without a full re-parse
+            (requires `cache`)
+        dataset: Write into the Hive-partitioned dataset under DATASET_DIR
+            instead of one set of flat files per URL
+        shard_workers: Parse the cached file in this many processes via
+            gzip checkpoints and in_network shards (flat output with a cache only)
+        spill_provider_map: Keep the provider map in memory-mapped files
+            instead of RAM, for provider_references larger than memory
+
+    Returns:
+        Paths of the written tables, or None if no scraper handles its format
     """
+    # Remote provider_references are cached next to the MRFs and shared across files and runs
+    references = RemoteReferences(cache.references_dir, session=cache.session) \
+        if cache is not None else RemoteReferences()
+    stack = ExitStack()
     try:
-        # Detect format
-        format_style = format_check.detect_format_from_url(url)
         logger.info(f"Processing URL: {url}")
+        if cache is not None:
+            # Detect from a bounded prefix (Range request or cached copy) before committing to a download
+            format_style = format_check.detect_format(url, cache=cache)
+        else:
+            # Detect from the head of the one streamed download, which the scraper then continues
+            format_style, stream = stack.enter_context(format_check.open_detected(url))
         logger.info(f"Detected format: {format_style}")
 
         # Get appropriate scraper
-        scraper = SCRAPER_MAP.get(format_style)
+        scrapers = SCRAPERS.get(format_style)
+        scraper = scrapers and (scrapers.normalized if normalized else scrapers.flat)
         if not scraper:
-            logger.error(f"No scraper registered for format: {format_style}")
-            return
+            logger.error(f"No {'normalized ' if normalized else ''}scraper registered for format: {format_style}")
+            return None
 
-        # Scrape data
-        table = scraper(url)
+        if cache is not None:
+            # Download once (or revalidate) and read everything from local disk
+            with metrics.stage("fetch"):
+                source = str(cache.fetch(url))
+        else:
+            source = stream
+
+        # Scrape data (flat scrapers return a lazy batch iterator)
+        if write_index and cache is not None:
+            data = scraper(source, index_path=str(cache.index_path(source)), spill_provider_map=spill_provider_map,
+                           references=references)
+        elif shard_workers > 1 and not normalized and scrapers.sharded and cache is not None:
+            data = scrapers.sharded(source, workers=shard_workers, plan_path=str(cache.shard_plan_path(source)),
+                                    spill_provider_map=spill_provider_map, references=references)
+        else:
+            data = scraper(source, spill_provider_map=spill_provider_map, references=references)
         
         # Extract entity and plan info
         if manifest_entry:
             entity_info, plans_info = extract_entity_and_plans(manifest_entry)
         else:
             # Create default entity and plan if no manifest entry
-            entity_id = str(uuid.uuid4())
+            entity_id = entity_key(Path(url).stem)
             entity_info = {
                 "entity_id": entity_id,
                 "reporting_entity_name": Path(url).stem,
@@ -109,47 +185,346 @@ def process_url(url: str, manifest_entry: Optional[Dict] = None) -> None:
                 "last_updated": "",
                 "version": "2025" if "2025" in url else "2024"
             }
-            plan_id = str(uuid.uuid4())
             plans_info = [{
-                "plan_id": plan_id,
+                "plan_id": plan_key(entity_id, Path(url).stem, "unknown"),
                 "plan_name": Path(url).stem,
                 "entity_id": entity_id,
                 "market_type": "unknown"
             }]
         
+        entity_tables = {
+            "reporting_entities": pa.Table.from_pylist([entity_info]),
+            "reporting_plans": pa.Table.from_pylist(plans_info),
+        }
+        file_prefix = Path(url).stem
+        rollup = RateRollup(entity_info["reporting_entity_name"])
+
+        if not normalized and not dataset:
+            # Transform and write rates batch by batch as the scraper produces them
+            outputs = stream_relational_tables(rollup.observe(data), url, entity_info["reporting_entity_name"],
+                                               str(OUTPUT_DIR), file_prefix, entity_tables)
+            outputs += rollup.write(str(ROLLUP_DIR), file_prefix)
+            logger.info(f"Successfully processed {url}")
+            return outputs
+
+        # The dataset writer sorts whole tables, so collect the batches first
+        if not normalized:
+            data = pa.Table.from_batches(list(data), schema=FLAT_RATE_SCHEMA)
+
         # Transform to relational format
-        tables = transform_to_relational(table, url, entity_info["reporting_entity_name"])
+        tables = transform_to_relational(data, url, entity_info["reporting_entity_name"])
+        if normalized:
+            rollup.add_group_rates(data["negotiated_rates"], data["provider_groups"])
+        else:
+            rollup.add_flat(data)
         
         # Add entity and plan info to tables
-        tables["reporting_entities"] = pa.Table.from_pandas(pd.DataFrame([entity_info]))
-        tables["reporting_plans"] = pa.Table.from_pandas(pd.DataFrame(plans_info))
+        tables.update(entity_tables)
         
         # Save tables
-        file_prefix = Path(url).stem
-        save_relational_tables(tables, str(OUTPUT_DIR), file_prefix)
+        if dataset:
+            outputs = save_relational_dataset(tables, str(DATASET_DIR), file_prefix,
+                                              entity_info["reporting_entity_name"], release_month(manifest_entry))
+        else:
+            outputs = save_relational_tables(tables, str(OUTPUT_DIR), file_prefix)
+        outputs += rollup.write(str(ROLLUP_DIR), file_prefix)
         
         logger.info(f"Successfully processed {url}")
+        return outputs
         
     except Exception as e:
         logger.error(f"Failed to process {url}: {e}")
         raise
+    finally:
+        stack.close()
+        references.close()
+
+def run_entry(url: str, manifest_entry: Dict, cache_dir: str, normalized: bool = False,
+              write_index: bool = False, dataset: bool = False, shard_workers: int = 1,
+              spill_provider_map: bool = False, profile_stages: Collection[str] = ()) -> Dict:
+    """
+    Process one manifest entry and report the outcome instead of raising.
+
+    This is the unit of work submitted to the process pool; each call writes
+    its own output files.
+
+    Args:
+        url: URL to process
+        manifest_entry: Manifest entry with additional metadata
+        cache_dir: Directory of the shared MRF cache
+        normalized: Passed through to process_url
+        write_index: Passed through to process_url
+        dataset: Passed through to process_url
+        shard_workers: Passed through to process_url
+        spill_provider_map: Passed through to process_url
+        profile_stages: Stages to sample with the stack profiler; collapsed
+            stacks are written to REPORT_DIR/<file>.stacks.txt
+
+    Returns:
+        Dict with url, status ("ok", "skipped" or "failed"), error, peak_rss,
+        the written outputs and the per-stage metrics
+    """
+    result = {"url": url, "status": "ok", "error": None, "peak_rss": None, "outputs": []}
+    profile_path = REPORT_DIR / f"{Path(url).stem}.stacks.txt" if profile_stages else None
+    with metrics.track(url, profile_stages, profile_path) as run_metrics:
+        try:
+            outputs = process_url(url, manifest_entry, cache=MRFCache(Path(cache_dir)), normalized=normalized,
+                                  write_index=write_index, dataset=dataset, shard_workers=shard_workers,
+                                  spill_provider_map=spill_provider_map)
+            if outputs is None:
+                result["status"] = "skipped"
+            else:
+                result["outputs"] = outputs
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+    # Sampled over this entry only; ru_maxrss would include earlier entries run in this process
+    result["peak_rss"] = run_metrics.peak_rss
+    result["metrics"] = run_metrics.to_dict()
+    return result
+
+def run_manifest(manifest: Iterable[Dict], workers: int = MAX_WORKERS,
+                 memory_fraction: float = MEMORY_FRACTION, normalized: bool = False,
+                 write_index: bool = False, force: bool = False, dataset: bool = False,
+                 shard_workers: int = 1, spill_provider_map: bool = False,
+                 profile_stages: Collection[str] = ()) -> List[Dict]:
+    """
+    Process every changed manifest entry, optionally in a memory-aware process pool.
+
+    The manifest is consumed lazily, so it may be a followed append-only
+    manifest (see toc.utils.manifest.iter_manifest) that is still being
+    written: entries start as soon as they arrive.
+
+    Each entry is fingerprinted (HEAD for ETag/Last-Modified/size, plus the
+    manifest's last_updated) and looked up in the persistent RunState. Entries
+    already processed at the same fingerprint are reported as "unchanged"
+    without downloading anything; entries a previous run left unfinished are
+    picked up again. State is saved as each entry starts and finishes, so an
+    interrupted run resumes where it stopped.
+
+    With more than one worker, an entry is only started when its estimated
+    peak RSS (from past runs of the same URL, or from Content-Length and the
+    peak-RSS/size ratio of previous files) fits in the memory not already
+    reserved by running entries. Available memory is re-read before every
+    submission, so memory taken or freed by other processes is seen; the
+    workers' own resident memory is already missing from it, so only the
+    part of their reservations they have not yet used is subtracted. One
+    entry always runs even if it exceeds the budget. The peak RSS of every entry, sampled over that entry alone
+    (see utils.metrics), is recorded for the next run, in serial runs too.
+
+    Args:
+        manifest: Manifest entries to process (any iterable)
+        workers: Number of worker processes (1 runs serially in-process)
+        memory_fraction: Share of available memory the pool may reserve,
+            re-read before each submission
+        normalized: Passed through to process_url
+        write_index: Passed through to process_url
+        force: Reprocess every entry regardless of the run state
+        dataset: Passed through to process_url
+        shard_workers: Passed through to process_url (use with workers=1)
+        spill_provider_map: Passed through to process_url
+        profile_stages: Passed through to run_entry
+
+    Returns:
+        List of per-entry results as produced by run_entry, plus "unchanged"
+        results for entries that were not reprocessed
+    """
+    cache = MRFCache(CACHE_DIR)
+    state = RunState()
+    interrupted = set(state.interrupted())
+    results = []
+    fingerprints = {}
+    counts = {"seen": 0, "todo": 0, "resumed": 0}
+
+    def changed_entries() -> Iterator[Dict]:
+        for entry in manifest:
+            url = entry["location"]
+            counts["seen"] += 1
+            fingerprints[url] = fetch_fingerprint(url, entry, cache.session)
+            if not force and state.is_unchanged(url, fingerprints[url]):
+                results.append({"url": url, "status": "unchanged", "error": None, "peak_rss": None,
+                                "outputs": state.record(url)["outputs"]})
+                continue
+            counts["todo"] += 1
+            counts["resumed"] += normalize_location(url) in interrupted
+            yield entry
+
+    def log_counts() -> None:
+        logger.info(f"Processed {counts['todo']} of {counts['seen']} entries "
+                    f"({counts['resumed']} resumed after interruption)")
+
+    def finish(result: Dict) -> None:
+        if result["status"] == "ok":
+            # Merge the entry's rollup partial into the cube as soon as it is done; replaced
+            # partials only mark it stale, for one rebuild at the end of the run
+            try:
+                update_rollup(str(ROLLUP_DIR), Path(result["url"]).stem, defer_rebuild=True)
+            except Exception as e:
+                logger.error(f"Failed to update rate rollup for {result['url']}: {e}")
+        state.mark_finished(result["url"], fingerprints[result["url"]], result["status"],
+                            result.get("outputs"), result["error"])
+        results.append(result)
+
+    def finish_run() -> None:
+        history.save()
+        try:
+            refresh_rollup(str(ROLLUP_DIR))
+        except Exception as e:
+            logger.error(f"Failed to rebuild rate rollup: {e}")
+
+    history = MemoryHistory()
+
+    if workers <= 1:
+        try:
+            for entry in changed_entries():
+                url = entry["location"]
+                state.mark_running(url, fingerprints[url])
+                result = run_entry(url, entry, str(CACHE_DIR), normalized, write_index, dataset,
+                                   shard_workers, spill_provider_map, profile_stages)
+                if result["status"] == "ok" and result["peak_rss"]:
+                    meta = cache.lookup(url)
+                    history.record(url, result["peak_rss"],
+                                   meta["content_length"] if meta else fingerprints[url]["content_length"])
+                finish(result)
+        finally:
+            finish_run()
+        log_counts()
+        return results
+
+    logger.info(f"Running on {workers} workers with a "
+                f"{available_memory_bytes() * memory_fraction / 1024 ** 3:.1f} GiB memory budget")
+
+    entries = changed_entries()
+    pending = deque()
+    running = {}
+    sizing = {}  # url -> (content_length, estimated peak RSS)
+    reserved = 0
+
+    def headroom() -> int:
+        # Memory free for a new entry: the current budget less what running entries may still grow into
+        budget = int(available_memory_bytes() * memory_fraction)
+        return budget - max(reserved - children_rss_bytes(), 0)
+
+    pool = ProcessPoolExecutor(max_workers=workers, **POOL_OPTIONS)
+    try:
+        while True:
+            # Admit work while there are free workers and memory to reserve
+            while len(running) < workers:
+                if not pending:
+                    entry = next(entries, None)
+                    if entry is None:
+                        break
+                    pending.append(entry)
+                entry = pending[0]
+                url = entry["location"]
+                if url not in sizing:
+                    meta = cache.lookup(url)
+                    content_length = meta["content_length"] if meta else fingerprints[url]["content_length"]
+                    sizing[url] = (content_length, history.estimate(url, content_length))
+                estimate = sizing[url][1]
+                if running and estimate > headroom():
+                    break
+                pending.popleft()
+                state.mark_running(url, fingerprints[url])
+                try:
+                    future = pool.submit(run_entry, url, entry, str(CACHE_DIR), normalized, write_index, dataset,
+                                         shard_workers, spill_provider_map, profile_stages)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM-killed); start a fresh pool
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=workers, **POOL_OPTIONS)
+                    future = pool.submit(run_entry, url, entry, str(CACHE_DIR), normalized, write_index, dataset,
+                                         shard_workers, spill_provider_map, profile_stages)
+                running[future] = url
+                reserved += estimate
+
+            if not running:
+                break  # manifest exhausted and nothing left to run
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = running.pop(future)
+                content_length, estimate = sizing[url]
+                reserved -= estimate
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"url": url, "status": "failed", "error": f"{type(e).__name__}: {e}",
+                              "peak_rss": None, "outputs": []}
+                if result["status"] == "ok" and result["peak_rss"]:
+                    history.record(url, result["peak_rss"], content_length)
+                finish(result)
+    finally:
+        pool.shutdown(wait=True)
+        finish_run()
+
+    log_counts()
+    return results
+
+def report_results(results: List[Dict]) -> None:
+    """
+    Log a summary of a manifest run, listing every failed entry.
+    """
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("ok", "unchanged", "skipped", "failed")}
+    logger.info(f"Processed {len(results)} entries: {counts['ok']} ok, {counts['unchanged']} unchanged, "
+                f"{counts['skipped']} skipped, {counts['failed']} failed")
+    for result in results:
+        if result["status"] == "failed":
+            logger.error(f"Failed: {result['url']} - {result['error']}")
 
 def main():
     """
     Main entry point for processing data into relational format.
     """
+    parser = argparse.ArgumentParser(description="Process in-network MRFs into relational tables")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of worker processes")
+    parser.add_argument("--memory-fraction", type=float, default=MEMORY_FRACTION,
+                        help="Share of available memory the worker pool may reserve")
+    parser.add_argument("--normalized", action="store_true",
+                        help="Write provider_groups and group-keyed rates instead of one row per NPI")
+    parser.add_argument("--write-index", action="store_true",
+                        help="Record a billing-code byte index for each cached MRF")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocess every entry, even if unchanged since the last run")
+    parser.add_argument("--dataset", action="store_true",
+                        help="Write a Hive-partitioned Parquet dataset instead of flat files per URL")
+    parser.add_argument("--compact", action="store_true",
+                        help="Merge small files of the partitioned dataset after the run")
+    parser.add_argument("--shard-workers", type=int, default=1,
+                        help="Parse each large cached MRF in this many processes (flat output; use with --workers 1)")
+    parser.add_argument("--spill-provider-map", action="store_true",
+                        help="Keep provider maps in memory-mapped files instead of RAM (huge provider_references)")
+    parser.add_argument("--report", type=Path,
+                        default=REPORT_DIR / f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+                        help="Run report with per-URL, per-stage metrics (.json, or .parquet for one row per stage)")
+    parser.add_argument("--profile", nargs="+", default=[], metavar="STAGE",
+                        help="Sample stacks of these stages (e.g. scrape) into collapsed-stack files under REPORT_DIR")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_PATH,
+                        help="Manifest path (.json, .jsonl or .parquet directory)")
+    parser.add_argument("--follow", action="store_true",
+                        help="Process an append-only manifest while it is still being written")
+    args = parser.parse_args()
+
     try:
         # Read manifest if it exists
-        if MANIFEST_PATH.exists():
-            with open(MANIFEST_PATH) as f:
-                manifest = json.load(f)
+        if args.follow or args.manifest.exists():
+            if args.follow:
+                manifest = iter_manifest(args.manifest, follow=True)
+            else:
+                manifest = load_manifest(args.manifest)
                 
-            for entry in manifest:
-                url = entry["location"]
-                process_url(url, entry)
+            results = run_manifest(manifest, workers=args.workers, memory_fraction=args.memory_fraction,
+                                   normalized=args.normalized, write_index=args.write_index,
+                                   force=args.force, dataset=args.dataset, shard_workers=args.shard_workers,
+                                   spill_provider_map=args.spill_provider_map, profile_stages=args.profile)
+            report_results(results)
+            logger.info(f"Run report written to {metrics.write_report(results, args.report)}")
+            if args.compact:
+                removed = compact_relational_dataset(str(DATASET_DIR))
+                logger.info(f"Compaction removed {removed} small files")
                 
         else:
-            logger.warning(f"Manifest file not found: {MANIFEST_PATH}")
+            logger.warning(f"Manifest file not found: {args.manifest}")
             logger.info("Please provide a URL to process")
             
     except Exception as e:
@@ -157,4 +532,4 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,14 +1,22 @@
 """
 Script for analyzing the relational data outputs from the healthcare transparency data processing.
+
+Reports run as SQL in DuckDB directly over the Parquet files, across every
+processed file at once. DuckDB pushes projections and filters into the
+Parquet scans and runs multi-threaded; only the aggregated results are
+brought into pandas for printing.
 """
 
-import pandas as pd
-import pyarrow.parquet as pq
-from pathlib import Path
+import argparse
 import logging
-from typing import Dict, List
+from pathlib import Path
+from typing import List, Optional
+
+import duckdb
 import matplotlib.pyplot as plt
-import seaborn as sns
+import pandas as pd
+
+from .transformers.rollup import load_rollup, rollup_stats
 
 # Configure logging
 logging.basicConfig(
@@ -19,209 +27,386 @@ logger = logging.getLogger(__name__)
 
 # Constants
 DATA_DIR = Path("prod/data/processed/relational/")
+DATASET_DIR = DATA_DIR / "dataset"
+ROLLUP_DIR = DATA_DIR / "rollup"
+TABLE_NAMES = ["reporting_entities", "reporting_plans", "providers", "negotiated_rates", "provider_groups"]
+HISTOGRAM_BINS = 50
 
-def get_base_filename(file_path: Path) -> str:
+def _sql_path(path: Path) -> str:
+    return str(path).replace("\\", "/").replace("'", "''")
+
+class RelationalQueryEngine:
     """
-    Extract the base filename without the table suffix.
-    
+    DuckDB views over the relational Parquet outputs.
+
+    Every table is one view over all of its files: either the flat
+    `{prefix}_{table}.parquet` files or the Hive-partitioned dataset. Each
+    view has a `source` column (the file prefix) because provider_group_id is
+    only unique within one source file.
+
+    On top of the raw tables:
+        entities, plans: de-duplicated dimension rows (each file repeats them)
+        rate_providers: (source, plan_id, cpt_code, provider_id) per rate and
+            provider, resolving group-keyed rates through provider_groups
+
     Args:
-        file_path: Path to the parquet file
-        
-    Returns:
-        Base filename without table suffix
+        data_dir: Directory of the flat relational files
+        dataset: Read the partitioned dataset under `data_dir/dataset` instead
+        expand_provider_groups: Expose group-keyed rates as one row per provider
+        threads: DuckDB worker threads (DuckDB's default if not given)
     """
-    # Remove the last underscore and everything after it
-    return str(file_path.stem).rsplit('_', 1)[0]
 
-def load_tables(file_prefix: str) -> Dict[str, pd.DataFrame]:
-    """
-    Load all tables for a given file prefix.
-    
-    Args:
-        file_prefix: Prefix of the files to load
-        
-    Returns:
-        Dict of DataFrames for each table
-    """
-    tables = {}
-    for table_name in ["reporting_entities", "reporting_plans", "providers", "negotiated_rates"]:
-        file_path = DATA_DIR / f"{file_prefix}_{table_name}.parquet"
-        if file_path.exists():
-            tables[table_name] = pq.read_table(file_path).to_pandas()
-            logger.info(f"Loaded {table_name} with {len(tables[table_name])} rows")
+    def __init__(self, data_dir: Path = DATA_DIR, dataset: bool = False,
+                 expand_provider_groups: bool = False, threads: Optional[int] = None):
+        self.data_dir = Path(data_dir)
+        self.dataset = dataset
+        self.con = duckdb.connect()
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        self.tables = set()
+
+        for table_name in TABLE_NAMES:
+            scan = self._scan(table_name)
+            if scan:
+                self.con.execute(f"CREATE VIEW {table_name}_raw AS {scan}")
+                self.tables.add(table_name)
+            else:
+                logger.warning(f"No files found for {table_name}")
+
+        if "reporting_entities" in self.tables:
+            self.con.execute("""
+                CREATE VIEW entities AS
+                SELECT DISTINCT entity_id, reporting_entity_name, type, version, last_updated
+                FROM reporting_entities_raw
+            """)
+        if "reporting_plans" in self.tables:
+            self.con.execute("""
+                CREATE VIEW plans AS
+                SELECT DISTINCT plan_id, plan_name, entity_id, market_type FROM reporting_plans_raw
+            """)
+        if "providers" in self.tables:
+            self.con.execute("CREATE VIEW providers AS SELECT * FROM providers_raw")
+        if "provider_groups" in self.tables:
+            self.con.execute("CREATE VIEW provider_groups AS SELECT * FROM provider_groups_raw")
+        if "negotiated_rates" in self.tables:
+            self._create_rate_views(expand_provider_groups)
+
+    def _scan(self, table_name: str) -> Optional[str]:
+        """
+        SQL reading every file of one table, or None if there are none.
+        """
+        if self.dataset:
+            table_dir = self.data_dir / "dataset" / table_name
+            if not any(table_dir.rglob("*.parquet")):
+                return None
+            return (
+                f"SELECT * FROM read_parquet('{_sql_path(table_dir)}/**/*.parquet', "
+                f"hive_partitioning = true, hive_types_autocast = false, union_by_name = true)"
+            )
+
+        if not any(self.data_dir.glob(f"*_{table_name}.parquet")):
+            return None
+        pattern = _sql_path(self.data_dir / f"*_{table_name}.parquet")
+        return (
+            f"SELECT * EXCLUDE (filename), "
+            f"regexp_extract(filename, '([^/\\\\]+)_{table_name}\\.parquet$', 1) AS source "
+            f"FROM read_parquet('{pattern}', filename = true, union_by_name = true)"
+        )
+
+    def _columns(self, view: str) -> List[str]:
+        return [row[0] for row in self.con.execute(f"DESCRIBE {view}").fetchall()]
+
+    def _create_rate_views(self, expand_provider_groups: bool) -> None:
+        columns = self._columns("negotiated_rates_raw")
+        grouped = "provider_group_id" in columns and "provider_groups" in self.tables
+
+        # Rate x provider pairs; group-keyed rates resolve through provider_groups
+        parts = []
+        if "provider_id" in columns:
+            parts.append("""
+                SELECT source, plan_id, cpt_code, provider_id
+                FROM negotiated_rates_raw WHERE provider_id IS NOT NULL
+            """)
+        if grouped:
+            parts.append("""
+                SELECT r.source, r.plan_id, r.cpt_code, g.provider_id
+                FROM negotiated_rates_raw r
+                JOIN provider_groups_raw g
+                  ON r.source = g.source AND r.provider_group_id = g.provider_group_id
+            """)
+        if not parts:
+            parts.append("SELECT source, plan_id, cpt_code, NULL::BIGINT AS provider_id FROM negotiated_rates_raw WHERE false")
+        self.con.execute(f"CREATE VIEW rate_providers AS {' UNION ALL '.join(parts)}")
+
+        if expand_provider_groups and grouped:
+            # One row per provider: join group-keyed rates down to provider_id
+            if "provider_id" in columns:
+                select = "r.* EXCLUDE (provider_id), coalesce(r.provider_id, g.provider_id) AS provider_id"
+            else:
+                select = "r.*, g.provider_id"
+            self.con.execute(f"""
+                CREATE VIEW negotiated_rates AS
+                SELECT {select}
+                FROM negotiated_rates_raw r
+                LEFT JOIN provider_groups_raw g
+                  ON r.source = g.source AND r.provider_group_id = g.provider_group_id
+            """)
         else:
-            logger.warning(f"File not found: {file_path}")
-    return tables
+            self.con.execute("CREATE VIEW negotiated_rates AS SELECT * FROM negotiated_rates_raw")
+
+    def has(self, *table_names: str) -> bool:
+        return all(t in self.tables for t in table_names)
 
-def analyze_relationships(tables: Dict[str, pd.DataFrame]) -> None:
+    def query(self, sql: str, params: Optional[list] = None) -> pd.DataFrame:
+        return self.con.execute(sql, params or []).df()
+
+    def scalar(self, sql: str):
+        return self.con.execute(sql).fetchone()[0]
+
+def analyze_relationships(engine: RelationalQueryEngine) -> None:
     """
     Analyze relationships between tables.
-    
+
     Args:
-        tables: Dict of DataFrames containing all tables
+        engine: Query engine over the relational data
     """
-    if not all(table in tables for table in ["reporting_entities", "reporting_plans", "providers", "negotiated_rates"]):
+    if not engine.has("reporting_entities", "reporting_plans", "providers", "negotiated_rates"):
         logger.error("Missing required tables for relationship analysis")
         return
-        
-    entities = tables["reporting_entities"]
-    plans = tables["reporting_plans"]
-    providers = tables["providers"]
-    rates = tables["negotiated_rates"]
-    
+
     print("\nRelationship Analysis:")
-    
+
+    plan_stats = engine.query("""
+        WITH rate_counts AS (
+            SELECT plan_id, count(*) AS rates, count(DISTINCT cpt_code) AS cpt_codes
+            FROM negotiated_rates GROUP BY plan_id
+        ), provider_counts AS (
+            SELECT plan_id, count(DISTINCT provider_id) AS providers FROM rate_providers GROUP BY plan_id
+        )
+        SELECT e.entity_id, e.reporting_entity_name, p.plan_id, p.plan_name, p.market_type,
+               coalesce(r.rates, 0) AS rates, coalesce(pc.providers, 0) AS providers,
+               coalesce(r.cpt_codes, 0) AS cpt_codes
+        FROM (SELECT DISTINCT entity_id, reporting_entity_name FROM entities) e
+        LEFT JOIN plans p ON p.entity_id = e.entity_id
+        LEFT JOIN rate_counts r ON r.plan_id = p.plan_id
+        LEFT JOIN provider_counts pc ON pc.plan_id = p.plan_id
+        ORDER BY e.reporting_entity_name, p.plan_name
+    """)
+    cpt_by_plan = engine.query("""
+        SELECT plan_id, cpt_code, count(*) AS count, round(avg(negotiated_rate), 2) AS mean,
+               round(min(negotiated_rate), 2) AS min, round(max(negotiated_rate), 2) AS max
+        FROM negotiated_rates GROUP BY plan_id, cpt_code ORDER BY plan_id, cpt_code
+    """)
+
     # Entity to Plans
     print("\nEntity to Plans:")
-    for _, entity in entities.iterrows():
-        entity_plans = plans[plans["entity_id"] == entity["entity_id"]]
-        print(f"\nEntity: {entity['reporting_entity_name']}")
+    for (entity_id, entity_name), entity_plans in plan_stats.groupby(["entity_id", "reporting_entity_name"], sort=False):
+        entity_plans = entity_plans.dropna(subset=["plan_id"])
+        print(f"\nEntity: {entity_name}")
         print(f"Number of plans: {len(entity_plans)}")
-        for _, plan in entity_plans.iterrows():
-            print(f"- Plan: {plan['plan_name']} (Market: {plan['market_type']})")
-            
+        for plan in entity_plans.itertuples():
+            print(f"- Plan: {plan.plan_name} (Market: {plan.market_type})")
+
             # Plans to Rates
-            plan_rates = rates[rates["plan_id"] == plan["plan_id"]]
-            print(f"  Number of rates: {len(plan_rates):,}")
-            print(f"  Unique providers: {plan_rates['provider_id'].nunique():,}")
-            print(f"  Unique CPT codes: {plan_rates['cpt_code'].nunique():,}")
-            
+            print(f"  Number of rates: {plan.rates:,}")
+            print(f"  Unique providers: {plan.providers:,}")
+            print(f"  Unique CPT codes: {plan.cpt_codes:,}")
+
             # Average rates by CPT
-            if not plan_rates.empty:
-                avg_rates = plan_rates.groupby("cpt_code")["negotiated_rate"].agg([
-                    'count', 'mean', 'min', 'max'
-                ]).round(2)
+            avg_rates = cpt_by_plan[cpt_by_plan["plan_id"] == plan.plan_id]
+            if not avg_rates.empty:
                 print("\n  Average Rates by CPT:")
-                print(avg_rates)
-    
+                print(avg_rates.drop(columns="plan_id").set_index("cpt_code"))
+
     # Provider Coverage
     print("\nProvider Coverage:")
-    total_providers = len(providers)
-    providers_with_rates = rates["provider_id"].nunique()
+    total_providers = engine.scalar("SELECT count(DISTINCT provider_id) FROM providers")
+    providers_with_rates = engine.scalar("SELECT count(DISTINCT provider_id) FROM rate_providers")
     print(f"Total providers: {total_providers:,}")
     print(f"Providers with rates: {providers_with_rates:,}")
-    print(f"Coverage: {(providers_with_rates/total_providers*100):.1f}%")
-    
+    if total_providers:
+        print(f"Coverage: {(providers_with_rates/total_providers*100):.1f}%")
+
     # Rates by Entity
     print("\nRates by Entity:")
-    for _, entity in entities.iterrows():
-        entity_plans = plans[plans["entity_id"] == entity["entity_id"]]
-        entity_rates = rates[rates["plan_id"].isin(entity_plans["plan_id"])]
-        print(f"\nEntity: {entity['reporting_entity_name']}")
-        print(f"Total rates: {len(entity_rates):,}")
-        print(f"Average rate: ${entity_rates['negotiated_rate'].mean():.2f}")
-        print(f"Rate range: ${entity_rates['negotiated_rate'].min():.2f} - ${entity_rates['negotiated_rate'].max():.2f}")
+    entity_rates = engine.query("""
+        SELECT e.reporting_entity_name, count(r.negotiated_rate) AS rates,
+               avg(r.negotiated_rate) AS mean, min(r.negotiated_rate) AS min, max(r.negotiated_rate) AS max
+        FROM (SELECT DISTINCT entity_id, reporting_entity_name FROM entities) e
+        LEFT JOIN plans p ON p.entity_id = e.entity_id
+        LEFT JOIN negotiated_rates r ON r.plan_id = p.plan_id
+        GROUP BY e.reporting_entity_name ORDER BY e.reporting_entity_name
+    """)
+    for row in entity_rates.itertuples():
+        print(f"\nEntity: {row.reporting_entity_name}")
+        print(f"Total rates: {row.rates:,}")
+        print(f"Average rate: ${row.mean:.2f}")
+        print(f"Rate range: ${row.min:.2f} - ${row.max:.2f}")
 
-def analyze_rates(tables: Dict[str, pd.DataFrame]) -> None:
+def plot_rate_distribution(engine: RelationalQueryEngine, path: str = "rate_distribution.png") -> None:
+    """
+    Histogram of negotiated rates, binned in SQL so no rows are loaded.
+    """
+    low, high = engine.con.execute("SELECT min(negotiated_rate), max(negotiated_rate) FROM negotiated_rates").fetchone()
+    if low is None:
+        return
+    width = (high - low) / HISTOGRAM_BINS or 1.0
+    bins = engine.query(f"""
+        SELECT least(floor((negotiated_rate - {low}) / {width}), {HISTOGRAM_BINS - 1}) AS bin, count(*) AS count
+        FROM negotiated_rates GROUP BY bin ORDER BY bin
+    """)
+
+    plt.figure(figsize=(12, 6))
+    plt.bar(low + bins["bin"] * width, bins["count"], width=width, align="edge")
+    plt.title('Distribution of Negotiated Rates')
+    plt.xlabel('Rate ($)')
+    plt.ylabel('Count')
+    plt.savefig(path)
+    plt.close()
+
+def analyze_rates(engine: RelationalQueryEngine) -> None:
     """
     Analyze negotiated rates data.
-    
+
     Args:
-        tables: Dict of DataFrames containing all tables
+        engine: Query engine over the relational data
     """
-    if "negotiated_rates" not in tables:
+    if not engine.has("negotiated_rates"):
         logger.error("No negotiated rates data found")
         return
-        
-    rates = tables["negotiated_rates"]
-    
+
     # Basic statistics
+    total, cpt_codes = engine.con.execute(
+        "SELECT count(*), count(DISTINCT cpt_code) FROM negotiated_rates"
+    ).fetchone()
     print("\nNegotiated Rates Analysis:")
-    print(f"Total number of rates: {len(rates):,}")
-    print(f"Unique CPT codes: {rates['cpt_code'].nunique():,}")
-    print(f"Unique providers: {rates['provider_id'].nunique():,}")
-    
+    print(f"Total number of rates: {total:,}")
+    print(f"Unique CPT codes: {cpt_codes:,}")
+    print(f"Unique providers: {engine.scalar('SELECT count(DISTINCT provider_id) FROM rate_providers'):,}")
+
     # Rate statistics by CPT code
-    cpt_stats = rates.groupby('cpt_code')['negotiated_rate'].agg([
-        'count', 'mean', 'min', 'max', 'std'
-    ]).round(2)
+    cpt_stats = engine.query("""
+        SELECT cpt_code, count(*) AS count, round(avg(negotiated_rate), 2) AS mean,
+               round(min(negotiated_rate), 2) AS min, round(max(negotiated_rate), 2) AS max,
+               round(stddev_samp(negotiated_rate), 2) AS std
+        FROM negotiated_rates GROUP BY cpt_code ORDER BY cpt_code
+    """).set_index("cpt_code")
     print("\nRate Statistics by CPT Code:")
     print(cpt_stats)
-    
+
     # Distribution of rates
-    plt.figure(figsize=(12, 6))
-    sns.histplot(data=rates, x='negotiated_rate', bins=50)
-    plt.title('Distribution of Negotiated Rates')
-    plt.xlabel('Rate ($)')
-    plt.ylabel('Count')
-    plt.savefig('rate_distribution.png')
-    plt.close()
-    
+    plot_rate_distribution(engine)
+
     # Rates by place of service
-    pos_stats = rates.groupby('place_of_service')['negotiated_rate'].agg([
-        'count', 'mean', 'min', 'max'
-    ]).round(2)
+    pos_stats = engine.query("""
+        SELECT place_of_service, count(*) AS count, round(avg(negotiated_rate), 2) AS mean,
+               round(min(negotiated_rate), 2) AS min, round(max(negotiated_rate), 2) AS max
+        FROM negotiated_rates GROUP BY place_of_service ORDER BY place_of_service
+    """).set_index("place_of_service")
     print("\nRate Statistics by Place of Service:")
     print(pos_stats)
 
-def analyze_providers(tables: Dict[str, pd.DataFrame]) -> None:
+def analyze_rollup(rollup_dir: Path = ROLLUP_DIR) -> None:
+    """
+    Print rate statistics from the materialized rollup cube instead of raw rates.
+
+    Args:
+        rollup_dir: Directory of the rollup written during processing
+    """
+    rollup, sketch = load_rollup(str(rollup_dir))
+    if rollup.num_rows == 0:
+        logger.error(f"No rate rollup found in {rollup_dir}")
+        return
+
+    print("\nRate Rollup:")
+    print(f"Rollup keys (payer x CPT x POS x TIN): {rollup.num_rows:,}")
+    for by, title in ((["cpt_code"], "CPT Code"), (["place_of_service"], "Place of Service"),
+                      (["payer", "cpt_code"], "Payer and CPT Code")):
+        print(f"\nRate Statistics by {title}:")
+        print(rollup_stats(rollup, sketch, by).round(2))
+
+def analyze_providers(engine: RelationalQueryEngine) -> None:
     """
     Analyze provider data.
-    
+
     Args:
-        tables: Dict of DataFrames containing all tables
+        engine: Query engine over the relational data
     """
-    if "providers" not in tables:
+    if not engine.has("providers"):
         logger.error("No provider data found")
         return
-        
-    providers = tables["providers"]
-    
+
+    total, npis, tins = engine.con.execute(
+        "SELECT count(DISTINCT provider_id), count(DISTINCT npi), count(DISTINCT tin) FROM providers"
+    ).fetchone()
     print("\nProvider Analysis:")
-    print(f"Total number of providers: {len(providers):,}")
-    print(f"Unique NPIs: {providers['npi'].nunique():,}")
-    print(f"Unique TINs: {providers['tin'].nunique():,}")
-    
+    print(f"Total number of providers: {total:,}")
+    print(f"Unique NPIs: {npis:,}")
+    print(f"Unique TINs: {tins:,}")
+
     # Providers per TIN
-    providers_per_tin = providers.groupby('tin').size()
+    providers_per_tin = engine.query("""
+        WITH per_tin AS (SELECT tin, count(DISTINCT provider_id) AS n FROM providers GROUP BY tin)
+        SELECT count(*) AS count, avg(n) AS mean, stddev_samp(n) AS std, min(n) AS min,
+               quantile_cont(n, 0.25) AS "25%", quantile_cont(n, 0.5) AS "50%",
+               quantile_cont(n, 0.75) AS "75%", max(n) AS max
+        FROM per_tin
+    """).iloc[0]
     print("\nProviders per TIN:")
-    print(providers_per_tin.describe().round(2))
+    print(providers_per_tin.astype(float).round(2))
 
-def analyze_reporting_entities(tables: Dict[str, pd.DataFrame]) -> None:
+def analyze_reporting_entities(engine: RelationalQueryEngine) -> None:
     """
     Analyze reporting entity data.
-    
+
     Args:
-        tables: Dict of DataFrames containing all tables
+        engine: Query engine over the relational data
     """
-    if "reporting_entities" not in tables:
+    if not engine.has("reporting_entities"):
         logger.error("No reporting entity data found")
         return
-        
-    entities = tables["reporting_entities"]
-    
+
+    entities = engine.query("""
+        SELECT reporting_entity_name, type, version, max(last_updated) AS last_updated
+        FROM entities GROUP BY reporting_entity_name, type, version ORDER BY reporting_entity_name
+    """)
     print("\nReporting Entity Analysis:")
     print("Entities:")
-    for _, row in entities.iterrows():
-        print(f"- {row['reporting_entity_name']} ({row['type']})")
-        print(f"  Version: {row['version']}")
-        print(f"  Last Updated: {row['last_updated']}")
+    for row in entities.itertuples():
+        print(f"- {row.reporting_entity_name} ({row.type})")
+        print(f"  Version: {row.version}")
+        print(f"  Last Updated: {row.last_updated}")
 
 def main():
     """
     Main entry point for analysis.
     """
+    parser = argparse.ArgumentParser(description="Analyze relational transparency data")
+    parser.add_argument("--expand-provider-groups", action="store_true",
+                        help="Join group-keyed rates to one row per provider before analyzing")
+    parser.add_argument("--dataset", action="store_true",
+                        help=f"Read the partitioned dataset under {DATASET_DIR} instead of the flat files")
+    parser.add_argument("--threads", type=int, default=None, help="DuckDB worker threads")
+    parser.add_argument("--rollup", action="store_true",
+                        help=f"Only print rate statistics from the rollup cube in {ROLLUP_DIR}")
+    args = parser.parse_args()
+
     try:
-        # Get all unique file prefixes
-        file_prefixes = set()
-        for file in DATA_DIR.glob("*.parquet"):
-            base_name = get_base_filename(file)
-            file_prefixes.add(base_name)
-            
-        for prefix in sorted(file_prefixes):
-            print(f"\n{'='*50}")
-            print(f"Analyzing data for: {prefix}")
-            print(f"{'='*50}")
-            
-            tables = load_tables(prefix)
-            analyze_reporting_entities(tables)
-            analyze_providers(tables)
-            analyze_rates(tables)
-            analyze_relationships(tables)
-            
+        if args.rollup:
+            analyze_rollup()
+            return
+
+        engine = RelationalQueryEngine(DATA_DIR, dataset=args.dataset,
+                                       expand_provider_groups=args.expand_provider_groups,
+                                       threads=args.threads)
+        analyze_reporting_entities(engine)
+        analyze_providers(engine)
+        analyze_rates(engine)
+        analyze_relationships(engine)
+
     except Exception as e:
         logger.error(f"Failed to analyze data: {e}")
         raise
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
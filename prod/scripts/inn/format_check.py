@@ -1,43 +1,185 @@
 # prod/inn/format_check.py
+"""
+Recognize the layout of an in-network MRF from a bounded prefix of it.
 
-import requests, gzip, ijson
-from io import BytesIO, TextIOWrapper
+A format is known by the first parse event matching one of its signatures,
+so only the head of the document is read: a Range request for a remote
+file, or a local one up to the first match. open_detected reads
+the prefix from an opened stream and hands that same stream on to the
+scraper. New layouts are added with register_format and a scraper
+registered under the same name (see scrapers.register_scraper).
+"""
 
-def smart_open(source: str):
-    r = requests.get(source, stream=True)
-    print(f"📥 Status: {r.status_code}")
-    print(f"🔎 First 300 bytes:\n{r.content[:300].decode(errors='ignore')}")
+import io
+import logging
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
 
-    if b'<html' in r.content[:300].lower():
-        raise ValueError("URL returned HTML instead of JSON")
+import ijson
+import requests
 
-    content_stream = BytesIO(r.content)
-    if content_stream.read(2) == b'\x1f\x8b':  # GZIP magic
-        content_stream.seek(0)
-        return gzip.open(content_stream, 'rt', encoding='utf-8')
-    else:
-        content_stream.seek(0)
-        return TextIOWrapper(content_stream, encoding='utf-8')
+from .utils import metrics
+from .utils.cache import MRFCache
+from .utils.events import PARSE_BUF_SIZE
+from .utils.streaming import CHUNK_SIZE, GZIP_MAGIC, PrefixedReader, is_remote, open_mrf_stream
 
+logger = logging.getLogger(__name__)
+
+DETECT_PREFIX_BYTES = 8 * 1024 * 1024  # decompressed bytes a signature must appear within
+RANGE_BYTES = 1024 * 1024  # compressed bytes requested from a remote file
+REQUEST_TIMEOUT = (10, 60)  # (connect, read) seconds
+
+
+class FormatSignature(NamedTuple):
+    format: str
+    prefix: str  # ijson prefix of the telltale event
+    event: str
 
-def detect_format_from_url(url: str) -> str:
-    try:
-        f = smart_open(url)
-        parser = ijson.parse(f)
 
-        for prefix, event, value in parser:
-            # Look for telltale grouped-provider structure
-            if prefix.startswith("provider_references.item.provider_groups.item.npi.item") and event == "string":
-                return "grouped_by_provider_reference"
-            if prefix.startswith("in_network.item.negotiated_rates.item.provider_references") and event == "start_array":
-                return "grouped_by_provider_reference"
+FORMAT_SIGNATURES: List[FormatSignature] = [
+    # Top-level provider_references, with rates pointing at them by id
+    FormatSignature("grouped_by_provider_reference", "provider_references.item", "start_map"),
+    FormatSignature("grouped_by_provider_reference", "in_network.item.negotiated_rates.item.provider_references",
+                    "start_array"),
+    # Providers listed inline on every rate
+    FormatSignature("inline_provider_groups", "in_network.item.negotiated_rates.item.provider_groups",
+                    "start_array"),
+]
+
+
+def register_format(signature: FormatSignature) -> None:
+    """
+    Recognize another layout; signatures are tried in registration order at every event.
+    """
+    FORMAT_SIGNATURES.append(signature)
+
+
+def _match_format(events: Iterator) -> str:
+    try:
+        for prefix, event, _ in events:
+            for signature in FORMAT_SIGNATURES:
+                if event == signature.event and prefix == signature.prefix:
+                    return signature.format
 
             # Bail early for efficiency
-            if prefix.startswith("in_network.item") and event == "end_map":
+            if prefix == "in_network.item" and event == "end_map":
                 break
+    except ijson.JSONError:
+        pass  # the prefix ends mid-document
+    return "unknown"
+
+
+class _PrefixRecorder:
+    """
+    Reader handing out at most `limit` bytes of a stream and keeping a copy of them.
+    """
+
+    def __init__(self, stream: BinaryIO, limit: int):
+        self._stream = stream
+        self._limit = limit
+        self.taken = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        left = self._limit - len(self.taken)
+        data = self._stream.read(left if size < 0 else min(size, left)) if left > 0 else b""
+        self.taken += data
+        return data
+
+
+def detect_format_from_prefix(prefix: bytes) -> str:
+    """
+    Format of the document starting with `prefix` (decompressed), or "unknown".
 
+    The first event matching a signature decides. Detection gives up at the
+    end of the first in_network item or of the prefix, whichever comes first.
+    """
+    return _match_format(ijson.parse(io.BytesIO(prefix)))
+
+
+def detect_format_from_stream(f: BinaryIO, limit: int = DETECT_PREFIX_BYTES) -> Tuple[str, bytes]:
+    """
+    Detect the format of a decompressed stream, reading no more of it than needed (and at most `limit` bytes).
+
+    Returns:
+        The format (or "unknown") and the bytes taken from the stream
+    """
+    recorder = _PrefixRecorder(f, limit)
+    return _match_format(ijson.parse(recorder, buf_size=PARSE_BUF_SIZE)), bytes(recorder.taken)
+
+
+def _read_remote_prefix(url: str, limit: int, session: Optional[requests.Session] = None) -> bytes:
+    getter = session.get if session is not None else requests.get
+    headers = {"Range": f"bytes=0-{RANGE_BYTES - 1}"}
+    with getter(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code not in (200, 206):
+            raise Exception(f"❌ Failed to fetch MRF: {response.status_code}")
+        # A server that ignores Range answers 200 with the whole body; only its head is read
+        body = response.raw.read(RANGE_BYTES, decode_content=True)
+    metrics.count("bytes_downloaded", len(body))
+    if b'<html' in body[:300].lower():
+        raise ValueError("URL returned HTML instead of JSON")
+    if body[:2] == GZIP_MAGIC:
+        # A truncated gzip member decompresses up to where it was cut
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, limit)
+    return body[:limit]
+
+
+@metrics.timed("detect_format")
+def detect_format(source: str, cache: Optional[MRFCache] = None, limit: int = DETECT_PREFIX_BYTES) -> str:
+    """
+    Format of an MRF from a bounded prefix of it, or "unknown".
+
+    A remote file is sampled with a Range request for its first RANGE_BYTES;
+    a local one is read only until a signature matches.
+
+    Args:
+        source: URL or local path of a .json or .json.gz file
+        cache: Optional MRF cache; a cached copy of a URL is read instead of
+            the network, otherwise its session makes the Range request
+        limit: Decompressed bytes a signature must appear within
+
+    Raises:
+        Exception: If the file cannot be fetched or opened
+    """
+    if cache is not None and is_remote(source):
+        local = cache.cached_path(source)
+        if local is None:
+            return detect_format_from_prefix(_read_remote_prefix(source, limit, cache.session))
+        source = str(local)
+    if is_remote(source):
+        return detect_format_from_prefix(_read_remote_prefix(source, limit))
+    with open_mrf_stream(source) as f:
+        return detect_format_from_stream(f, limit)[0]
+
+
+def detect_format_from_url(url: str, cache: Optional[MRFCache] = None, limit: int = DETECT_PREFIX_BYTES) -> str:
+    """
+    detect_format, reporting failures as "unknown" instead of raising.
+    """
+    try:
+        return detect_format(url, cache, limit)
     except Exception as e:
-        print(f"⚠️ Format detection failed: {e}")
+        logger.warning(f"Format detection failed: {e}")
     return "unknown"
 
 
+@contextmanager
+def open_detected(source: str, limit: int = DETECT_PREFIX_BYTES,
+                  session: Optional[requests.Session] = None) -> Iterator[Tuple[str, io.BufferedReader]]:
+    """
+    Open an MRF once, detect its format from its head and keep the stream for scraping.
+
+    Args:
+        source: URL or local path of a .json or .json.gz file
+        limit: Decompressed bytes a signature must appear within
+        session: Optional requests session to reuse pooled connections
+
+    Yields:
+        (format, stream) where stream produces the decompressed document
+        from its first byte, the bytes read for detection included
+    """
+    with open_mrf_stream(source, session=session) as f:
+        with metrics.stage("detect_format"):
+            format_style, prefix = detect_format_from_stream(f, limit)
+        yield format_style, io.BufferedReader(PrefixedReader(prefix, f, name=str(source)), CHUNK_SIZE)
@@ -0,0 +1,34 @@
+"""
+Scrapers by MRF format, under the names format_check detects.
+
+A new layout is supported by registering a format signature
+(format_check.register_format) and a Scraper under the same name.
+"""
+
+from typing import Callable, Dict, NamedTuple, Optional
+
+from . import grouped_by_provider_reference, inline_provider_groups
+
+
+class Scraper(NamedTuple):
+    flat: Callable  # yields RecordBatches in FLAT_RATE_SCHEMA
+    normalized: Optional[Callable] = None  # returns provider_groups and group-keyed negotiated_rates tables
+    sharded: Optional[Callable] = None  # same output as flat, parsing one local file in several processes
+
+
+SCRAPERS: Dict[str, Scraper] = {}
+
+
+def register_scraper(format_name: str, scraper: Scraper) -> None:
+    SCRAPERS[format_name] = scraper
+
+
+register_scraper("grouped_by_provider_reference", Scraper(
+    flat=grouped_by_provider_reference.iter_mrf_batches,
+    normalized=grouped_by_provider_reference.stream_mrf_to_normalized_tables,
+    sharded=grouped_by_provider_reference.iter_mrf_batches_parallel,
+))
+register_scraper("inline_provider_groups", Scraper(
+    flat=inline_provider_groups.iter_mrf_batches,
+    normalized=inline_provider_groups.stream_mrf_to_normalized_tables,
+))
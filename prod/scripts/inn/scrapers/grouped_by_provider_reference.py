@@ -1,58 +1,446 @@
 # prod/inn/scrapers/grouped_by_provider_reference.py
 
-import requests, gzip, ijson, pyarrow as pa
-from io import BytesIO
-from tqdm import tqdm
+import logging
+import os
+import tempfile
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Collection, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from ..utils.billing_index import BillingIndexRecorder, iter_indexed_items
+from ..utils.disk_pool import DiskProviderPool
+from ..utils.columnar import (
+    FLAT_RATE_SCHEMA, GROUP_RATE_SCHEMA, GroupRateBatchBuilder, ProviderPool, RateBatchBuilder,
+)
+from ..utils import metrics
+from ..utils.events import iter_items, SECTION_END, Skipped
+from ..utils.remote_refs import RemoteReferences
+from ..utils.shards import Shard, ShardPlan, build_shard_plan, can_shard, open_section, open_shard
+from ..utils.spill import SpillBuffer
+from ..utils.streaming import is_remote, open_mrf_stream, open_seekable_stream
 
 CPT_CODES = {"99213", "73221", "72000", "72156"}
 BATCH_SIZE = 10000
+PENDING_SPILL_ITEMS = 50000  # unresolved rates kept in RAM before spilling to disk
+
+logger = logging.getLogger(__name__)
+
+REFS_PREFIX = "provider_references.item"
+IN_NETWORK_PREFIX = "in_network.item"
+
+def _tin_groups(ref: dict) -> list:
+    return [
+        (group.get("tin", {}).get("value", "unknown"), group.get("npi", []))
+        for group in ref.get("provider_groups", [])
+    ]
+
+@contextmanager
+def _remote_references(references: Optional[RemoteReferences] = None):
+    if references is not None:
+        yield references
+        return
+    with RemoteReferences() as references:
+        yield references
+
+def _add_reference(pool: ProviderPool, ref: dict, references: RemoteReferences, remote: list) -> None:
+    """
+    Add a provider_references entry to `pool`, or start fetching it if it only has a `location`.
+
+    Remote entries are queued on `remote` as (group id, future) and added by
+    _add_remote, so their downloads overlap with parsing the rest of the file.
+    """
+    if "provider_groups" not in ref and ref.get("location"):
+        remote.append((ref.get("provider_group_id"), references.submit(ref["location"])))
+    else:
+        pool.add_tin_groups(ref.get("provider_group_id"), _tin_groups(ref))
 
-def stream_mrf_to_table(url: str) -> pa.Table:
-    print(f"📥 Streaming MRF from: {url}")
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise Exception(f"❌ Failed to fetch MRF: {r.status_code}")
-    f = gzip.GzipFile(fileobj=BytesIO(r.content))
-
-    # Step 1: provider_references
-    f.seek(0)
-    provider_map = {}
-    refs = ijson.items(f, 'provider_references.item')
-    for ref in refs:
-        ref_id = ref.get("provider_group_id")
-        entries = []
-        for group in ref.get("provider_groups", []):
-            tin = group.get("tin", {}).get("value", "unknown")
-            for npi in group.get("npi", []):
-                entries.append((npi, tin))
-        provider_map[ref_id] = entries
-
-    # Step 2: in_network streaming
-    f.seek(0)
-    items = ijson.items(f, 'in_network.item')
-    batches, current = [], []
-
-    for item in tqdm(items, desc="CPT matches"):
-        code = item.get("billing_code")
-        if code not in CPT_CODES:
+def _add_remote(pool: ProviderPool, remote: list) -> None:
+    for group_id, future in remote:
+        groups = future.result()
+        if groups is None:
+            # Could not be fetched: leave the group unregistered, so its rates fall
+            # back to the unknown provider like any other unresolved reference
             continue
-        for rate in item.get("negotiated_rates", []):
-            for ref_id in rate.get("provider_references", []):
-                for npi, tin in provider_map.get(ref_id, [("unknown", "unknown")]):
-                    for price in rate.get("negotiated_prices", []):
-                        current.append({
-                            "cpt": code,
-                            "npi": npi,
-                            "tin": tin,
-                            "pos": price.get("place_of_service", "unknown"),
-                            "negotiated_rate": float(price.get("negotiated_rate") or 0.0),
-                        })
-
-        if len(current) >= BATCH_SIZE:
-            batches.append(pa.Table.from_pylist(current))
-            current = []
-
-    if current:
-        batches.append(pa.Table.from_pylist(current))
-
-    return pa.concat_tables(batches)
+        pool.add_tin_groups(group_id, _tin_groups({"provider_groups": groups}))
+    remote.clear()
+
+def _prices(rate: dict) -> list:
+    return [
+        (price.get("place_of_service", "unknown"), float(price.get("negotiated_rate") or 0.0))
+        for price in rate.get("negotiated_prices", [])
+    ]
+
+@contextmanager
+def _open_items(url: Union[str, BinaryIO], spool_path: Optional[str] = None, index_path: Optional[str] = None):
+    """
+    Yield the (prefix, item) stream of an MRF, filtered to CPT_CODES.
+
+    `url` may also be an already opened decompressed stream (e.g. from
+    format_check.open_detected), which is parsed as is. With `index_path`, the byte span and billing code of every in_network item
+    (matched or not) is recorded and the sidecar is written once the stream
+    has been read to the end.
+    """
+    # Drop non-target billing codes before their negotiated_rates are built
+    filters = {IN_NETWORK_PREFIX: ("billing_code", CPT_CODES)}
+    prefixes = (REFS_PREFIX, IN_NETWORK_PREFIX)
+
+    if hasattr(url, "read"):
+        if spool_path is not None or index_path is not None:
+            raise ValueError("Spooling and indexing need the URL or path of the MRF, not an open stream")
+        yield iter_items(url, prefixes, filters)
+        return
+
+    if index_path is None:
+        with open_mrf_stream(url, spool_path=spool_path) as f:
+            yield iter_items(f, prefixes, filters)
+        return
+
+    if is_remote(url):
+        raise ValueError("A billing-code index can only be built for a local (cached) file")
+    recorder = BillingIndexRecorder(url, index_path)
+
+    def recorded(items):
+        for prefix, item in items:
+            if prefix == IN_NETWORK_PREFIX and item is not SECTION_END:
+                recorder.record(item.value if isinstance(item, Skipped) else item.get("billing_code"))
+            yield prefix, item
+
+    with open_seekable_stream(url, build_checkpoints=True) as f:
+        f = recorder.wrap(f)
+        if metrics.active():
+            f = metrics.CountingReader(f, "bytes_decompressed")
+        yield recorded(iter_items(f, prefixes, filters))
+        recorder.write()
+
+@contextmanager
+def _provider_pool(spill_provider_map: bool = False, spill_dir: Optional[str] = None):
+    """
+    An empty provider map, in RAM or (spill_provider_map) in memory-mapped files under `spill_dir`.
+    """
+    if not spill_provider_map:
+        yield ProviderPool()
+        return
+    with DiskProviderPool(spill_dir) as pool:
+        yield pool
+
+def _iter_flat_batches(items: Iterator, codes, spill_dir: Optional[str] = None,
+                       pool: Optional[ProviderPool] = None, refs_complete: bool = False,
+                       references: Optional[RemoteReferences] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Explode the matching in_network items of an item stream into flat RecordBatches.
+
+    provider_references and in_network may come in either order. If rates
+    arrive before the references are complete, only the matched rates are
+    buffered (spilling to `spill_dir`) and resolved once the provider map is
+    known. References are added to `pool` (a new ProviderPool by default);
+    pass refs_complete=True when the pool is already fully built. References
+    given by `location` are fetched through `references` while parsing goes
+    on, and added before any rate is resolved.
+    """
+    pool = pool if pool is not None else ProviderPool()
+    builder = RateBatchBuilder(pool)
+    remote = []
+
+    def ready(force: bool = False):
+        return len(builder) >= BATCH_SIZE or (force and len(builder))
+
+    def flush() -> pa.RecordBatch:
+        batch = builder.flush()
+        metrics.count("rows_scraped", batch.num_rows)
+        return batch
+
+    scanned = matched = 0
+    with SpillBuffer(PENDING_SPILL_ITEMS, spill_dir) as pending, _remote_references(references) as references:
+        for prefix, item in items:
+            if prefix == REFS_PREFIX:
+                if item is SECTION_END:
+                    _add_remote(pool, remote)
+                    refs_complete = True
+                    # Resolve rates that were read before the references
+                    for code, ref_ids, prices in pending:
+                        builder.add_rate(code, ref_ids, prices)
+                        if ready():
+                            yield flush()
+                    pending.clear()
+                else:
+                    _add_reference(pool, item, references, remote)
+                continue
+
+            if item is SECTION_END:
+                continue
+            scanned += 1
+            if isinstance(item, Skipped):
+                continue
+            code = item.get("billing_code")
+            if code not in codes:
+                continue
+            matched += 1
+            for rate in item.get("negotiated_rates", []):
+                ref_ids = rate.get("provider_references", [])
+                if refs_complete:
+                    builder.add_rate(code, ref_ids, _prices(rate))
+                else:
+                    pending.append((code, ref_ids, _prices(rate)))
+            if ready():
+                yield flush()
+        metrics.count("items_scanned", scanned)
+        metrics.count("items_matched", matched)
+
+        # No provider_references section at all: whatever is pending resolves to unknown
+        for code, ref_ids, prices in pending:
+            builder.add_rate(code, ref_ids, prices)
+            if ready():
+                yield flush()
+
+    if ready(force=True):
+        yield flush()
+
+@metrics.timed("scrape")
+def iter_mrf_batches(url: Union[str, BinaryIO], spool_path: Optional[str] = None, spill_dir: Optional[str] = None,
+                     index_path: Optional[str] = None, spill_provider_map: bool = False,
+                     references: Optional[RemoteReferences] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Stream an MRF once and yield matching CPT rates as flat RecordBatches.
+
+    provider_references and in_network are read from the same event stream in
+    whichever order the file uses. Rows are produced by RateBatchBuilder as
+    typed column buffers rather than one dict per (rate, provider, price), and
+    handed out as soon as BATCH_SIZE rows are ready, so memory is bounded by
+    the batch size rather than by the number of matched rates.
+
+    Args:
+        url: URL or local path of the MRF, or its opened decompressed stream
+        spool_path: Optional path to keep a copy of the compressed file
+        spill_dir: Directory for spilled unresolved rates (system temp by default)
+        index_path: Optional billing-code index sidecar to write (local files
+            only), see extract_codes_from_index
+        spill_provider_map: Keep the provider map in memory-mapped files
+            under `spill_dir` (DiskProviderPool) instead of RAM, for
+            provider_references larger than memory
+        references: Cache for provider_references given by `location`
+            (a RemoteReferences on DEFAULT_REFS_DIR by default)
+
+    Yields:
+        RecordBatches in FLAT_RATE_SCHEMA
+    """
+    logger.info(f"Streaming MRF from: {getattr(url, 'name', url)}")
+    with _open_items(url, spool_path=spool_path, index_path=index_path) as items, \
+            _provider_pool(spill_provider_map, spill_dir) as pool:
+        yield from _iter_flat_batches(items, CPT_CODES, spill_dir, pool=pool, references=references)
+
+def stream_mrf_to_table(url: Union[str, BinaryIO], spool_path: Optional[str] = None, spill_dir: Optional[str] = None,
+                        index_path: Optional[str] = None, spill_provider_map: bool = False,
+                        references: Optional[RemoteReferences] = None) -> pa.Table:
+    """
+    Collect iter_mrf_batches into one flat table.
+
+    Args:
+        url: URL or local path of the MRF, or its opened decompressed stream
+        spool_path: Optional path to keep a copy of the compressed file
+        spill_dir: Directory for spilled unresolved rates (system temp by default)
+        index_path: Optional billing-code index sidecar to write (local files only)
+        spill_provider_map: Keep the provider map on disk, see iter_mrf_batches
+        references: Cache for remote provider_references, see iter_mrf_batches
+    """
+    batches = list(iter_mrf_batches(url, spool_path=spool_path, spill_dir=spill_dir, index_path=index_path,
+                                    spill_provider_map=spill_provider_map, references=references))
+    return pa.Table.from_batches(batches, schema=FLAT_RATE_SCHEMA)
+
+# Per-process state of shard workers, set once by _init_shard_worker
+_SHARD_STATE: Dict = {}
+
+def _init_shard_worker(plan: ShardPlan, pool: ProviderPool, codes: Collection[str]) -> None:
+    _SHARD_STATE.update(plan=plan, pool=pool, codes=codes)
+
+def _scrape_shard(shard: Shard, out_path: str) -> Tuple[int, Dict[str, int]]:
+    """
+    Explode one shard of in_network items into an Arrow IPC file.
+
+    Returns:
+        Number of rows written and the shard's metrics counters
+    """
+    plan, pool, codes = _SHARD_STATE["plan"], _SHARD_STATE["pool"], _SHARD_STATE["codes"]
+    filters = {IN_NETWORK_PREFIX: ("billing_code", codes)}
+    rows = 0
+    with metrics.track(out_path) as shard_metrics, open_shard(plan, shard) as f, \
+            pa.OSFile(out_path, "wb") as sink, pa.ipc.new_file(sink, FLAT_RATE_SCHEMA) as writer:
+        items = iter_items(f, (IN_NETWORK_PREFIX,), filters)
+        for batch in _iter_flat_batches(items, codes, pool=pool, refs_complete=True):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows, shard_metrics.totals()
+
+def _load_provider_pool(plan: ShardPlan, pool: ProviderPool,
+                        references: Optional[RemoteReferences] = None) -> ProviderPool:
+    remote = []
+    with open_section(plan, "provider_references") as f, _remote_references(references) as references:
+        if f is not None:
+            for _, ref in iter_items(f, (REFS_PREFIX,)):
+                if ref is not SECTION_END:
+                    _add_reference(pool, ref, references, remote)
+        _add_remote(pool, remote)
+    # Trim buffers before the pool is shipped to the workers (a DiskProviderPool
+    # ships only its file paths, and the workers map the same files)
+    return pool.freeze()
+
+@metrics.timed("scrape")
+def iter_mrf_batches_parallel(url: str, workers: int = os.cpu_count() or 1, plan_path: Optional[str] = None,
+                              spill_dir: Optional[str] = None, shard_dir: Optional[str] = None,
+                              index_path: Optional[str] = None, spill_provider_map: bool = False,
+                              references: Optional[RemoteReferences] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Scrape one large local MRF on several cores, yielding what iter_mrf_batches would.
+
+    A sequential pass (build_shard_plan) records gzip checkpoints and the
+    byte spans of the in_network items and splits them into shards. The
+    parent then parses provider_references once and a process pool parses
+    the shards, each seeking straight to its bytes. Shard outputs are spooled
+    as Arrow IPC files under `shard_dir` and yielded in file order, so rows
+    come out in the same order as the sequential scraper.
+
+    Falls back to iter_mrf_batches for remote sources, a single worker, a
+    billing-index request, files too small to split, or gzip files without
+    indexed_gzip (which could only be "seeked" by decompressing from the start).
+
+    Args:
+        url: Local path of the MRF (normally the cached copy)
+        workers: Processes parsing shards
+        plan_path: Optional shard plan sidecar; reused if it matches the file,
+            written otherwise, so a re-run skips the scanning pass
+        spill_dir: Passed to iter_mrf_batches when falling back
+        shard_dir: Directory for shard outputs (system temp by default)
+        index_path: Passed to iter_mrf_batches; requesting an index disables sharding
+        spill_provider_map: Keep the provider map in memory-mapped files
+            under `spill_dir`, shared by all workers through the page cache
+        references: Cache for remote provider_references, see iter_mrf_batches
+
+    Yields:
+        RecordBatches in FLAT_RATE_SCHEMA
+    """
+    if workers <= 1 or is_remote(url) or index_path is not None or not can_shard(url):
+        yield from iter_mrf_batches(url, spill_dir=spill_dir, index_path=index_path,
+                                    spill_provider_map=spill_provider_map, references=references)
+        return
+
+    with tempfile.TemporaryDirectory(dir=shard_dir) as tmp:
+        plan = None
+        if plan_path and os.path.exists(plan_path):
+            plan = ShardPlan.load(plan_path)
+            if plan.source != str(url) or plan.source_size != os.path.getsize(url) \
+                    or (plan.checkpoints and not os.path.exists(plan.checkpoints)):
+                plan = None
+        if plan is None:
+            logger.info(f"Indexing MRF for parallel parsing: {url}")
+            checkpoints = Path(plan_path).with_suffix(".gzidx") if plan_path else Path(tmp) / "checkpoints.gzidx"
+            if plan_path:
+                Path(plan_path).parent.mkdir(parents=True, exist_ok=True)
+            plan = build_shard_plan(url, checkpoints, workers)
+            if plan_path:
+                plan.save(plan_path)
+
+        if len(plan.shards) <= 1:
+            yield from iter_mrf_batches(url, spill_dir=spill_dir, spill_provider_map=spill_provider_map,
+                                        references=references)
+            return
+
+        logger.info(f"Parsing MRF in {len(plan.shards)} shards on {workers} workers: {url}")
+        with _provider_pool(spill_provider_map, spill_dir) as pool, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                    initargs=(plan, _load_provider_pool(plan, pool, references), CPT_CODES)) as executor:
+            paths = [os.path.join(tmp, f"shard-{i:05d}.arrow") for i in range(len(plan.shards))]
+            futures = [executor.submit(_scrape_shard, shard, path) for shard, path in zip(plan.shards, paths)]
+            for future, path in zip(futures, paths):
+                _, counters = future.result()
+                metrics.add_totals(counters)
+                with pa.OSFile(path, "rb") as source:
+                    reader = pa.ipc.open_file(source)
+                    for i in range(reader.num_record_batches):
+                        yield reader.get_batch(i)
+                os.remove(path)
+
+def extract_codes_from_index(source: str, index_path: str, codes: Iterable[str]) -> pa.Table:
+    """
+    Extract rates for new billing codes from a cached MRF via its index sidecar.
+
+    Only provider_references and the byte ranges of the requested codes are
+    decompressed and parsed, instead of the whole file.
+
+    Args:
+        source: Local path of the cached MRF the index was built from
+        index_path: Sidecar written by stream_mrf_to_table(index_path=...)
+        codes: Billing codes to extract
+
+    Returns:
+        Table in FLAT_RATE_SCHEMA, as stream_mrf_to_table would produce for `codes`
+    """
+    codes = set(codes)
+    logger.info(f"Extracting {len(codes)} billing codes from: {source}")
+    batches = list(_iter_flat_batches(iter_indexed_items(source, index_path, codes), codes))
+    return pa.Table.from_batches(batches, schema=FLAT_RATE_SCHEMA)
+
+@metrics.timed("scrape")
+def stream_mrf_to_normalized_tables(url: Union[str, BinaryIO], spool_path: Optional[str] = None,
+                                    index_path: Optional[str] = None, spill_dir: Optional[str] = None,
+                                    spill_provider_map: bool = False,
+                                    references: Optional[RemoteReferences] = None) -> Dict[str, pa.Table]:
+    """
+    Stream an MRF once and emit rates keyed by provider group instead of by NPI.
+
+    A rate that references a 5,000-NPI group produces one row per price rather
+    than 5,000. Because rates only carry the group id, the sections can be
+    read in any order without buffering.
+
+    Args:
+        url: URL or local path of the MRF, or its opened decompressed stream
+        spool_path: Optional path to keep a copy of the compressed file
+        index_path: Optional billing-code index sidecar to write (local files only)
+        spill_dir: Directory for the on-disk provider map (system temp by default)
+        spill_provider_map: Build the provider map in memory-mapped files
+            instead of RAM; only the final provider_groups table is materialized
+        references: Cache for remote provider_references, see iter_mrf_batches
+
+    Returns:
+        Dict with "provider_groups" (provider_group_id, npi, tin) and
+        "negotiated_rates" (cpt, provider_group_id, pos, negotiated_rate)
+    """
+    logger.info(f"Streaming MRF (normalized) from: {getattr(url, 'name', url)}")
+    builder = GroupRateBatchBuilder()
+    batches = []
+    remote = []
+    scanned = matched = 0
+
+    with _provider_pool(spill_provider_map, spill_dir) as pool, _remote_references(references) as references, \
+            _open_items(url, spool_path=spool_path, index_path=index_path) as items:
+        for prefix, item in items:
+            if item is SECTION_END:
+                continue
+            if prefix == REFS_PREFIX:
+                _add_reference(pool, item, references, remote)
+                continue
+
+            scanned += 1
+            if isinstance(item, Skipped):
+                continue
+            code = item.get("billing_code")
+            if code not in CPT_CODES:
+                continue
+            matched += 1
+            for rate in item.get("negotiated_rates", []):
+                builder.add_rate(code, rate.get("provider_references", []), _prices(rate))
+            if len(builder) >= BATCH_SIZE:
+                batches.append(builder.flush())
+        _add_remote(pool, remote)
+        provider_groups = pool.to_table()
+
+    if len(builder):
+        batches.append(builder.flush())
+    metrics.count("items_scanned", scanned)
+    metrics.count("items_matched", matched)
+    metrics.count("rows_scraped", sum(batch.num_rows for batch in batches))
+
+    return {
+        "provider_groups": provider_groups,
+        "negotiated_rates": pa.Table.from_batches(batches, schema=GROUP_RATE_SCHEMA),
+    }
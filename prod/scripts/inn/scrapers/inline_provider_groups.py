@@ -0,0 +1,153 @@
+# prod/inn/scrapers/inline_provider_groups.py
+"""
+Scraper for MRFs that list providers inline on every negotiated rate.
+
+Instead of pointing at a top-level provider_references section by id, each
+rate carries its own provider_groups ([{"npi": [...], "tin": {...}}, ...]).
+Nothing has to wait for another section, so the file is exploded in one
+pass and memory is bounded by the batch size.
+"""
+
+import hashlib
+import json
+import logging
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple, Union
+
+import pyarrow as pa
+
+from ..utils import metrics
+from ..utils.columnar import GROUP_RATE_SCHEMA, GroupRateBatchBuilder, ProviderPool, RateBatchBuilder
+from ..utils.events import SECTION_END, Skipped
+from ..utils.remote_refs import RemoteReferences
+from .grouped_by_provider_reference import (
+    BATCH_SIZE, CPT_CODES, IN_NETWORK_PREFIX, _open_items, _prices, _provider_pool, _tin_groups,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_matched_rates(items: Iterator) -> Iterator[Tuple[str, dict]]:
+    """
+    (billing code, rate) for every negotiated rate of the in_network items in CPT_CODES.
+
+    Rates that point at provider_references instead of listing their
+    providers are skipped with a warning; grouped_by_provider_reference
+    reads those.
+    """
+    scanned = matched = by_reference = 0
+    for prefix, item in items:
+        if prefix != IN_NETWORK_PREFIX or item is SECTION_END:
+            continue
+        scanned += 1
+        if isinstance(item, Skipped):
+            continue
+        code = item.get("billing_code")
+        if code not in CPT_CODES:
+            continue
+        matched += 1
+        for rate in item.get("negotiated_rates", []):
+            if "provider_groups" not in rate and rate.get("provider_references"):
+                by_reference += 1
+                continue
+            yield code, rate
+    metrics.count("items_scanned", scanned)
+    metrics.count("items_matched", matched)
+    if by_reference:
+        logger.warning(f"Skipped {by_reference} rates given by provider_references in an inline provider_groups file")
+
+
+@metrics.timed("scrape")
+def iter_mrf_batches(url: Union[str, BinaryIO], spool_path: Optional[str] = None, spill_dir: Optional[str] = None,
+                     index_path: Optional[str] = None, spill_provider_map: bool = False,
+                     references: Optional[RemoteReferences] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Stream an MRF once and yield matching CPT rates as flat RecordBatches.
+
+    Each rate's provider_groups are added to a provider pool that lives only
+    as long as the batch, and rows are produced by the same RateBatchBuilder
+    as grouped_by_provider_reference, so both layouts give identical rows
+    for the same providers and prices.
+
+    Args:
+        url: URL or local path of the MRF, or its opened decompressed stream
+        spool_path: Optional path to keep a copy of the compressed file
+        spill_dir: Unused; nothing is buffered (same interface as grouped_by_provider_reference)
+        index_path: Optional billing-code index sidecar to write (local files only)
+        spill_provider_map: Unused; the per-batch pool is small
+        references: Unused; there are no provider_references to fetch
+
+    Yields:
+        RecordBatches in FLAT_RATE_SCHEMA
+    """
+    logger.info(f"Streaming MRF (inline provider groups) from: {getattr(url, 'name', url)}")
+    builder = RateBatchBuilder(ProviderPool())
+    with _open_items(url, spool_path=spool_path, index_path=index_path) as items:
+        for code, rate in _iter_matched_rates(items):
+            group_id = len(builder.codes)  # unique within the batch
+            builder.pool.add_tin_groups(group_id, _tin_groups(rate))
+            builder.add_rate(code, [group_id], _prices(rate))
+            if len(builder) >= BATCH_SIZE:
+                batch = builder.flush()
+                metrics.count("rows_scraped", batch.num_rows)
+                yield batch
+                builder = RateBatchBuilder(ProviderPool())
+    if len(builder):
+        batch = builder.flush()
+        metrics.count("rows_scraped", batch.num_rows)
+        yield batch
+
+
+def _group_key(rate: dict) -> int:
+    # Same providers give the same provider_group_id, in every rate and every file
+    groups = json.dumps(_tin_groups(rate), separators=(",", ":"), default=str)
+    return int.from_bytes(hashlib.blake2b(groups.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+@metrics.timed("scrape")
+def stream_mrf_to_normalized_tables(url: Union[str, BinaryIO], spool_path: Optional[str] = None,
+                                    index_path: Optional[str] = None, spill_dir: Optional[str] = None,
+                                    spill_provider_map: bool = False,
+                                    references: Optional[RemoteReferences] = None) -> Dict[str, pa.Table]:
+    """
+    Stream an MRF once and emit rates keyed by provider group instead of by NPI.
+
+    Inline groups have no id, so each distinct provider list gets one from a
+    hash of its contents and is stored once however many rates repeat it.
+
+    Args:
+        url: URL or local path of the MRF, or its opened decompressed stream
+        spool_path: Optional path to keep a copy of the compressed file
+        index_path: Optional billing-code index sidecar to write (local files only)
+        spill_dir: Directory for the on-disk provider map (system temp by default)
+        spill_provider_map: Build the provider map in memory-mapped files instead of RAM
+        references: Unused; there are no provider_references to fetch
+
+    Returns:
+        Dict with "provider_groups" (provider_group_id, npi, tin) and
+        "negotiated_rates" (cpt, provider_group_id, pos, negotiated_rate)
+    """
+    logger.info(f"Streaming MRF (inline provider groups, normalized) from: {getattr(url, 'name', url)}")
+    builder = GroupRateBatchBuilder()
+    batches = []
+    seen = set()
+
+    with _provider_pool(spill_provider_map, spill_dir) as pool, \
+            _open_items(url, spool_path=spool_path, index_path=index_path) as items:
+        for code, rate in _iter_matched_rates(items):
+            group_id = _group_key(rate)
+            if group_id not in seen:
+                seen.add(group_id)
+                pool.add_tin_groups(group_id, _tin_groups(rate))
+            builder.add_rate(code, [group_id], _prices(rate))
+            if len(builder) >= BATCH_SIZE:
+                batches.append(builder.flush())
+        provider_groups = pool.to_table()
+
+    if len(builder):
+        batches.append(builder.flush())
+    metrics.count("rows_scraped", sum(batch.num_rows for batch in batches))
+
+    return {
+        "provider_groups": provider_groups,
+        "negotiated_rates": pa.Table.from_batches(batches, schema=GROUP_RATE_SCHEMA),
+    }
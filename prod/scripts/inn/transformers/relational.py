@@ -3,17 +3,69 @@ Transformers for converting healthcare transparency data into relational format.
 """
 
 import logging
+import os
+import re
 import uuid
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
 from pyarrow import Table
 
+from ..utils import metrics
+from ..utils.keys import KeyCounts, hash_columns, hash_key, occurrence_index
+
 logger = logging.getLogger(__name__)
 
+def entity_key(entity_name: str) -> int:
+    """
+    Deterministic entity_id for a reporting entity.
+    """
+    return hash_key("entity", entity_name)
+
+def plan_key(entity_id: int, plan_name: str, market_type: str) -> int:
+    """
+    Deterministic plan_id for a plan of a reporting entity.
+    """
+    return hash_key("plan", entity_id, plan_name, market_type)
+
+PROVIDER_SCHEMA = pa.schema([
+    ("npi", pa.int64()),
+    ("tin", pa.string()),
+    ("provider_id", pa.int64()),
+])
+
+PROVIDER_GROUP_LINK_SCHEMA = pa.schema([
+    ("provider_group_id", pa.int64()),
+    ("provider_id", pa.int64()),
+])
+
+FLAT_RATES_SCHEMA = pa.schema([
+    ("cpt_code", pa.string()),
+    ("npi", pa.int64()),
+    ("tin", pa.string()),
+    ("place_of_service", pa.string()),
+    ("negotiated_rate", pa.float64()),
+    ("provider_id", pa.int64()),
+    ("plan_id", pa.int64()),
+    ("rate_id", pa.int64()),
+])
+
+GROUP_RATES_SCHEMA = pa.schema([
+    ("cpt_code", pa.string()),
+    ("provider_group_id", pa.int64()),
+    ("place_of_service", pa.string()),
+    ("negotiated_rate", pa.float64()),
+    ("plan_id", pa.int64()),
+    ("rate_id", pa.int64()),
+])
+
 def extract_entity_info(url: str, entity_name: str) -> Dict:
     """
     Extract entity details from URL and metadata.
@@ -26,8 +78,8 @@ def extract_entity_info(url: str, entity_name: str) -> Dict:
         Dict containing entity information
     """
     try:
-        # Generate a unique ID for the entity
-        entity_id = str(uuid.uuid4())
+        # Same entity name, same id across files and runs
+        entity_id = entity_key(entity_name)
         
         # Extract version from URL if possible
         version = "unknown"
@@ -40,77 +92,238 @@ def extract_entity_info(url: str, entity_name: str) -> Dict:
             "entity_id": entity_id,
             "reporting_entity_name": entity_name,
             "type": "health_plan",  # Default type
-            "last_updated": pd.Timestamp.now().isoformat(),
+            "last_updated": datetime.now().isoformat(),
             "version": version
         }
     except Exception as e:
         logger.error(f"Failed to extract entity info: {e}")
         raise
 
-def transform_to_relational(data: Table, url: str, entity_name: str) -> Dict[str, Table]:
+class RelationalSplitter:
+    """
+    Splits scraper output into the provider dimension and keyed rate rows, one batch at a time.
+
+    Only the provider dimension (one row per distinct npi/tin) is kept across
+    batches; every input batch maps to exactly one output batch, so a caller
+    streaming batches never holds more than one batch of rates.
+
+    rate_id is a primary key: an MRF may list the same (cpt, provider, pos,
+    rate) more than once (e.g. under different billing code types or
+    arrangements the scraper drops). The first occurrence of a natural key is
+    keyed by its hash alone; the n-th repeat hashes in n, counted within that
+    natural key only, so adding or removing other rates leaves an id unchanged.
+    The counts of every natural key seen are kept for the whole file.
+
+    Args:
+        plan_id: plan_id stamped on every rate
+    """
+
+    def __init__(self, plan_id: int):
+        self.plan_id = plan_id
+        self._seen = KeyCounts()  # provider ids already in the dimension
+        self._providers: List[pa.RecordBatch] = []
+        self._rate_counts = KeyCounts()
+
+    def _provider_ids(self, npis: pa.Array, tins: pa.Array) -> pa.Array:
+        """
+        provider_id per row; providers not seen before are added to the dimension.
+        """
+        ids = hash_columns([npis, tins], "provider")
+        unique, first = np.unique(ids, return_index=True)
+        # Membership is a binary search per distinct id, not a pass over the whole dimension
+        new = self._seen.get(unique) == 0
+        if new.any():
+            rows = pa.array(first[new])
+            self._providers.append(pa.RecordBatch.from_arrays(
+                [npis.take(rows), tins.take(rows), pa.array(unique[new])], schema=PROVIDER_SCHEMA
+            ))
+            self._seen.add(unique[new])
+        return pa.array(ids)
+
+    def _rate_keys(self, n: int, cpt: pa.Array, provider: pa.Array, pos: pa.Array,
+                   rate: pa.Array) -> Tuple[pa.Array, pa.Array]:
+        plan_ids = pa.array(np.full(n, self.plan_id, dtype=np.int64))
+        natural = hash_columns([plan_ids, cpt, provider, pos, rate], "rate")
+        occurrence = occurrence_index(natural, self._rate_counts)
+        repeat = occurrence > 0
+        rate_ids = natural.copy()
+        if repeat.any():
+            rate_ids[repeat] = hash_columns([natural[repeat], occurrence[repeat]], "rate_repeat")
+        return plan_ids, pa.array(rate_ids)
+
+    def split_flat(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        """
+        Key a batch of flat (cpt, npi, tin, pos, negotiated_rate) rows.
+
+        Returns:
+            RecordBatch in FLAT_RATES_SCHEMA
+        """
+        cpt, npi, tin, pos, rate = (batch.column(name) for name in ("cpt", "npi", "tin", "pos", "negotiated_rate"))
+        provider_ids = self._provider_ids(npi, tin)
+        plan_ids, rate_ids = self._rate_keys(batch.num_rows, cpt, provider_ids, pos, rate)
+        return pa.RecordBatch.from_arrays(
+            [cpt, npi, tin, pos, rate, provider_ids, plan_ids, rate_ids], schema=FLAT_RATES_SCHEMA
+        )
+
+    def split_provider_groups(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        """
+        Map (provider_group_id, npi, tin) membership rows to provider ids.
+
+        Returns:
+            RecordBatch in PROVIDER_GROUP_LINK_SCHEMA
+        """
+        provider_ids = self._provider_ids(batch.column("npi"), batch.column("tin"))
+        return pa.RecordBatch.from_arrays(
+            [batch.column("provider_group_id"), provider_ids], schema=PROVIDER_GROUP_LINK_SCHEMA
+        )
+
+    def split_group_rates(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        """
+        Key a batch of group-keyed (cpt, provider_group_id, pos, negotiated_rate) rows.
+
+        Returns:
+            RecordBatch in GROUP_RATES_SCHEMA
+        """
+        cpt, group, pos, rate = (batch.column(name) for name in ("cpt", "provider_group_id", "pos", "negotiated_rate"))
+        plan_ids, rate_ids = self._rate_keys(batch.num_rows, cpt, group, pos, rate)
+        return pa.RecordBatch.from_arrays([cpt, group, pos, rate, plan_ids, rate_ids], schema=GROUP_RATES_SCHEMA)
+
+    def providers(self) -> Table:
+        """
+        Provider dimension accumulated so far, in PROVIDER_SCHEMA.
+        """
+        return pa.Table.from_batches(self._providers, schema=PROVIDER_SCHEMA)
+
+def relational_header(url: str, entity_name: str) -> Tuple[Dict[str, Table], RelationalSplitter]:
+    """
+    Build the reporting_entities/reporting_plans tables for a file and a splitter for its rates.
+
+    Args:
+        url: Source URL
+        entity_name: Name of the reporting entity
+
+    Returns:
+        Tuple of (dict with the two small tables, splitter keyed to the plan)
+    """
+    entity_info = extract_entity_info(url, entity_name)
+    entity_id = entity_info["entity_id"]
+
+    # For now, create a single plan with info from URL
+    plan_name = Path(url).stem
+    plan_id = plan_key(entity_id, plan_name, "unknown")
+    reporting_plans = [{
+        "plan_id": plan_id,
+        "plan_name": plan_name,
+        "entity_id": entity_id,
+        "market_type": "unknown"  # Could be extracted from URL/description
+    }]
+    tables = {
+        "reporting_entities": pa.Table.from_pylist([entity_info]),
+        "reporting_plans": pa.Table.from_pylist(reporting_plans),
+    }
+    return tables, RelationalSplitter(plan_id)
+
+@metrics.timed("transform")
+def transform_to_relational(data, url: str, entity_name: str) -> Dict[str, Table]:
     """
     Convert flat data to 4 relational tables.
+
+    Runs on Arrow batches directly: each input batch is keyed and split by a
+    RelationalSplitter, with no pandas conversion, drop_duplicates or merge.
     
     Args:
-        data: Input PyArrow table with flat data
+        data: Input PyArrow table with flat data, or the dict of
+            "provider_groups" and "negotiated_rates" tables produced by a
+            normalized scraper
         url: Source URL
         entity_name: Name of the reporting entity
         
     Returns:
-        Dict containing 4 relational tables
+        Dict containing 4 relational tables (5 for normalized input, which
+        adds provider_groups and keys negotiated_rates by provider_group_id)
     """
     try:
-        # Extract entity info
-        entity_info = extract_entity_info(url, entity_name)
-        entity_id = entity_info["entity_id"]
-        
-        # Convert to pandas for easier manipulation
-        df = data.to_pandas()
-        
-        # Create reporting_entities table
-        reporting_entities = pd.DataFrame([entity_info])
-        
-        # Create reporting_plans table
-        # For now, create a single plan with info from URL
-        plan_id = str(uuid.uuid4())
-        reporting_plans = pd.DataFrame([{
-            "plan_id": plan_id,
-            "plan_name": Path(url).stem,
-            "entity_id": entity_id,
-            "market_type": "unknown"  # Could be extracted from URL/description
-        }])
-        
-        # Create providers table
-        providers = df[["npi", "tin"]].drop_duplicates()
-        providers["provider_id"] = [str(uuid.uuid4()) for _ in range(len(providers))]
-        
-        # Create negotiated_rates table
-        negotiated_rates = df.merge(
-            providers[["npi", "tin", "provider_id"]],
-            on=["npi", "tin"]
-        )
-        negotiated_rates = negotiated_rates.rename(columns={
-            "cpt": "cpt_code",
-            "pos": "place_of_service"
-        })
-        negotiated_rates["rate_id"] = [str(uuid.uuid4()) for _ in range(len(negotiated_rates))]
-        negotiated_rates["plan_id"] = plan_id
-        
-        # Convert all to PyArrow tables
-        tables = {
-            "reporting_entities": pa.Table.from_pandas(reporting_entities),
-            "reporting_plans": pa.Table.from_pandas(reporting_plans),
-            "providers": pa.Table.from_pandas(providers),
-            "negotiated_rates": pa.Table.from_pandas(negotiated_rates)
-        }
-        
+        tables, splitter = relational_header(url, entity_name)
+
+        provider_groups = None
+        if isinstance(data, dict):
+            provider_groups = pa.Table.from_batches(
+                [splitter.split_provider_groups(b) for b in data["provider_groups"].to_batches()],
+                schema=PROVIDER_GROUP_LINK_SCHEMA,
+            )
+            rates = pa.Table.from_batches(
+                [splitter.split_group_rates(b) for b in data["negotiated_rates"].to_batches()],
+                schema=GROUP_RATES_SCHEMA,
+            )
+        else:
+            rates = pa.Table.from_batches(
+                [splitter.split_flat(b) for b in data.to_batches()], schema=FLAT_RATES_SCHEMA
+            )
+
+        tables["providers"] = splitter.providers()
+        tables["negotiated_rates"] = rates
+        if provider_groups is not None:
+            tables["provider_groups"] = provider_groups
         return tables
         
     except Exception as e:
         logger.error(f"Failed to transform to relational format: {e}")
         raise
 
-def save_relational_tables(tables: Dict[str, Table], output_dir: str, file_prefix: str, format: str = "parquet") -> None:
+@metrics.timed("save")
+def stream_relational_tables(batches: Iterable[pa.RecordBatch], url: str, entity_name: str, output_dir: str,
+                             file_prefix: str, extra_tables: Optional[Dict[str, Table]] = None) -> List[str]:
+    """
+    Split flat rate batches into relational tables while writing them.
+
+    negotiated_rates is written batch by batch with a ParquetWriter as the
+    batches arrive, so only one batch of rates plus the provider dimension is
+    in memory at a time. The small tables are written at the end with
+    save_relational_tables.
+
+    Args:
+        batches: Flat (cpt, npi, tin, pos, negotiated_rate) RecordBatches
+        url: Source URL
+        entity_name: Name of the reporting entity
+        output_dir: Directory to save files
+        file_prefix: Prefix for output files
+        extra_tables: Tables that replace the generated ones of the same name
+            (e.g. reporting_entities/reporting_plans built from a manifest)
+
+    Returns:
+        Paths of the written files
+    """
+    try:
+        tables, splitter = relational_header(url, entity_name)
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        rates_path = output_path / f"{file_prefix}_negotiated_rates.parquet"
+        tmp_path = rates_path.with_name(f"{rates_path.name}.{os.getpid()}.tmp")
+
+        rows = 0
+        try:
+            with pq.ParquetWriter(tmp_path, FLAT_RATES_SCHEMA) as writer:
+                for batch in batches:
+                    with metrics.stage("transform"):
+                        split = splitter.split_flat(batch)
+                    writer.write_batch(split)
+                    rows += batch.num_rows
+            os.replace(tmp_path, rates_path)
+            metrics.count("rows_emitted", rows)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        logger.info(f"Saved negotiated_rates ({rows} rows) to {rates_path}")
+
+        tables["providers"] = splitter.providers()
+        tables.update(extra_tables or {})
+        return save_relational_tables(tables, output_dir, file_prefix) + [str(rates_path)]
+
+    except Exception as e:
+        logger.error(f"Failed to stream relational tables: {e}")
+        raise
+
+@metrics.timed("save")
+def save_relational_tables(tables: Dict[str, Table], output_dir: str, file_prefix: str, format: str = "parquet") -> List[str]:
     """
     Save relational tables to disk.
     
@@ -119,10 +332,14 @@ def save_relational_tables(tables: Dict[str, Table], output_dir: str, file_prefi
         output_dir: Directory to save files
         file_prefix: Prefix for output files
         format: Output format ("parquet" or "csv")
+
+    Returns:
+        Paths of the written files
     """
     try:
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
+        written = []
         
         for table_name, table in tables.items():
             file_path = output_path / f"{file_prefix}_{table_name}"
@@ -144,7 +361,179 @@ def save_relational_tables(tables: Dict[str, Table], output_dir: str, file_prefi
                 raise ValueError(f"Unsupported format: {format}")
                 
             logger.info(f"Saved {table_name} to {file_path}.{format}")
+            metrics.count("rows_emitted", len(table))
+            written.append(f"{file_path}.{format.lower()}")
+
+        return written
             
     except Exception as e:
         logger.error(f"Failed to save relational tables: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Hive-partitioned dataset output
+DATASET_PARTITIONS = ["reporting_entity", "release_month"]
+TABLE_PARTITIONS = {"negotiated_rates": DATASET_PARTITIONS + ["cpt_code"]}
+TABLE_SORT_KEYS = {
+    "negotiated_rates": ["cpt_code", "tin", "npi", "place_of_service", "negotiated_rate"],
+    "providers": ["tin", "npi"],
+    "provider_groups": ["provider_group_id", "provider_id"],
+}
+DICTIONARY_COLUMNS = ["npi", "tin", "cpt_code", "place_of_service", "source"]
+ROW_GROUP_ROWS = 512 * 1024
+MAX_FILE_ROWS = 8 * 1024 * 1024
+COMPACT_FILE_BYTES = 64 * 1024 ** 2  # files below this are merged by compact_relational_dataset
+COMPRESSION = "zstd"
+COMPACTED_PREFIX = "compacted-"
+
+def _parquet_options(schema: pa.Schema) -> ds.FileWriteOptions:
+    return ds.ParquetFileFormat().make_write_options(
+        compression=COMPRESSION,
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in schema.names],
+        write_statistics=True,
+    )
+
+def _sorted(table_name: str, table: Table) -> Table:
+    keys = [k for k in TABLE_SORT_KEYS.get(table_name, []) if k in table.column_names]
+    return table.sort_by([(k, "ascending") for k in keys]) if keys else table
+
+def _remove_source(table_dir: Path, source: str) -> None:
+    """
+    Drop everything a previous run wrote for `source` under one table directory.
+
+    The source's own files are deleted; compacted files that contain rows of
+    the source are rewritten without them.
+    """
+    # Exactly the basename_template of save_relational_dataset; a bare prefix
+    # test would also match sources such as "{source}-2"
+    own_file = re.compile(rf"{re.escape(source)}-\d+\.parquet")
+    for path in table_dir.rglob("*.parquet"):
+        if own_file.fullmatch(path.name):
+            path.unlink()
+        elif path.name.startswith(COMPACTED_PREFIX):
+            sources = pq.read_table(path, columns=["source"]).column("source")
+            keep = pc.not_equal(sources, source)
+            if pc.all(keep).as_py():
+                continue
+            remaining = pq.read_table(path).filter(keep)
+            if remaining.num_rows:
+                tmp = path.with_name(f"{path.name}.tmp")
+                pq.write_table(remaining, tmp, compression=COMPRESSION,
+                               use_dictionary=[c for c in DICTIONARY_COLUMNS if c in remaining.column_names])
+                os.replace(tmp, path)
+            else:
+                path.unlink()
+
+@metrics.timed("save")
+def save_relational_dataset(tables: Dict[str, Table], output_dir: str, file_prefix: str,
+                            entity_name: str, release_month: str) -> List[str]:
+    """
+    Write relational tables into a Hive-partitioned Parquet dataset.
+
+    Each table becomes `<output_dir>/<table>/reporting_entity=.../release_month=.../`
+    (negotiated_rates adds `cpt_code=...`), so a query for one code or one
+    payer only opens the matching directories. Files are zstd-compressed,
+    dictionary-encode npi/tin/cpt/pos, and hold rows sorted by the table's
+    sort key in large row groups, which keeps the per-row-group min/max
+    statistics selective. Every row carries a `source` column (the file
+    prefix), so re-processing a URL replaces exactly its previous rows.
+
+    Args:
+        tables: Dict of PyArrow tables to save
+        output_dir: Root directory of the dataset
+        file_prefix: Source file prefix, also used to name the written files
+        entity_name: Reporting entity partition value
+        release_month: Release month partition value (YYYY-MM)
+
+    Returns:
+        Partition directories written to
+    """
+    try:
+        root = Path(output_dir)
+        written = set()
+
+        for table_name, table in tables.items():
+            table_dir = root / table_name
+            if table_dir.exists():
+                _remove_source(table_dir, file_prefix)
+            if table.num_rows == 0:
+                continue
+
+            n = table.num_rows
+            metrics.count("rows_emitted", n)
+            table = _sorted(table_name, table)
+            table = table.append_column("source", pa.array([file_prefix] * n, pa.string()).dictionary_encode())
+            for column, value in (("reporting_entity", entity_name), ("release_month", release_month)):
+                if column not in table.column_names:
+                    table = table.append_column(column, pa.array([value] * n, pa.string()))
+
+            partition_cols = TABLE_PARTITIONS.get(table_name, DATASET_PARTITIONS)
+            partitioning = ds.partitioning(
+                pa.schema([table.schema.field(c) for c in partition_cols]), flavor="hive"
+            )
+            file_schema = pa.schema([f for f in table.schema if f.name not in partition_cols])
+
+            def visit(written_file):
+                written.add(str(Path(written_file.path).parent))
+
+            ds.write_dataset(
+                table,
+                table_dir,
+                format="parquet",
+                partitioning=partitioning,
+                basename_template=f"{file_prefix}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=_parquet_options(file_schema),
+                min_rows_per_group=min(ROW_GROUP_ROWS, n),
+                max_rows_per_group=ROW_GROUP_ROWS,
+                max_rows_per_file=MAX_FILE_ROWS,
+                file_visitor=visit,
+            )
+            logger.info(f"Saved {table_name} ({n} rows) to dataset {table_dir}")
+
+        return sorted(written)
+
+    except Exception as e:
+        logger.error(f"Failed to save relational dataset: {e}")
+        raise
+
+def compact_relational_dataset(output_dir: str, small_file_bytes: int = COMPACT_FILE_BYTES) -> int:
+    """
+    Merge small Parquet files that share a partition directory.
+
+    Many sources contribute only a few rows per (entity, month, cpt) partition;
+    merging them keeps file counts and per-file overhead down for readers.
+
+    Args:
+        output_dir: Root directory of the dataset
+        small_file_bytes: Files below this size are candidates for merging
+
+    Returns:
+        Number of files removed by merging
+    """
+    removed = 0
+    for directory in sorted({p.parent for p in Path(output_dir).rglob("*.parquet")}):
+        small = sorted(p for p in directory.glob("*.parquet") if p.stat().st_size < small_file_bytes)
+        if len(small) < 2:
+            continue
+        table_name = directory.relative_to(output_dir).parts[0]
+        merged = _sorted(table_name, pa.concat_tables([pq.read_table(p) for p in small], promote_options="default"))
+        target = directory / f"{COMPACTED_PREFIX}{uuid.uuid4().hex}.parquet"
+        tmp = target.with_name(f"{target.name}.tmp")
+        pq.write_table(merged, tmp, compression=COMPRESSION, row_group_size=ROW_GROUP_ROWS,
+                       use_dictionary=[c for c in DICTIONARY_COLUMNS if c in merged.column_names])
+        os.replace(tmp, target)
+        for path in small:
+            path.unlink()
+        removed += len(small) - 1
+        logger.info(f"Compacted {len(small)} files in {directory}")
+    return removed
+
+def open_relational_dataset(output_dir: str, table_name: str) -> ds.Dataset:
+    """
+    Open one table of the partitioned dataset with string-typed partition columns.
+
+    Without an explicit schema, Arrow would infer e.g. cpt_code as an integer.
+    """
+    partition_cols = TABLE_PARTITIONS.get(table_name, DATASET_PARTITIONS)
+    partitioning = ds.partitioning(pa.schema([(c, pa.string()) for c in partition_cols]), flavor="hive")
+    return ds.dataset(Path(output_dir) / table_name, format="parquet", partitioning=partitioning)
@@ -0,0 +1,315 @@
+"""
+Materialized negotiated-rate rollup by payer x CPT x place of service x TIN.
+
+Every processed file contributes a partial aggregate that can be merged with
+any other partial:
+
+    rate_rollup: count, sum, sum_sq, min, max of negotiated_rate per key
+    rate_sketch: a log-bucketed quantile sketch per key (bucket, count)
+
+count/mean/min/max/std follow from the first table; percentiles come from the
+sketch, whose buckets are spaced so any estimate is within
+RELATIVE_ACCURACY of a true rate. Partials are kept per source file under
+`partials/`, and the merged cube next to them is updated as each file
+finishes: a new source is merged in directly, a re-processed source needs a
+rebuild from the partials (min/max cannot be subtracted). A run refreshing
+many sources defers that rebuild: the cube is marked stale and rebuilt once
+by `refresh_rollup` at the end, instead of once per re-processed source.
+"""
+
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import Table
+
+from ..utils import metrics
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEYS = ["payer", "cpt_code", "place_of_service", "tin"]
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+ZERO_BUCKET = np.iinfo(np.int32).min  # rates <= 0
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+ROLLUP_SCHEMA = pa.schema(
+    [(k, pa.string()) for k in ROLLUP_KEYS] + [
+        ("count", pa.int64()),
+        ("sum", pa.float64()),
+        ("sum_sq", pa.float64()),
+        ("min", pa.float64()),
+        ("max", pa.float64()),
+    ]
+)
+
+SKETCH_SCHEMA = pa.schema(
+    [(k, pa.string()) for k in ROLLUP_KEYS] + [
+        ("bucket", pa.int32()),
+        ("count", pa.int64()),
+    ]
+)
+
+ROLLUP_FILE = "rate_rollup.parquet"
+SKETCH_FILE = "rate_sketch.parquet"
+STATE_FILE = "rollup_state.json"
+
+def _buckets(rates: np.ndarray) -> np.ndarray:
+    buckets = np.full(len(rates), ZERO_BUCKET, dtype=np.int32)
+    positive = rates > 0
+    buckets[positive] = np.ceil(np.log(rates[positive]) / math.log(GAMMA)).astype(np.int32)
+    return buckets
+
+def _bucket_values(buckets: np.ndarray) -> np.ndarray:
+    values = 2 * np.power(GAMMA, buckets.astype(np.float64)) / (GAMMA + 1)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+def merge_partials(rollups: Sequence[Table], sketches: Sequence[Table]) -> Tuple[Table, Table]:
+    """
+    Merge partial rollups and sketches into one of each.
+    """
+    rollup = pa.concat_tables([r.select(ROLLUP_SCHEMA.names) for r in rollups] or [ROLLUP_SCHEMA.empty_table()])
+    rollup = rollup.group_by(ROLLUP_KEYS).aggregate([
+        ("count", "sum"), ("sum", "sum"), ("sum_sq", "sum"), ("min", "min"), ("max", "max"),
+    ]).rename_columns(ROLLUP_KEYS + ["count", "sum", "sum_sq", "min", "max"])
+
+    sketch = pa.concat_tables([s.select(SKETCH_SCHEMA.names) for s in sketches] or [SKETCH_SCHEMA.empty_table()])
+    sketch = sketch.group_by(ROLLUP_KEYS + ["bucket"]).aggregate([("count", "sum")]) \
+        .rename_columns(ROLLUP_KEYS + ["bucket", "count"])
+    return rollup.cast(ROLLUP_SCHEMA), sketch.cast(SKETCH_SCHEMA)
+
+class RateRollup:
+    """
+    Accumulates the rollup partial of one source file, batch by batch.
+
+    Args:
+        payer: Reporting entity the rates belong to
+    """
+
+    def __init__(self, payer: str):
+        self.payer = payer
+        self._rollups: List[Table] = []
+        self._sketches: List[Table] = []
+
+    def add(self, cpt: pa.Array, pos: pa.Array, tin: pa.Array, rate: pa.Array,
+            weight: Optional[np.ndarray] = None) -> None:
+        """
+        Add rates; `weight` counts a row as that many rates (e.g. providers of a group).
+        """
+        n = len(rate)
+        if n == 0:
+            return
+        values = pc.fill_null(rate, 0.0).to_numpy(zero_copy_only=False).astype(np.float64)
+        weights = np.ones(n, dtype=np.int64) if weight is None else np.asarray(weight, dtype=np.int64)
+        table = pa.table({
+            "payer": pa.array([self.payer] * n, pa.string()),
+            "cpt_code": cpt, "place_of_service": pos, "tin": tin,
+            "w": weights, "wx": values * weights, "wxx": values * values * weights,
+            "x": values, "bucket": _buckets(values),
+        })
+        rollup = table.group_by(ROLLUP_KEYS).aggregate([
+            ("w", "sum"), ("wx", "sum"), ("wxx", "sum"), ("x", "min"), ("x", "max"),
+        ]).rename_columns(ROLLUP_KEYS + ["count", "sum", "sum_sq", "min", "max"])
+        sketch = table.group_by(ROLLUP_KEYS + ["bucket"]).aggregate([("w", "sum")]) \
+            .rename_columns(ROLLUP_KEYS + ["bucket", "count"])
+        self._rollups.append(rollup)
+        self._sketches.append(sketch)
+
+        # Keep the partial small while streaming: fold the per-batch pieces together
+        if len(self._rollups) >= 64:
+            rollup, sketch = merge_partials(self._rollups, self._sketches)
+            self._rollups, self._sketches = [rollup], [sketch]
+
+    @metrics.timed("rollup")
+    def add_flat(self, batch) -> None:
+        """
+        Add a flat rate batch/table (scraper or negotiated_rates column names).
+        """
+        names = batch.schema.names
+        cpt = "cpt_code" if "cpt_code" in names else "cpt"
+        pos = "place_of_service" if "place_of_service" in names else "pos"
+        self.add(batch.column(cpt), batch.column(pos), batch.column("tin"), batch.column("negotiated_rate"))
+
+    @metrics.timed("rollup")
+    def add_group_rates(self, rates: Table, provider_groups: Table) -> None:
+        """
+        Add group-keyed rates, weighting each by the group's providers per TIN.
+
+        Args:
+            rates: (cpt, provider_group_id, pos, negotiated_rate) rows
+            provider_groups: (provider_group_id, npi, tin) membership rows
+        """
+        group_tins = provider_groups.group_by(["provider_group_id", "tin"]).aggregate([([], "count_all")]) \
+            .rename_columns(["provider_group_id", "tin", "providers"])
+        names = rates.schema.names
+        cpt = "cpt_code" if "cpt_code" in names else "cpt"
+        pos = "place_of_service" if "place_of_service" in names else "pos"
+        for batch in rates.select([cpt, "provider_group_id", pos, "negotiated_rate"]).to_batches():
+            joined = pa.Table.from_batches([batch]).join(group_tins, "provider_group_id")
+            self.add(joined.column(cpt), joined.column(pos), joined.column("tin"),
+                     joined.column("negotiated_rate"), joined.column("providers").to_numpy())
+
+    @metrics.timed("rollup")
+    def observe(self, batches: Iterator[pa.RecordBatch]) -> Iterator[pa.RecordBatch]:
+        """
+        Pass flat batches through unchanged while adding them to the rollup.
+        """
+        for batch in batches:
+            self.add_flat(batch)
+            yield batch
+
+    def tables(self) -> Tuple[Table, Table]:
+        return merge_partials(self._rollups, self._sketches)
+
+    @metrics.timed("rollup")
+    def write(self, rollup_dir: str, source: str) -> List[str]:
+        """
+        Persist this source's partial under `<rollup_dir>/partials/`.
+
+        Returns:
+            Paths of the written files
+        """
+        rollup, sketch = self.tables()
+        partial_dir = Path(rollup_dir) / "partials"
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for table, suffix in ((rollup, "rollup"), (sketch, "sketch")):
+            path = partial_dir / f"{source}.{suffix}.parquet"
+            _atomic_write_table(table, path)
+            paths.append(str(path))
+        logger.info(f"Saved rate rollup partial for {source} ({rollup.num_rows} keys)")
+        return paths
+
+def _atomic_write_table(table: Table, path: Path) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+
+def _read(path: Path, schema: pa.Schema) -> Table:
+    return pq.read_table(path) if path.exists() else schema.empty_table()
+
+def _read_state(root: Path) -> Dict:
+    state_path = root / STATE_FILE
+    return json.loads(state_path.read_text()) if state_path.exists() else {"sources": []}
+
+def update_rollup(rollup_dir: str, source: str, defer_rebuild: bool = False) -> None:
+    """
+    Fold one source's freshly written partial into the merged cube.
+
+    A source merged for the first time is combined with the current cube
+    directly; if the source had been merged before, its old contribution
+    cannot be subtracted, so the cube is rebuilt from all partials.
+
+    Args:
+        rollup_dir: Directory holding the cube and `partials/`
+        source: Source file prefix whose partial was just written
+        defer_rebuild: Instead of rebuilding, mark the cube stale for a
+            later `refresh_rollup`
+    """
+    root = Path(rollup_dir)
+    state_path = root / STATE_FILE
+    state = _read_state(root)
+
+    if source in state["sources"]:
+        if defer_rebuild:
+            state["stale"] = True
+            _write_state(state_path, state)
+        else:
+            rebuild_rollup(rollup_dir)
+        return
+
+    partial_dir = root / "partials"
+    rollup, sketch = merge_partials(
+        [_read(root / ROLLUP_FILE, ROLLUP_SCHEMA), _read(partial_dir / f"{source}.rollup.parquet", ROLLUP_SCHEMA)],
+        [_read(root / SKETCH_FILE, SKETCH_SCHEMA), _read(partial_dir / f"{source}.sketch.parquet", SKETCH_SCHEMA)],
+    )
+    _atomic_write_table(rollup, root / ROLLUP_FILE)
+    _atomic_write_table(sketch, root / SKETCH_FILE)
+    state["sources"].append(source)
+    _write_state(state_path, state)
+
+def rebuild_rollup(rollup_dir: str) -> None:
+    """
+    Rebuild the merged cube from every partial under `<rollup_dir>/partials/`.
+    """
+    root = Path(rollup_dir)
+    partial_dir = root / "partials"
+    rollup_paths = sorted(partial_dir.glob("*.rollup.parquet"))
+    sources = [p.name[:-len(".rollup.parquet")] for p in rollup_paths]
+    rollup, sketch = merge_partials(
+        [pq.read_table(p) for p in rollup_paths],
+        [_read(partial_dir / f"{s}.sketch.parquet", SKETCH_SCHEMA) for s in sources],
+    )
+    root.mkdir(parents=True, exist_ok=True)
+    _atomic_write_table(rollup, root / ROLLUP_FILE)
+    _atomic_write_table(sketch, root / SKETCH_FILE)
+    _write_state(root / STATE_FILE, {"sources": sources})
+    logger.info(f"Rebuilt rate rollup from {len(sources)} partials")
+
+def refresh_rollup(rollup_dir: str) -> bool:
+    """
+    Rebuild the merged cube if a deferred update left it stale.
+
+    Returns:
+        True if the cube was rebuilt
+    """
+    if not _read_state(Path(rollup_dir)).get("stale"):
+        return False
+    rebuild_rollup(rollup_dir)
+    return True
+
+def _write_state(path: Path, state: Dict) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, path)
+
+def load_rollup(rollup_dir: str) -> Tuple[Table, Table]:
+    root = Path(rollup_dir)
+    if _read_state(root).get("stale"):
+        logger.warning(f"Rate rollup in {rollup_dir} still counts replaced partials; run refresh_rollup")
+    return _read(root / ROLLUP_FILE, ROLLUP_SCHEMA), _read(root / SKETCH_FILE, SKETCH_SCHEMA)
+
+def rollup_stats(rollup: Table, sketch: Table, by: Sequence[str],
+                 quantiles: Sequence[float] = DEFAULT_QUANTILES) -> pd.DataFrame:
+    """
+    count/mean/min/max/std and percentiles of negotiated_rate grouped by `by`.
+
+    Args:
+        rollup: Merged rollup table
+        sketch: Merged sketch table
+        by: Subset of ROLLUP_KEYS to group by
+        quantiles: Percentiles to estimate from the sketch
+
+    Returns:
+        DataFrame indexed by `by`
+    """
+    by = list(by)
+    totals = rollup.group_by(by).aggregate([
+        ("count", "sum"), ("sum", "sum"), ("sum_sq", "sum"), ("min", "min"), ("max", "max"),
+    ]).rename_columns(by + ["count", "sum", "sum_sq", "min", "max"]).to_pandas().set_index(by)
+    stats = pd.DataFrame(index=totals.index)
+    stats["count"] = totals["count"]
+    stats["mean"] = totals["sum"] / totals["count"]
+    stats["min"] = totals["min"]
+    stats["max"] = totals["max"]
+    variance = (totals["sum_sq"] - totals["sum"] ** 2 / totals["count"]) / (totals["count"] - 1)
+    stats["std"] = np.sqrt(variance.clip(lower=0)).where(totals["count"] > 1)
+
+    buckets = sketch.group_by(by + ["bucket"]).aggregate([("count", "sum")]) \
+        .rename_columns(by + ["bucket", "count"]).to_pandas().sort_values(by + ["bucket"])
+    buckets["cum"] = buckets.groupby(by)["count"].cumsum()
+    buckets["total"] = buckets.groupby(by)["count"].transform("sum")
+    buckets["value"] = _bucket_values(buckets["bucket"].to_numpy())
+    for q in quantiles:
+        rank = q * (buckets["total"] - 1)
+        hit = buckets[buckets["cum"] > rank].groupby(by)["value"].first()
+        stats[f"p{int(round(q * 100))}"] = hit.reindex(stats.index).clip(stats["min"], stats["max"])
+    return stats.sort_index()
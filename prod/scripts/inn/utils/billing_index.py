@@ -0,0 +1,278 @@
+# prod/inn/utils/billing_index.py
+"""
+Byte-offset index of billing codes inside an MRF.
+
+While a file is scraped, StructureScanner watches the decompressed bytes and
+records where every top-level array and every in_network item starts and
+ends. The scraper supplies the billing code of each item (ijson sees the
+items in the same order), and the result is written as a JSON sidecar:
+
+    {
+        "source": "...", "source_size": 123, "gzip": true,
+        "checkpoints": "<name>.gzidx",
+        "sections": {"provider_references": [start, end], "in_network": [start, end]},
+        "codes": {"99213": [[u_start, u_end, c_start, c_end], ...]}
+    }
+
+`u_*` are offsets in the decompressed stream, `c_*` the compressed offsets
+of the nearest gzip checkpoints around that range. Extracting new codes later
+only seeks to and parses those ranges plus the provider_references section.
+"""
+
+import bisect
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import ijson
+import numpy as np
+
+from .events import SECTION_END
+from .streaming import CHUNK_SIZE, is_gzip_file, open_seekable_stream
+
+logger = logging.getLogger(__name__)
+
+_QUOTE, _BACKSLASH = 34, 92
+_OPEN_MAP, _CLOSE_MAP, _OPEN_ARRAY, _CLOSE_ARRAY = 123, 125, 91, 93
+_KEY_BEFORE = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*$')
+_LOOKBACK = 512
+
+
+class StructureScanner:
+    """
+    Incremental, vectorized scanner of JSON structure over raw bytes.
+
+    Only string/escape state and bracket depth are tracked, with NumPy doing
+    the per-byte work; Python only sees the few brackets that open or close a
+    top-level array or an item of an indexed section.
+
+    Args:
+        item_sections: Top-level array keys whose map items should be located
+    """
+
+    def __init__(self, item_sections: Iterable[str] = ("in_network",)):
+        self.item_sections = set(item_sections)
+        self.offset = 0
+        self.depth = 0
+        self.in_string = False
+        self.trailing_backslashes = 0
+        self.tail = b""
+        self.section: Optional[str] = None
+        self.sections: Dict[str, List[int]] = {}
+        self.items: List[Tuple[int, int]] = []
+        self._item_start = None
+
+    def feed(self, chunk: bytes) -> None:
+        n = len(chunk)
+        if n == 0:
+            return
+        arr = np.frombuffer(chunk, dtype=np.uint8)
+        idx = np.arange(n)
+
+        # Quotes preceded by an odd run of backslashes are escaped
+        is_backslash = arr == _BACKSLASH
+        last_plain = np.maximum.accumulate(np.where(is_backslash, -1, idx))
+        quotes = np.flatnonzero(arr == _QUOTE)
+        before = quotes - 1
+        plain_before = last_plain[np.maximum(before, 0)]
+        run = np.where(before >= 0, before - plain_before, 0)
+        # Runs touching the chunk start continue the previous chunk's trailing run
+        run += np.where((before < 0) | (plain_before == -1), self.trailing_backslashes, 0)
+        real_quotes = quotes[run % 2 == 0]
+
+        # Brackets outside strings and the depth after each of them
+        brackets = np.flatnonzero((arr == _OPEN_MAP) | (arr == _OPEN_ARRAY) | (arr == _CLOSE_MAP) | (arr == _CLOSE_ARRAY))
+        quotes_before = np.searchsorted(real_quotes, brackets)
+        outside = (quotes_before % 2 == 0) != self.in_string
+        brackets = brackets[outside]
+        values = arr[brackets]
+        opening = (values == _OPEN_MAP) | (values == _OPEN_ARRAY)
+        delta = np.where(opening, 1, -1)
+        depth_after = self.depth + np.cumsum(delta)
+        depth_before = depth_after - delta
+
+        # Top-level arrays open/close at depth 1 <-> 2, their items at 2 <-> 3
+        interesting = np.flatnonzero(
+            (opening & ((depth_before == 1) | (depth_before == 2)))
+            | (~opening & ((depth_after == 1) | (depth_after == 2)))
+        )
+        for i in interesting:
+            pos = int(brackets[i])
+            absolute = self.offset + pos
+            if opening[i] and depth_before[i] == 1:
+                self.section = None
+                if values[i] == _OPEN_ARRAY:
+                    match = _KEY_BEFORE.search((self.tail + chunk[:pos])[-_LOOKBACK:])
+                    if match:
+                        self.section = match.group(1).decode("utf-8")
+                        self.sections[self.section] = [absolute, None]
+            elif not opening[i] and depth_after[i] == 1:
+                if self.section in self.sections:
+                    self.sections[self.section][1] = absolute + 1
+                self.section = None
+            elif self.section in self.item_sections and values[i] in (_OPEN_MAP, _CLOSE_MAP):
+                if opening[i]:
+                    self._item_start = absolute
+                else:
+                    self.items.append((self._item_start, absolute + 1))
+
+        if len(real_quotes) % 2:
+            self.in_string = not self.in_string
+        if len(delta):
+            self.depth = int(depth_after[-1])
+        trailing = n - 1 - int(last_plain[-1])
+        self.trailing_backslashes = trailing + (self.trailing_backslashes if trailing == n else 0)
+        self.tail = (self.tail + chunk)[-_LOOKBACK:]
+        self.offset += n
+
+
+class ScanningReader:
+    """
+    File-like wrapper that feeds everything read through it to a scanner.
+    """
+
+    def __init__(self, stream: BinaryIO, scanner: StructureScanner):
+        self._stream = stream
+        self.scanner = scanner
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self.scanner.feed(data)
+        return data
+
+
+class BillingIndexRecorder:
+    """
+    Collects item spans and billing codes during a scrape and writes the sidecar.
+
+    Args:
+        source: Local path of the file being scraped
+        index_path: Where the JSON sidecar is written
+    """
+
+    def __init__(self, source: str, index_path: str):
+        self.source = source
+        self.index_path = Path(index_path)
+        self.scanner = StructureScanner()
+        self.codes: List[Any] = []
+
+    def wrap(self, stream: BinaryIO) -> ScanningReader:
+        self.stream = stream
+        return ScanningReader(stream, self.scanner)
+
+    def record(self, code: Any) -> None:
+        """Register the billing code of the next in_network item."""
+        self.codes.append(code)
+
+    def write(self) -> bool:
+        """
+        Write the sidecar (and the gzip checkpoint file, when available).
+
+        Returns:
+            False if item spans and billing codes did not line up and nothing was written
+        """
+        spans = self.scanner.items
+        if len(spans) != len(self.codes):
+            logger.warning(f"Not writing billing index: {len(spans)} item spans vs {len(self.codes)} codes")
+            return False
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        checkpoints_name = None
+        seek_points: List[Tuple[int, int]] = []
+        if hasattr(self.stream, "export_index"):
+            checkpoints_name = f"{self.index_path.stem}.gzidx"
+            self.stream.export_index(str(self.index_path.with_name(checkpoints_name)))
+            seek_points = list(self.stream.seek_points())
+        source_size = os.path.getsize(self.source)
+        u_points = [p[0] for p in seek_points]
+
+        def compressed_range(u_start: int, u_end: int) -> Tuple[int, int]:
+            if not seek_points:
+                return 0, source_size
+            before = max(bisect.bisect_right(u_points, u_start) - 1, 0)
+            after = bisect.bisect_left(u_points, u_end)
+            return seek_points[before][1], seek_points[after][1] if after < len(seek_points) else source_size
+
+        codes: Dict[str, List[List[int]]] = {}
+        for (u_start, u_end), code in zip(spans, self.codes):
+            codes.setdefault(str(code), []).append([u_start, u_end, *compressed_range(u_start, u_end)])
+
+        index = {
+            "source": str(self.source),
+            "source_size": source_size,
+            "gzip": is_gzip_file(self.source),
+            "checkpoints": checkpoints_name,
+            "sections": self.scanner.sections,
+            "codes": codes,
+        }
+        tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+        logger.info(f"Wrote billing index for {len(codes)} codes to {self.index_path}")
+        return True
+
+
+class RangeReader:
+    """
+    Read-only view of the byte range [start, end) of a seekable stream.
+    """
+
+    def __init__(self, stream: BinaryIO, start: int, end: int):
+        stream.seek(start)
+        self._stream = stream
+        self._remaining = end - start
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def load_index(index_path: str) -> Dict:
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def iter_indexed_items(source: str, index_path: str, codes: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Parse only the parts of a cached MRF needed for `codes`.
+
+    Args:
+        source: Local path of the MRF the index was built from
+        index_path: JSON sidecar written during an earlier scrape
+        codes: Billing codes to extract
+
+    Yields:
+        ("provider_references.item", ref) for every provider reference, then
+        SECTION_END for that prefix, then ("in_network.item", item) for every
+        in_network item of the requested codes
+    """
+    index = load_index(index_path)
+    if os.path.getsize(source) != index["source_size"]:
+        raise ValueError(f"{source} does not match the file indexed in {index_path}")
+
+    checkpoints = index.get("checkpoints")
+    index_file = Path(index_path).with_name(checkpoints) if checkpoints else None
+    ranges = sorted(
+        (u_start, u_end)
+        for code in codes
+        for u_start, u_end, _, _ in index["codes"].get(str(code), [])
+    )
+
+    with open_seekable_stream(source, index_file=index_file) as f:
+        refs = index["sections"].get("provider_references")
+        if refs and refs[1] is not None:
+            for ref in ijson.items(RangeReader(f, *refs), "item", buf_size=CHUNK_SIZE):
+                yield "provider_references.item", ref
+        yield "provider_references.item", SECTION_END
+        for u_start, u_end in ranges:
+            for item in ijson.items(RangeReader(f, u_start, u_end), ""):
+                yield "in_network.item", item
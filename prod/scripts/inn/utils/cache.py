@@ -0,0 +1,245 @@
+# prod/inn/utils/cache.py
+"""
+On-disk cache of downloaded MRF files.
+
+Files are stored as served (still compressed) under `prod/data/raw/`. Each URL
+has a small JSON metadata record under `meta/` holding the ETag/Last-Modified
+validators (kept apart from the blobs, which may themselves be .json files).
+URLs are keyed without their signing parameters (see
+toc.utils.manifest.normalize_location), so a re-signed URL still hits its
+cached copy; the full URL is only used for the request. The blob name is
+derived from that key plus the validators (or the body's
+hash when the server sends none), so a new upstream
+version never overwrites the copy another reader may still have open. Cached
+copies are revalidated with a conditional GET and the cache is kept under a
+size limit by evicting the least recently used files.
+
+Billing-code index sidecars built from a cached blob live under `index/` and
+are removed together with the blob. Remote provider_references documents are
+cached under `provider_references/`; they are small, shared across MRFs and
+not evicted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import requests
+
+from . import metrics
+from .streaming import CHUNK_SIZE
+from ...toc.utils.manifest import normalize_location
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path("prod/data/raw/")
+DEFAULT_MAX_BYTES = 500 * 1024 ** 3  # 500 GiB
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_write_json(path: Path, data: Dict) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+class MRFCache:
+    """
+    Content-addressed local cache for MRF downloads.
+
+    Args:
+        root: Cache directory
+        max_bytes: Total size the cached blobs may occupy before LRU eviction
+        revalidate: If False, cached copies are used without contacting the server
+        session: Optional requests session to reuse pooled connections
+    """
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 revalidate: bool = True, session: Optional[requests.Session] = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / "meta").mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.session = session or requests.Session()
+
+    def _meta_path(self, url: str) -> Path:
+        return self.root / "meta" / f"{_sha256(normalize_location(url))}.json"
+
+    def index_path(self, blob_path: Path) -> Path:
+        """
+        Location of the billing-code index sidecar for a cached blob.
+        """
+        return self.root / "index" / f"{Path(blob_path).name}.json"
+
+    def shard_plan_path(self, blob_path: Path) -> Path:
+        """
+        Location of the shard plan sidecar (see utils.shards) for a cached blob.
+        """
+        return self.root / "index" / f"{Path(blob_path).name}.shards.json"
+
+    @property
+    def references_dir(self) -> Path:
+        """
+        Directory of the remote provider_references cache (see utils.remote_refs).
+        """
+        return self.root / "provider_references"
+
+    def _remove_blob(self, blob: str) -> None:
+        blob_path = self.root / blob
+        index_path = self.index_path(blob_path)
+        plan_path = self.shard_plan_path(blob_path)
+        for path in (blob_path, index_path, index_path.with_suffix(".gzidx"), plan_path, plan_path.with_suffix(".gzidx")):
+            path.unlink(missing_ok=True)
+
+    def _load_meta(self, url: str) -> Optional[Dict]:
+        meta_path = self._meta_path(url)
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not (self.root / meta["blob"]).exists():
+            return None
+        return meta
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """
+        Return the cached metadata for a URL without contacting the server.
+        """
+        return self._load_meta(url)
+
+    def cached_path(self, url: str) -> Optional[Path]:
+        """
+        Local path of the cached copy of `url`, if any, without revalidating it.
+        """
+        meta = self._load_meta(url)
+        return self.root / meta["blob"] if meta else None
+
+    def fetch(self, url: str) -> Path:
+        """
+        Return a local path holding the current body of `url`.
+
+        A cached copy is revalidated with If-None-Match / If-Modified-Since; a
+        304 costs one round trip and no body. Otherwise the body is streamed to a
+        temp file and atomically moved into place. A server sending neither
+        ETag nor Last-Modified cannot be revalidated, so its body is downloaded
+        every time and the blob is named by its content hash.
+
+        Args:
+            url: URL of the file
+
+        Returns:
+            Path to the cached (still compressed) file
+        """
+        meta = self._load_meta(url)
+        if meta and not self.revalidate:
+            return self._touch(url, meta)
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        with self.session.get(url, headers=headers, stream=True) as response:
+            if meta and response.status_code == 304:
+                logger.info(f"Cache hit (not modified): {url}")
+                return self._touch(url, meta)
+            if response.status_code != 200:
+                raise Exception(f"❌ Failed to fetch MRF: {response.status_code}")
+
+            key = normalize_location(url)
+            etag = response.headers.get("ETag", "")
+            last_modified = response.headers.get("Last-Modified", "")
+            suffix = Path(url.split('?')[0]).suffix
+            validated = bool(etag or last_modified)
+            if validated:
+                blob = f"{_sha256(key + etag + last_modified)}{suffix}"
+                if meta and meta["blob"] == blob:
+                    # Server ignored the conditional headers but the validators match
+                    return self._touch(url, meta)
+            # Without validators the body itself names the version, see below
+            digest = None if validated else hashlib.sha256()
+
+            tmp_path = self.root / f"{_sha256(key)}.{os.getpid()}.tmp"
+            size = 0
+            try:
+                with open(tmp_path, "wb") as out:
+                    for chunk in response.raw.stream(CHUNK_SIZE, decode_content=True):
+                        out.write(chunk)
+                        size += len(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                if digest is not None:
+                    # An unchanged body keeps its blob name (and sidecars); a changed one gets a new blob
+                    blob = f"{_sha256(key + digest.hexdigest())}{suffix}"
+                blob_path = self.root / blob
+                os.replace(tmp_path, blob_path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+        logger.info(f"Cached {size:,} bytes from {url}")
+        metrics.count("bytes_downloaded", size)
+        old_blob = meta["blob"] if meta else None
+        new_meta = {
+            "url": url,
+            "blob": blob,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_length": size,
+            "fetched_at": time.time(),
+            "last_access": time.time(),
+        }
+        _atomic_write_json(self._meta_path(url), new_meta)
+        if old_blob and old_blob != blob:
+            self._remove_blob(old_blob)
+
+        self.evict(keep=blob)
+        return blob_path
+
+    def _touch(self, url: str, meta: Dict) -> Path:
+        meta["last_access"] = time.time()
+        _atomic_write_json(self._meta_path(url), meta)
+        return self.root / meta["blob"]
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Delete least recently used blobs until the cache fits in `max_bytes`.
+
+        Args:
+            keep: Blob name that must not be evicted (the one just fetched)
+        """
+        entries = []
+        for meta_path in (self.root / "meta").glob("*.json"):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            blob_path = self.root / meta.get("blob", "")
+            if blob_path.is_file():
+                entries.append((meta.get("last_access", 0), meta_path, blob_path))
+
+        total = sum(blob_path.stat().st_size for _, _, blob_path in entries)
+        for _, meta_path, blob_path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if blob_path.name == keep:
+                continue
+            total -= blob_path.stat().st_size
+            self._remove_blob(blob_path.name)
+            meta_path.unlink(missing_ok=True)
+            logger.info(f"Evicted {blob_path.name} from MRF cache")
@@ -0,0 +1,419 @@
+# prod/inn/utils/columnar.py
+"""
+Typed column buffers for exploding negotiated rates into flat rows.
+
+The flat output is the cross product (rate x provider x price). Instead of one
+Python dict per output row, each rate contributes a handful of index entries
+(provider ranges and prices); the cross product is then produced for a whole
+batch at once with NumPy repeat/arange arithmetic and Arrow `take`.
+"""
+
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from .keys import hash_key
+
+FLAT_RATE_SCHEMA = pa.schema([
+    ("cpt", pa.string()),
+    ("npi", pa.int64()),
+    ("tin", pa.string()),
+    ("pos", pa.string()),
+    ("negotiated_rate", pa.float64()),
+])
+
+PROVIDER_GROUP_SCHEMA = pa.schema([
+    ("provider_group_id", pa.int64()),
+    ("npi", pa.int64()),
+    ("tin", pa.string()),
+])
+
+GROUP_RATE_SCHEMA = pa.schema([
+    ("cpt", pa.string()),
+    ("provider_group_id", pa.int64()),
+    ("pos", pa.string()),
+    ("negotiated_rate", pa.float64()),
+])
+
+UNKNOWN_RANGE = (0, 1)  # pool slot 0 is the ("unknown", "unknown") provider
+
+
+def _exclusive_cumsum(counts: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    return offsets
+
+
+def group_key(group_id: Hashable) -> int:
+    """
+    int64 key of a provider_group_id; non-integer ids are hashed.
+    """
+    try:
+        key = int(group_id)
+        if -2 ** 63 <= key < 2 ** 63:
+            return key
+    except (TypeError, ValueError):
+        pass
+    return hash_key("provider_group_id", str(group_id))
+
+
+def group_keys(group_ids: Sequence) -> np.ndarray:
+    """
+    Vectorized group_key over a list of provider_group_ids.
+    """
+    try:
+        return np.asarray(group_ids, dtype=np.int64).reshape(-1)
+    except (TypeError, ValueError, OverflowError):
+        return np.fromiter((group_key(g) for g in group_ids), dtype=np.int64, count=len(group_ids))
+
+
+def expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Concatenate [start, start + length) ranges without a Python loop.
+    """
+    total = int(lengths.sum())
+    shift = np.repeat(starts - _exclusive_cumsum(lengths), lengths)
+    return np.arange(total, dtype=np.int64) + shift
+
+
+class ProviderPool:
+    """
+    Compact provider map: each provider group maps to a slice of flat provider arrays.
+
+    NPIs are kept in a uint32 array (every valid 10-digit NPI fits; the array
+    is promoted to int64 if a value does not) and TINs as int32 codes into a
+    TIN dictionary, so a provider costs 8 bytes instead of a Python int and
+    a list slot per column (~50 bytes), or ~130 bytes as a tuple of strings. Group g owns slots [starts[g], starts[g] + lengths[g]),
+    CSR-style, and group ids are resolved in bulk through a sorted index with
+    np.searchsorted. Buffers grow by doubling.
+
+    Group ids are int64; ids that are not integers are hashed to one. If a
+    group id is defined twice, the later definition wins.
+
+    Slot 0 holds the unknown provider used for unresolved references.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._npis = np.zeros(max(capacity, 1), dtype=np.uint32)
+        self._tins = np.zeros(max(capacity, 1), dtype=np.int32)
+        self._size = 1
+        self.tin_values: List[str] = ["unknown"]
+        self._tin_codes: Dict[str, int] = {"unknown": 0}
+        self._group_ids = np.zeros(64, dtype=np.int64)
+        self._starts = np.zeros(64, dtype=np.int64)
+        self._lengths = np.zeros(64, dtype=np.int64)
+        self._groups = 0
+        self._index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._tin_array: Optional[pa.Array] = None
+
+    @staticmethod
+    def _grow(buffer: np.ndarray, needed: int) -> np.ndarray:
+        if needed <= len(buffer):
+            return buffer
+        grown = np.zeros(max(needed, 2 * len(buffer)), dtype=buffer.dtype)
+        grown[:len(buffer)] = buffer
+        return grown
+
+    def tin_code(self, tin: str) -> int:
+        code = self._tin_codes.get(tin)
+        if code is None:
+            code = self._tin_codes[tin] = len(self.tin_values)
+            self.tin_values.append(tin)
+        return code
+
+    def _append(self, npis: np.ndarray, tin_codes: np.ndarray) -> None:
+        if self._npis.dtype == np.uint32 and len(npis) and (npis.min() < 0 or npis.max() > 0xFFFFFFFF):
+            self._npis = self._npis.astype(np.int64)
+        end = self._size + len(npis)
+        self._npis = self._grow(self._npis, end)
+        self._tins = self._grow(self._tins, end)
+        self._npis[self._size:end] = npis
+        self._tins[self._size:end] = tin_codes
+        self._size = end
+
+    def _add_range(self, group_id: Hashable, start: int) -> None:
+        g = self._groups
+        self._group_ids = self._grow(self._group_ids, g + 1)
+        self._starts = self._grow(self._starts, g + 1)
+        self._lengths = self._grow(self._lengths, g + 1)
+        self._group_ids[g] = group_key(group_id)
+        self._starts[g] = start
+        self._lengths[g] = self._size - start
+        self._groups = g + 1
+        self._index = None
+
+    def add_group(self, group_id: Hashable, providers: List[Tuple[int, str]]) -> None:
+        """
+        Add a group from (npi, tin) pairs.
+        """
+        start = self._size
+        npis = np.fromiter((npi for npi, _ in providers), dtype=np.int64, count=len(providers))
+        codes = np.fromiter((self.tin_code(tin) for _, tin in providers), dtype=np.int32, count=len(providers))
+        self._append(npis, codes)
+        self._add_range(group_id, start)
+
+    def add_tin_groups(self, group_id: Hashable, tin_groups: Iterable[Tuple[str, Sequence]]) -> None:
+        """
+        Add a group from (tin, npis) pairs, as provider_groups lists them.
+        """
+        start = self._size
+        for tin, npis in tin_groups:
+            npis = np.asarray(npis, dtype=np.int64)
+            self._append(npis, np.full(len(npis), self.tin_code(tin), dtype=np.int32))
+        self._add_range(group_id, start)
+
+    def _sorted_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._index is None:
+            ids = self._group_ids[:self._groups]
+            order = np.argsort(ids, kind="stable")
+            sorted_ids = ids[order]
+            # Keep the last definition of each id
+            last = np.ones(len(sorted_ids), dtype=bool)
+            last[:-1] = sorted_ids[1:] != sorted_ids[:-1]
+            self._index = (sorted_ids[last], order[last])
+        return self._index
+
+    def lookup_many(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Slot ranges of many group keys at once; unknown groups get UNKNOWN_RANGE.
+
+        Args:
+            keys: int64 group keys, see group_keys
+
+        Returns:
+            (starts, lengths) int64 arrays
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        sorted_ids, groups = self._sorted_index()
+        if len(sorted_ids) == 0:
+            return np.full(len(keys), UNKNOWN_RANGE[0], dtype=np.int64), np.full(len(keys), UNKNOWN_RANGE[1], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_ids, keys), len(sorted_ids) - 1)
+        found = sorted_ids[pos] == keys
+        g = groups[pos]
+        return (np.where(found, self._starts[g], UNKNOWN_RANGE[0]),
+                np.where(found, self._lengths[g], UNKNOWN_RANGE[1]))
+
+    def lookup(self, group_id: Hashable) -> Tuple[int, int]:
+        starts, lengths = self.lookup_many(group_keys([group_id]))
+        return int(starts[0]), int(lengths[0])
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held by the pool's arrays (after freeze(), without spare capacity).
+        """
+        return sum(a.nbytes for a in (self._npis, self._tins, self._group_ids, self._starts, self._lengths))
+
+    def freeze(self) -> "ProviderPool":
+        """
+        Drop spare buffer capacity and build the lookup index, e.g. before pickling.
+        """
+        self._npis = self._npis[:self._size].copy()
+        self._tins = self._tins[:self._size].copy()
+        self._group_ids = self._group_ids[:self._groups].copy()
+        self._starts = self._starts[:self._groups].copy()
+        self._lengths = self._lengths[:self._groups].copy()
+        self._index = None
+        self._sorted_index()
+        self._tin_array = None
+        return self
+
+    def take(self, slots: np.ndarray) -> Tuple[pa.Array, pa.Array]:
+        """
+        NPI and TIN columns for the given slots (slot 0 gives a null NPI and "unknown").
+        """
+        if self._tin_array is None or len(self._tin_array) != len(self.tin_values):
+            self._tin_array = pa.array(self.tin_values, type=pa.string())
+        npis = pa.array(self._npis[slots].astype(np.int64), type=pa.int64(), mask=slots == 0)
+        tins = self._tin_array.take(pa.array(self._tins[slots]))
+        return npis, tins
+
+    def to_table(self) -> pa.Table:
+        """
+        One row per (provider_group_id, npi, tin) membership, in PROVIDER_GROUP_SCHEMA.
+        """
+        _, groups = self._sorted_index()
+        groups = np.sort(groups)
+        lengths = self._lengths[groups]
+        slots = expand_ranges(self._starts[groups], lengths)
+        npis, tins = self.take(slots)
+        return pa.Table.from_arrays([
+            pa.array(np.repeat(self._group_ids[groups], lengths)),
+            npis,
+            tins,
+        ], schema=PROVIDER_GROUP_SCHEMA)
+
+
+class RateBatchBuilder:
+    """
+    Accumulates rates as index buffers and emits flat RecordBatches.
+
+    provider_references ids are queued as they come and resolved against the
+    pool in bulk (pool.lookup_many) whenever the row count is needed.
+
+    Args:
+        pool: Provider pool that provider ranges point into
+    """
+
+    def __init__(self, pool: ProviderPool):
+        self.pool = pool
+        self._reset()
+
+    def _reset(self) -> None:
+        self.codes: List[str] = []
+        self.ref_counts: List[int] = []
+        self.ref_ids: List = []
+        self.range_starts: List[np.ndarray] = []
+        self.range_lengths: List[np.ndarray] = []
+        self.price_counts: List[int] = []
+        self.price_pos: List[str] = []
+        self.price_rates: List[float] = []
+        self.pending_rows = 0
+        self._resolved_rates = 0
+        self._resolved_refs = 0
+
+    def add_rate(self, code: str, ref_ids, prices: List[Tuple[str, float]]) -> None:
+        """
+        Queue one negotiated rate.
+
+        Args:
+            code: Billing code of the enclosing in_network item
+            ref_ids: provider_references ids of the rate
+            prices: (place_of_service, negotiated_rate) per negotiated price
+        """
+        self.codes.append(code)
+        self.ref_counts.append(len(ref_ids))
+        self.ref_ids.extend(ref_ids)
+        self.price_counts.append(len(prices))
+        for pos, rate in prices:
+            self.price_pos.append(pos)
+            self.price_rates.append(rate)
+
+    def _resolve(self) -> None:
+        """
+        Look up the provider ranges of rates queued since the last call.
+        """
+        if self._resolved_rates == len(self.codes):
+            return
+        ref_counts = np.asarray(self.ref_counts[self._resolved_rates:], dtype=np.int64)
+        price_counts = np.asarray(self.price_counts[self._resolved_rates:], dtype=np.int64)
+        starts, lengths = self.pool.lookup_many(group_keys(self.ref_ids[self._resolved_refs:]))
+        self.range_starts.append(starts)
+        self.range_lengths.append(lengths)
+        self.pending_rows += int((lengths * np.repeat(price_counts, ref_counts)).sum())
+        self._resolved_rates = len(self.codes)
+        self._resolved_refs = len(self.ref_ids)
+
+    def __len__(self) -> int:
+        self._resolve()
+        return self.pending_rows
+
+    def flush(self) -> Optional[pa.RecordBatch]:
+        """
+        Materialize the queued rates as one RecordBatch and clear the buffers.
+
+        Returns:
+            RecordBatch in FLAT_RATE_SCHEMA, or None if nothing produces rows
+        """
+        self._resolve()
+        if self.pending_rows == 0:
+            self._reset()
+            return None
+
+        n_rates = len(self.codes)
+        ref_counts = np.asarray(self.ref_counts, dtype=np.int64)
+        range_lengths = np.concatenate(self.range_lengths)
+        price_counts = np.asarray(self.price_counts, dtype=np.int64)
+
+        # Providers per rate, and the flat provider index list grouped by rate
+        rate_of_range = np.repeat(np.arange(n_rates), ref_counts)
+        provider_counts = np.bincount(rate_of_range, weights=range_lengths, minlength=n_rates).astype(np.int64)
+        provider_idx = expand_ranges(np.concatenate(self.range_starts), range_lengths)
+        provider_offsets = _exclusive_cumsum(provider_counts)
+        price_offsets = _exclusive_cumsum(price_counts)
+
+        # Cross product: rows of rate r enumerate provider i (major) x price j (minor)
+        rows_per_rate = provider_counts * price_counts
+        rate_of_row = np.repeat(np.arange(n_rates), rows_per_rate)
+        within = np.arange(int(rows_per_rate.sum()), dtype=np.int64) - np.repeat(_exclusive_cumsum(rows_per_rate), rows_per_rate)
+        row_price_counts = price_counts[rate_of_row]
+        row_provider = provider_idx[provider_offsets[rate_of_row] + within // row_price_counts]
+        row_price = price_offsets[rate_of_row] + within % row_price_counts
+
+        npis, tins = self.pool.take(row_provider)
+        batch = pa.RecordBatch.from_arrays([
+            pa.array(self.codes, type=pa.string()).take(pa.array(rate_of_row)),
+            npis,
+            tins,
+            pa.array(self.price_pos, type=pa.string()).take(pa.array(row_price)),
+            pa.array(np.asarray(self.price_rates, dtype=np.float64)[row_price]),
+        ], schema=FLAT_RATE_SCHEMA)
+        self._reset()
+        return batch
+
+
+class GroupRateBatchBuilder:
+    """
+    Accumulates rates keyed by provider group id, without expanding to NPIs.
+
+    Each rate yields one row per (provider_reference, price) in GROUP_RATE_SCHEMA.
+    provider_group_ids are mapped through group_keys like the pool's.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self.codes: List[str] = []
+        self.ref_counts: List[int] = []
+        self.ref_ids: List = []
+        self.price_counts: List[int] = []
+        self.price_pos: List[str] = []
+        self.price_rates: List[float] = []
+        self.pending_rows = 0
+
+    def add_rate(self, code: str, ref_ids, prices: List[Tuple[str, float]]) -> None:
+        self.codes.append(code)
+        self.ref_counts.append(len(ref_ids))
+        self.ref_ids.extend(ref_ids)
+        self.price_counts.append(len(prices))
+        for pos, rate in prices:
+            self.price_pos.append(pos)
+            self.price_rates.append(rate)
+        self.pending_rows += len(ref_ids) * len(prices)
+
+    def __len__(self) -> int:
+        return self.pending_rows
+
+    def flush(self) -> Optional[pa.RecordBatch]:
+        if self.pending_rows == 0:
+            self._reset()
+            return None
+
+        n_rates = len(self.codes)
+        ref_counts = np.asarray(self.ref_counts, dtype=np.int64)
+        price_counts = np.asarray(self.price_counts, dtype=np.int64)
+        ref_offsets = _exclusive_cumsum(ref_counts)
+        price_offsets = _exclusive_cumsum(price_counts)
+
+        # Rows of rate r enumerate reference i (major) x price j (minor)
+        rows_per_rate = ref_counts * price_counts
+        rate_of_row = np.repeat(np.arange(n_rates), rows_per_rate)
+        within = np.arange(int(rows_per_rate.sum()), dtype=np.int64) - np.repeat(_exclusive_cumsum(rows_per_rate), rows_per_rate)
+        row_price_counts = price_counts[rate_of_row]
+        row_ref = ref_offsets[rate_of_row] + within // row_price_counts
+        row_price = price_offsets[rate_of_row] + within % row_price_counts
+
+        batch = pa.RecordBatch.from_arrays([
+            pa.array(self.codes, type=pa.string()).take(pa.array(rate_of_row)),
+            # Same keys as ProviderPool.to_table, so non-integer ids join too
+            pa.array(group_keys(self.ref_ids)[row_ref]),
+            pa.array(self.price_pos, type=pa.string()).take(pa.array(row_price)),
+            pa.array(np.asarray(self.price_rates, dtype=np.float64)[row_price]),
+        ], schema=GROUP_RATE_SCHEMA)
+        self._reset()
+        return batch
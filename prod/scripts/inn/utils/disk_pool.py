@@ -0,0 +1,202 @@
+# prod/inn/utils/disk_pool.py
+"""
+Provider pool backed by memory-mapped files, for provider_references larger than RAM.
+"""
+
+import shutil
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from .columnar import ProviderPool, group_key
+
+BUFFER_SLOTS = 1 << 20  # providers (and groups) buffered in RAM before they are appended to disk
+
+_COLUMNS = ("npis", "tins", "group_ids", "starts", "lengths", "index_ids", "index_groups")
+
+
+class DiskProviderPool(ProviderPool):
+    """
+    ProviderPool whose arrays live in flat files under a private temp directory.
+
+    While provider_references stream in, providers and group ranges are
+    buffered up to `buffer_slots` entries and appended to the files. Reads
+    (lookups, gathers, to_table) map the files with np.memmap, so the page
+    cache rather than the process holds the data and a worker of any size
+    can handle any file. The sorted group index is built once (argsort
+    needs 8 bytes per group of RAM, transiently) and stored on disk as well.
+
+    Lookups and gathers sort their keys first, so each batch walks the files
+    in order instead of seeking at random.
+
+    Pickling a pool (e.g. to hand it to shard workers) passes only the file
+    paths; the copies map the same files and never delete them. The owner
+    removes the directory on close() or when it is garbage collected.
+
+    Args:
+        spill_dir: Parent of the pool's directory (system temp by default)
+        buffer_slots: Providers and groups buffered in RAM between appends
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None, buffer_slots: int = BUFFER_SLOTS):
+        super().__init__(capacity=1)
+        self.dir = Path(tempfile.mkdtemp(prefix="provider_pool_", dir=spill_dir))
+        self._finalizer = weakref.finalize(self, shutil.rmtree, str(self.dir), True)
+        self.buffer_slots = buffer_slots
+        self._dtypes: Dict[str, np.dtype] = {
+            "npis": np.dtype(np.uint32), "tins": np.dtype(np.int32), "group_ids": np.dtype(np.int64),
+            "starts": np.dtype(np.int64), "lengths": np.dtype(np.int64),
+            "index_ids": np.dtype(np.int64), "index_groups": np.dtype(np.int64),
+        }
+        self._pending: Dict[str, List[np.ndarray]] = {name: [] for name in _COLUMNS}
+        self._pending_slots = 0
+        self._pending_groups: List[Tuple[int, int, int]] = []
+        self._synced = False
+        for name in _COLUMNS:
+            self._path(name).touch()
+        # Slot 0: the unknown provider
+        self._size = 0
+        self._append(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int32))
+
+    def _path(self, name: str) -> Path:
+        return self.dir / f"{name}.bin"
+
+    def _map(self, name: str, length: int) -> np.ndarray:
+        if length == 0:
+            return np.zeros(0, dtype=self._dtypes[name])
+        return np.memmap(self._path(name), dtype=self._dtypes[name], mode="r", shape=(length,))
+
+    def _write(self, name: str, values: np.ndarray) -> None:
+        with open(self._path(name), "ab") as f:
+            f.write(np.ascontiguousarray(values, dtype=self._dtypes[name]).tobytes())
+
+    def _promote_npis(self) -> None:
+        """
+        Rewrite the NPI file as int64 once a value does not fit in uint32.
+        """
+        self._flush()
+        old, new = self._path("npis"), self._path("npis.tmp")
+        written = self._size - self._pending_slots
+        source = np.memmap(old, dtype=np.uint32, mode="r", shape=(written,)) if written else np.zeros(0, np.uint32)
+        with open(new, "wb") as f:
+            for start in range(0, written, self.buffer_slots):
+                f.write(source[start:start + self.buffer_slots].astype(np.int64).tobytes())
+        del source
+        new.replace(old)
+        self._dtypes["npis"] = np.dtype(np.int64)
+        self._pending["npis"] = [a.astype(np.int64) for a in self._pending["npis"]]
+
+    def _append(self, npis: np.ndarray, tin_codes: np.ndarray) -> None:
+        if self._dtypes["npis"] == np.uint32 and len(npis) and (npis.min() < 0 or npis.max() > 0xFFFFFFFF):
+            self._promote_npis()
+        self._pending["npis"].append(npis)
+        self._pending["tins"].append(tin_codes)
+        self._pending_slots += len(npis)
+        self._size += len(npis)
+        self._synced = False
+        if self._pending_slots >= self.buffer_slots:
+            self._flush()
+
+    def _add_range(self, group_id, start: int) -> None:
+        self._pending_groups.append((group_key(group_id), start, self._size - start))
+        self._groups += 1
+        self._index = None
+        self._synced = False
+        if len(self._pending_groups) >= self.buffer_slots:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending_slots:
+            self._write("npis", np.concatenate(self._pending["npis"]))
+            self._write("tins", np.concatenate(self._pending["tins"]))
+            self._pending["npis"], self._pending["tins"] = [], []
+            self._pending_slots = 0
+        if self._pending_groups:
+            ids, starts, lengths = np.asarray(self._pending_groups, dtype=np.int64).reshape(-1, 3).T
+            self._write("group_ids", ids)
+            self._write("starts", starts)
+            self._write("lengths", lengths)
+            self._pending_groups = []
+
+    def _sync(self) -> None:
+        """
+        Append buffered entries and map the files for reading.
+        """
+        if self._synced:
+            return
+        self._flush()
+        self._npis = self._map("npis", self._size)
+        self._tins = self._map("tins", self._size)
+        self._group_ids = self._map("group_ids", self._groups)
+        self._starts = self._map("starts", self._groups)
+        self._lengths = self._map("lengths", self._groups)
+        self._synced = True
+
+    def _sorted_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        self._sync()
+        if self._index is None:
+            ids, groups = super()._sorted_index()
+            for name, values in (("index_ids", ids), ("index_groups", groups)):
+                self._path(name).unlink()
+                self._write(name, values)
+            del ids, groups
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        length = self._path("index_ids").stat().st_size // self._dtypes["index_ids"].itemsize
+        return self._map("index_ids", length), self._map("index_groups", length)
+
+    def lookup_many(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        starts, lengths = super().lookup_many(keys[order])
+        out_starts, out_lengths = np.empty_like(starts), np.empty_like(lengths)
+        out_starts[order], out_lengths[order] = starts, lengths
+        return out_starts, out_lengths
+
+    def take(self, slots: np.ndarray) -> Tuple[pa.Array, pa.Array]:
+        self._sync()
+        slots = np.asarray(slots, dtype=np.int64)
+        order = np.argsort(slots, kind="stable")
+        npis, tins = super().take(slots[order])
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        inverse = pa.array(inverse)
+        return npis.take(inverse), tins.take(inverse)
+
+    def freeze(self) -> "DiskProviderPool":
+        self._sorted_index()
+        return self
+
+    def close(self) -> None:
+        """
+        Delete the pool's files (only the owning instance does this).
+        """
+        self._npis = self._tins = self._group_ids = self._starts = self._lengths = None
+        self._index = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self) -> "DiskProviderPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self) -> Dict:
+        self.freeze()
+        state = {k: v for k, v in self.__dict__.items()
+                 if k not in ("_npis", "_tins", "_group_ids", "_starts", "_lengths", "_index", "_finalizer")}
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._finalizer = None  # the owner deletes the files
+        self._synced = False
+        self._sync()
+        self._index = self._load_index()
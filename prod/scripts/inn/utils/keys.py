@@ -0,0 +1,178 @@
+# prod/inn/utils/keys.py
+"""
+Deterministic 64-bit surrogate keys computed from natural key columns.
+
+A key is a hash of the namespace (e.g. "provider") and the natural key values,
+so the same provider gets the same provider_id in every file and every run.
+Work is vectorized: integers and floats are mixed with splitmix64 in NumPy,
+strings are dictionary-encoded first so only the distinct values are hashed in
+Python (with BLAKE2b, which is stable across processes unlike `hash()`).
+
+Keys are returned as int64 (the uint64 bit pattern) so they round-trip through
+Parquet and pandas without overflow.
+"""
+
+import hashlib
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+_NULL_HASH = np.uint64(0x6A09E667F3BCC908)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MUL1 = np.uint64(0xBF58476D1CE4E5B9)
+_MUL2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer over a uint64 array."""
+    with np.errstate(over="ignore"):
+        x = x + _GOLDEN
+        x = (x ^ (x >> np.uint64(30))) * _MUL1
+        x = (x ^ (x >> np.uint64(27))) * _MUL2
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_text(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hash_strings(arr: pa.Array) -> np.ndarray:
+    encoded = pc.dictionary_encode(arr)
+    dictionary = np.fromiter(
+        (_hash_text(v) for v in encoded.dictionary.to_pylist()),
+        dtype=np.uint64, count=len(encoded.dictionary),
+    )
+    indices = encoded.indices.to_numpy(zero_copy_only=False)
+    valid = ~np.asarray(encoded.indices.is_null(), dtype=bool)
+    out = np.full(len(arr), _NULL_HASH, dtype=np.uint64)
+    out[valid] = dictionary[indices[valid].astype(np.int64)]
+    return out
+
+
+def _hash_numbers(arr: pa.Array) -> np.ndarray:
+    if pa.types.is_floating(arr.type):
+        values = pc.fill_null(arr.cast(pa.float64()), 0.0).to_numpy(zero_copy_only=False)
+        bits = (values + 0.0).view(np.uint64)  # + 0.0 folds -0.0 into 0.0
+    else:
+        bits = pc.fill_null(arr.cast(pa.int64()), 0).to_numpy(zero_copy_only=False).view(np.uint64)
+    out = _mix(bits.copy())
+    out[np.asarray(arr.is_null(), dtype=bool)] = _NULL_HASH
+    return out
+
+
+def hash_column(values: Any) -> np.ndarray:
+    """
+    Hash one column to uint64 per row.
+
+    Args:
+        values: Arrow array/chunked array, or anything `pa.array` accepts
+            (e.g. a pandas Series)
+    """
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    elif not isinstance(values, pa.Array):
+        values = pa.array(values)
+    if pa.types.is_dictionary(values.type):
+        values = values.cast(values.type.value_type)
+    if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+        return _hash_strings(values)
+    if pa.types.is_null(values.type):
+        return np.full(len(values), _NULL_HASH, dtype=np.uint64)
+    if pa.types.is_integer(values.type) or pa.types.is_floating(values.type) or pa.types.is_boolean(values.type):
+        return _hash_numbers(values)
+    raise TypeError(f"Cannot hash column of type {values.type}")
+
+
+def hash_columns(columns: Sequence[Any], namespace: str) -> np.ndarray:
+    """
+    Combine several natural-key columns into one int64 key per row.
+
+    Args:
+        columns: Equal-length columns forming the natural key
+        namespace: Key family, so e.g. a provider and a plan with equal
+            natural keys still get different ids
+
+    Returns:
+        int64 NumPy array of keys
+    """
+    n = len(columns[0])
+    key = np.full(n, np.uint64(_hash_text(namespace)), dtype=np.uint64)
+    for column in columns:
+        key = _mix(key ^ hash_column(column))
+    return key.view(np.int64)
+
+
+def hash_key(namespace: str, *values: Any) -> int:
+    """
+    Key of a single natural key tuple; equal to the matching `hash_columns` row.
+    """
+    return int(hash_columns([pa.array([v]) for v in values], namespace)[0])
+
+
+class KeyCounts:
+    """
+    Running occurrence counts of int64 keys, for keys seen over many batches.
+
+    Counts live in sorted runs of geometrically decreasing size (a new run is
+    merged into the last one while that is at most twice as large), so adding
+    a batch costs O(batch log n) amortized and a lookup searches O(log n)
+    runs, instead of rewriting one array of every key seen per batch.
+    """
+
+    def __init__(self):
+        self._runs: List[Tuple[np.ndarray, np.ndarray]] = []  # (sorted unique keys, counts)
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys, _ in self._runs)
+
+    @staticmethod
+    def _merge(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.concatenate([a[0], b[0]])
+        # Both runs are sorted, so the stable sort (timsort) merges them in linear time
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.add.reduceat(np.concatenate([a[1], b[1]])[order], starts)
+        return keys[starts], counts
+
+    def get(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Count of each key so far (0 for keys never added).
+        """
+        counts = np.zeros(len(keys), dtype=np.int64)
+        for run_keys, run_counts in self._runs:
+            at = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            found = run_keys[at] == keys
+            counts[found] += run_counts[at[found]]
+        return counts
+
+    def add(self, keys: np.ndarray, counts: np.ndarray = None) -> None:
+        """
+        Add `counts` (default 1 each) to `keys`; keys must be sorted and unique.
+        """
+        if not len(keys):
+            return
+        run = (np.asarray(keys, dtype=np.int64),
+               np.ones(len(keys), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64))
+        while self._runs and len(self._runs[-1][0]) <= 2 * len(run[0]):
+            run = self._merge(self._runs.pop(), run)
+        self._runs.append(run)
+
+
+def occurrence_index(keys: np.ndarray, seen: KeyCounts) -> np.ndarray:
+    """
+    How many times each row's key occurred before it, in earlier batches
+    (`seen`) and earlier rows of this one; `seen` is updated with the batch.
+    """
+    n = len(keys)
+    order = np.argsort(keys, kind="stable")
+    ordered = keys[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]]) if n else np.empty(0, dtype=np.int64)
+    sizes = np.diff(np.r_[starts, n])
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.repeat(starts, sizes)
+    occurrence = seen.get(keys) + rank
+    seen.add(ordered[starts], sizes)
+    return occurrence
@@ -0,0 +1,123 @@
+# prod/inn/utils/memory.py
+"""
+Memory accounting helpers used to size parallel work.
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+from statistics import median
+from typing import Dict, Optional
+
+import psutil
+
+from ...toc.utils.manifest import normalize_location
+
+DEFAULT_HISTORY_PATH = Path("prod/data/state/memory_history.json")
+DEFAULT_ESTIMATE_BYTES = 2 * 1024 ** 3  # assumed peak for a file we know nothing about
+MIN_ESTIMATE_BYTES = 256 * 1024 ** 2
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of the current process in bytes, over its whole lifetime.
+    """
+    if sys.platform == "win32":
+        return psutil.Process().memory_info().peak_wset
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes() -> int:
+    """
+    Resident set size of the current process in bytes, right now.
+
+    Unlike peak_rss_bytes this goes down again, so samples of it give the
+    peak of one stretch of work in a process that has run others before.
+    """
+    return _process().memory_info().rss
+
+
+_PROCESS: Optional[psutil.Process] = None
+
+
+def _process() -> psutil.Process:
+    global _PROCESS
+    if _PROCESS is None or _PROCESS.pid != os.getpid():
+        _PROCESS = psutil.Process()
+    return _PROCESS
+
+
+def available_memory_bytes() -> int:
+    return psutil.virtual_memory().available
+
+
+def children_rss_bytes() -> int:
+    """
+    Combined resident set size of the current process's children (e.g. pool workers) in bytes.
+    """
+    total = 0
+    for child in _process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass  # exited since it was listed
+    return total
+
+
+class MemoryHistory:
+    """
+    Persistent record of the peak RSS observed per URL.
+
+    Used to predict how much memory processing a URL will take, either from
+    its own past runs or, for new URLs, from the typical peak-RSS to
+    Content-Length ratio of everything seen so far. URLs are keyed without
+    their signing parameters (see toc.utils.manifest.normalize_location).
+
+    Args:
+        path: JSON file the history is stored in
+    """
+
+    def __init__(self, path: Path = DEFAULT_HISTORY_PATH):
+        self.path = Path(path)
+        self.records: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.records = json.load(f)
+
+    def record(self, url: str, peak_rss: int, content_length: Optional[int]) -> None:
+        self.records[normalize_location(url)] = {"peak_rss": peak_rss, "content_length": content_length}
+
+    def estimate(self, url: str, content_length: Optional[int]) -> int:
+        """
+        Estimate peak RSS in bytes for processing `url`.
+
+        Args:
+            url: URL about to be processed
+            content_length: Size of the (compressed) body if known
+
+        Returns:
+            Estimated peak RSS in bytes
+        """
+        key = normalize_location(url)
+        if key in self.records:
+            return max(self.records[key]["peak_rss"], MIN_ESTIMATE_BYTES)
+
+        ratios = [
+            r["peak_rss"] / r["content_length"]
+            for r in self.records.values()
+            if r.get("content_length")
+        ]
+        if content_length and ratios:
+            return max(int(median(ratios) * content_length), MIN_ESTIMATE_BYTES)
+        return DEFAULT_ESTIMATE_BYTES
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=2)
+        os.replace(tmp, self.path)
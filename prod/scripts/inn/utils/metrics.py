@@ -0,0 +1,411 @@
+# prod/inn/utils/metrics.py
+"""
+Per-URL, per-stage metrics of a pipeline run.
+
+`track(url)` makes a RunMetrics current for the process. Instrumented code
+calls `stage(name)` (or decorates a function or generator with `timed(name)`)
+and `count(counter, n)`. When nothing is being tracked, all of them do
+nothing, so library callers pay nothing.
+
+Stages nest and time is exclusive. A streaming run interleaves stages: the
+Parquet writer pulls batches from the rollup, which pulls them from the
+scraper. Entering a nested stage pauses the one around it, so wall and CPU
+seconds land on the stage that actually spent them. Counters are added to
+the innermost active stage.
+
+Peak RSS is the highest current RSS seen while a URL (or stage) is active:
+an RSSSampler thread samples it every RSS_INTERVAL seconds, and every stage
+switch samples it too. The process-lifetime maximum (ru_maxrss) would carry
+over from earlier entries run in the same process. Memory of child
+processes (e.g. shard workers) is not included.
+
+StackSampler is an optional sampling profiler. It snapshots the tracked
+thread's stack every few milliseconds while a chosen stage is active and
+writes collapsed stacks for flame graph tools.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .memory import current_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005  # seconds between profiler samples
+RSS_INTERVAL = 0.02  # seconds between RSS samples
+MAX_STACK_DEPTH = 64
+
+# Counters recorded by the instrumented stages. Each quantity is counted once
+# per run, so totals() over stages does not double it: rows_scraped are the
+# scraper's flat (or group-keyed) rate rows, rows_emitted the rows written to
+# the output tables by the savers.
+COUNTERS = ("bytes_downloaded", "bytes_read", "bytes_decompressed", "items_scanned", "items_matched",
+            "rows_scraped", "rows_emitted")
+
+
+class RunMetrics:
+    """
+    Stage timings and counters of one URL.
+
+    Args:
+        url: URL (or other label) the metrics belong to
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.thread_id = threading.get_ident()
+        self.stages: Dict[str, Dict] = {}
+        self._stack: List[str] = []
+        self._mark = (time.perf_counter(), time.process_time())
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.wall = 0.0
+        self.peak_rss = 0
+
+    def _stats(self, name: str) -> Dict:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {"wall": 0.0, "cpu": 0.0, "peak_rss": 0, **{c: 0 for c in COUNTERS}}
+        return stats
+
+    def _charge(self) -> None:
+        # Time since the last switch goes to the innermost active stage
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self._stack:
+            stats = self._stats(self._stack[-1])
+            stats["wall"] += wall - self._mark[0]
+            stats["cpu"] += cpu - self._mark[1]
+        self._mark = (wall, cpu)
+
+    def sample_rss(self) -> None:
+        """
+        Raise the peak RSS of the URL and of the innermost active stage to the current RSS.
+        """
+        rss = current_rss_bytes()
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            name = self.current_stage
+            if name is not None:
+                stats = self._stats(name)
+                stats["peak_rss"] = max(stats["peak_rss"], rss)
+
+    def enter(self, name: str) -> None:
+        self.sample_rss()
+        self._charge()
+        self._stack.append(name)
+        self._stats(name)
+
+    def exit(self) -> None:
+        self.sample_rss()
+        self._charge()
+        self._stack.pop()
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        stack = self._stack
+        return stack[-1] if stack else None
+
+    def count(self, counter: str, n: int = 1, stage: Optional[str] = None) -> None:
+        with self._lock:
+            stats = self._stats(stage or self.current_stage or "other")
+            stats[counter] = stats.get(counter, 0) + n
+
+    def totals(self) -> Dict[str, int]:
+        """
+        Counters summed over all stages.
+        """
+        totals = Counter()
+        for stats in self.stages.values():
+            totals.update({c: stats.get(c, 0) for c in COUNTERS})
+        return dict(totals)
+
+    def add_totals(self, totals: Dict[str, int]) -> None:
+        """
+        Add counters recorded elsewhere (e.g. by a worker process) to the current stage.
+        """
+        for counter, n in totals.items():
+            self.count(counter, n)
+
+    def to_dict(self) -> Dict:
+        return {"url": self.url, "started": self.started, "wall": self.wall, "peak_rss": self.peak_rss,
+                "stages": self.stages}
+
+
+_current: Optional[RunMetrics] = None
+
+
+def current() -> Optional[RunMetrics]:
+    return _current
+
+
+@contextmanager
+def track(url: str, profile_stages: Collection[str] = (), profile_path: Optional[Union[str, Path]] = None
+          ) -> Iterator[RunMetrics]:
+    """
+    Record the metrics of everything run in this block under `url`.
+
+    Args:
+        url: URL being processed
+        profile_stages: Stages to sample with StackSampler
+        profile_path: Where the collapsed stacks are written (required with profile_stages)
+
+    Yields:
+        The RunMetrics being filled
+    """
+    global _current
+    previous, _current = _current, RunMetrics(url)
+    metrics = _current
+    sampler = StackSampler(metrics, profile_stages) if profile_stages else None
+    if sampler:
+        sampler.start()
+    rss_sampler = RSSSampler(metrics)
+    rss_sampler.start()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.wall = time.perf_counter() - start
+        rss_sampler.stop()
+        _current = previous
+        if sampler:
+            sampler.stop()
+            sampler.write(profile_path)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Attribute the time spent in this block to stage `name` of the tracked URL.
+    """
+    metrics = _current
+    if metrics is None or threading.get_ident() != metrics.thread_id:
+        yield
+        return
+    metrics.enter(name)
+    try:
+        yield
+    finally:
+        metrics.exit()
+
+
+def count(counter: str, n: int = 1) -> None:
+    """
+    Add `n` to a counter of the innermost active stage, if a URL is being tracked.
+    """
+    if _current is not None:
+        _current.count(counter, n)
+
+
+def add_totals(totals: Dict[str, int]) -> None:
+    """
+    Add counters recorded elsewhere (e.g. by a worker process) to the innermost active stage.
+    """
+    if _current is not None:
+        _current.add_totals(totals)
+
+
+def active() -> bool:
+    return _current is not None
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """
+    Iterate `iterable`, attributing the time of each step to stage `name`.
+
+    Time the consumer spends between steps is not charged to `name`, which is
+    what a lazy pipeline needs.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            with stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        # Release the wrapped generator's resources when the consumer stops early
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator timing a function, or each step of a generator function, as stage `name`.
+    """
+    def decorate(func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                return timed_iter(name, func(*args, **kwargs))
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class CountingReader:
+    """
+    Read-through wrapper adding the bytes read to a counter of the tracked URL.
+    """
+
+    def __init__(self, stream, counter: str):
+        self._stream = stream
+        self._counter = counter
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        count(self._counter, len(data))
+        return data
+
+    def readinto(self, b) -> int:
+        n = self._stream.readinto(b)
+        count(self._counter, n or 0)
+        return n
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+
+class RSSSampler:
+    """
+    Samples the current RSS into a RunMetrics every `interval` seconds until stopped.
+    """
+
+    def __init__(self, metrics: RunMetrics, interval: float = RSS_INTERVAL):
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        self.metrics.sample_rss()
+        while not self._stop.wait(self.interval):
+            self.metrics.sample_rss()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.metrics.sample_rss()
+
+
+class StackSampler:
+    """
+    Sampling profiler of the tracked thread while one of `stages` is active.
+
+    A daemon thread snapshots the thread's Python stack every `interval`
+    seconds and counts identical stacks. write() emits them in the collapsed
+    format ("outer;...;inner count" per line) read by flamegraph.pl and
+    speedscope.
+
+    Args:
+        metrics: RunMetrics whose thread and current stage are sampled
+        stages: Stage names to sample
+        interval: Seconds between samples
+    """
+
+    def __init__(self, metrics: RunMetrics, stages: Collection[str], interval: float = SAMPLE_INTERVAL):
+        self.metrics = metrics
+        self.stages = set(stages)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            stage_name = self.metrics.current_stage
+            if stage_name not in self.stages:
+                continue
+            frame = sys._current_frames().get(self.metrics.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join([stage_name] + stack[::-1])] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Optional[Union[str, Path]]) -> None:
+        if path is None or not self.samples:
+            return
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+        logger.info(f"Wrote {sum(self.samples.values())} profile samples to {path}")
+
+
+REPORT_SCHEMA = pa.schema([
+    ("url", pa.string()),
+    ("status", pa.string()),
+    ("stage", pa.string()),
+    ("wall_s", pa.float64()),
+    ("cpu_s", pa.float64()),
+    ("peak_rss", pa.int64()),
+    *[(c, pa.int64()) for c in COUNTERS],
+])
+
+
+def report_rows(results: Iterable[Dict]) -> List[Dict]:
+    """
+    One row per (URL, stage) from run results carrying a "metrics" dict.
+    """
+    rows = []
+    for result in results:
+        metrics = result.get("metrics")
+        if not metrics:
+            continue
+        for name, stats in metrics["stages"].items():
+            rows.append({"url": result["url"], "status": result.get("status"), "stage": name,
+                         "wall_s": stats["wall"], "cpu_s": stats["cpu"], "peak_rss": stats["peak_rss"],
+                         **{c: stats.get(c, 0) for c in COUNTERS}})
+    return rows
+
+
+def write_report(results: List[Dict], path: Union[str, Path]) -> Path:
+    """
+    Write a run report: .parquet gives one row per (URL, stage) in REPORT_SCHEMA;
+    anything else gives JSON with the full per-entry results.
+
+    Returns:
+        Path written
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if path.suffix == ".parquet":
+        pq.write_table(pa.Table.from_pylist(report_rows(results), schema=REPORT_SCHEMA), tmp)
+    else:
+        with open(tmp, "w") as f:
+            json.dump({"created": time.time(), "entries": results}, f, indent=2, default=str)
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,160 @@
+# prod/inn/utils/remote_refs.py
+"""
+Shared on-disk cache of remote provider_references.
+
+A provider_references entry may carry a `location` URL instead of inline
+provider_groups. RemoteReferences downloads those documents on a bounded
+thread pool over pooled keep-alive connections and stores each one as JSON
+under the cache directory, named by the hash of its URL. A location shared
+by many MRFs, or seen again in a later run, is downloaded only once, and
+concurrent requests for the same URL share a single download.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import ijson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import DEFAULT_CACHE_DIR
+from .streaming import open_mrf_stream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFS_DIR = DEFAULT_CACHE_DIR / "provider_references"
+FETCH_WORKERS = 8  # concurrent downloads (and pooled connections)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5  # seconds; doubled on each retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class RemoteReferences:
+    """
+    Fetch-once cache of remote provider reference documents.
+
+    `submit(url)` returns a future for the document's provider_groups list.
+    Cached documents are read from disk; missing ones are fetched (gunzipped
+    if needed) by at most `workers` threads at a time. A failed fetch logs a
+    warning and resolves to None, so callers can tell it from a document
+    that lists no providers; it is not cached, so the next run retries it.
+
+    Writes are atomic, so several processes may share one cache directory;
+    at worst two of them download the same new URL at the same time.
+
+    Args:
+        root: Cache directory (created on the first write)
+        workers: Concurrent downloads
+        session: Optional requests session to reuse pooled connections; by
+            default one with `workers` pooled connections and retries is made
+    """
+
+    def __init__(self, root: Path = DEFAULT_REFS_DIR, workers: int = FETCH_WORKERS,
+                 session: Optional[requests.Session] = None):
+        self.root = Path(root)
+        self.workers = workers
+        self._owns_session = session is None
+        self.session = session or self._new_session()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.hits = 0
+
+    def _new_session(self) -> requests.Session:
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=self.workers, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def path(self, url: str) -> Path:
+        digest = _sha256(url)
+        return self.root / digest[:2] / f"{digest}.json"
+
+    def _load(self, url: str) -> Optional[List[Dict]]:
+        try:
+            with open(self.path(url)) as f:
+                return json.load(f)["provider_groups"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _store(self, url: str, groups: List[Dict]) -> None:
+        path = self.path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"url": url, "provider_groups": groups}, f)
+        os.replace(tmp, path)
+
+    def _fetch(self, url: str) -> Optional[List[Dict]]:
+        groups = self._load(url)
+        if groups is not None:
+            self.hits += 1
+            return groups
+        try:
+            with open_mrf_stream(url, session=self.session) as f:
+                groups = list(ijson.items(f, "provider_groups.item", use_float=True))
+        except Exception as e:
+            logger.warning(f"Failed to fetch provider reference {url}: {e}")
+            return None
+        self._store(url, groups)
+        self.downloads += 1
+        return groups
+
+    def _done(self, url: str) -> None:
+        # Finished documents are on disk; later requests read them from there
+        with self._lock:
+            self._pending.pop(url, None)
+
+    def submit(self, url: str) -> Future:
+        """
+        Start resolving `url` (or join a download already in flight).
+
+        Returns:
+            Future of the location's provider_groups list (None if it could not be fetched)
+        """
+        with self._lock:
+            future = self._pending.get(url)
+            if future is not None:
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="provider-refs")
+            future = self._pending[url] = self._executor.submit(self._fetch, url)
+        future.add_done_callback(lambda _: self._done(url))
+        return future
+
+    def get(self, url: str) -> Optional[List[Dict]]:
+        return self.submit(url).result()
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self) -> "RemoteReferences":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
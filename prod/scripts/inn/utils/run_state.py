@@ -0,0 +1,156 @@
+# prod/inn/utils/run_state.py
+"""
+Persistent per-URL state of manifest runs.
+
+Each processed URL gets a record with the upstream fingerprint it was
+processed at (ETag, Last-Modified, size and the manifest's last_updated), the
+output files it produced and its status. A later run skips URLs whose
+fingerprint is unchanged and whose outputs still exist, so a monthly refresh
+only reprocesses what changed upstream. Entries are marked "running" before
+they start, which makes interrupted runs visible and resumable: only
+unfinished or changed entries are picked up again.
+
+Records are keyed by the URL with its signing parameters stripped
+(toc.utils.manifest.normalize_location), so a TOC that re-signs its URLs
+every month does not make every file look new.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+from .streaming import is_remote
+from ...toc.utils.manifest import normalize_location
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = Path("prod/data/state/run_state.json")
+FINGERPRINT_FIELDS = ("etag", "last_modified", "content_length", "manifest_last_updated")
+
+
+def fetch_fingerprint(url: str, manifest_entry: Optional[Dict] = None,
+                      session: Optional[requests.Session] = None) -> Dict:
+    """
+    Describe the current upstream version of `url` without downloading it.
+
+    Remote files are fingerprinted with a HEAD request, local files with
+    their size and modification time. Fields that cannot be determined are None.
+
+    Args:
+        url: URL or local path of the MRF
+        manifest_entry: Manifest entry, whose last_updated is part of the fingerprint
+        session: Optional requests session to reuse pooled connections
+
+    Returns:
+        Dict with the FINGERPRINT_FIELDS
+    """
+    fingerprint = dict.fromkeys(FINGERPRINT_FIELDS)
+    fingerprint["manifest_last_updated"] = (manifest_entry or {}).get("last_updated") or None
+
+    if not is_remote(url):
+        try:
+            stat = os.stat(url)
+        except OSError:
+            return fingerprint
+        fingerprint["content_length"] = stat.st_size
+        fingerprint["last_modified"] = str(int(stat.st_mtime))
+        return fingerprint
+
+    try:
+        response = (session or requests).head(url, allow_redirects=True, timeout=30)
+    except requests.RequestException:
+        return fingerprint
+    if response.status_code != 200:
+        return fingerprint
+    length = response.headers.get("Content-Length")
+    fingerprint["etag"] = response.headers.get("ETag") or None
+    fingerprint["last_modified"] = response.headers.get("Last-Modified") or None
+    fingerprint["content_length"] = int(length) if length and length.isdigit() else None
+    return fingerprint
+
+
+def _has_validator(fingerprint: Dict) -> bool:
+    return any(fingerprint.get(field) for field in ("etag", "last_modified", "manifest_last_updated"))
+
+
+class RunState:
+    """
+    JSON-backed store of per-URL run records.
+
+    Args:
+        path: JSON file the state is stored in
+    """
+
+    def __init__(self, path: Path = DEFAULT_STATE_PATH):
+        self.path = Path(path)
+        self.records: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.records = json.load(f)
+
+    def is_unchanged(self, url: str, fingerprint: Dict) -> bool:
+        """
+        Whether `url` was already processed successfully at this fingerprint.
+
+        A fingerprint without any validator (no ETag, Last-Modified or
+        last_updated) never counts as unchanged, and neither does a record
+        whose output files have since been removed.
+        """
+        record = self.record(url)
+        if not record or record.get("status") != "ok" or not _has_validator(fingerprint):
+            return False
+        if any(record.get("fingerprint", {}).get(field) != fingerprint.get(field) for field in FINGERPRINT_FIELDS):
+            return False
+        return all(Path(p).exists() for p in record.get("outputs", []))
+
+    def record(self, url: str) -> Optional[Dict]:
+        """
+        Record of `url` under any signature, if it was ever started.
+        """
+        return self.records.get(normalize_location(url))
+
+    def interrupted(self) -> List[str]:
+        """
+        Keys (see normalize_location) of URLs started by an earlier run but never finished.
+        """
+        return [key for key, record in self.records.items() if record.get("status") == "running"]
+
+    def mark_running(self, url: str, fingerprint: Dict) -> None:
+        record = self.records.setdefault(normalize_location(url), {})
+        record.update({"url": url, "status": "running", "fingerprint": fingerprint, "started_at": time.time()})
+        self.save()
+
+    def mark_finished(self, url: str, fingerprint: Dict, status: str,
+                      outputs: Optional[List[str]] = None, error: Optional[str] = None) -> None:
+        """
+        Record the outcome of processing `url` and persist the store.
+
+        Args:
+            url: URL that was processed
+            fingerprint: Fingerprint it was processed at
+            status: "ok", "skipped" or "failed"
+            outputs: Files written for the URL
+            error: Error message for failed entries
+        """
+        record = self.records.setdefault(normalize_location(url), {})
+        record.update({
+            "url": url,
+            "status": status,
+            "fingerprint": fingerprint,
+            "outputs": outputs or [],
+            "error": error,
+            "finished_at": time.time(),
+        })
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,159 @@
+# prod/inn/utils/shards.py
+"""
+Split the in_network array of a cached MRF into independently parseable shards.
+
+One sequential pass decompresses the file through StructureScanner, which
+records the byte span of every in_network item and of provider_references,
+while indexed_gzip records restart checkpoints (a zran-style access-point
+index). Consecutive items are then grouped into shards of roughly equal
+uncompressed size. A worker can seek straight to its shard through the
+checkpoints and parse it as `{"in_network": [<shard bytes>]}`, so gunzip and
+JSON parsing of one huge file spread across cores.
+"""
+
+import json
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from .billing_index import RangeReader, ScanningReader, StructureScanner
+from .streaming import CHUNK_SIZE, indexed_gzip, is_gzip_file, open_seekable_stream
+
+logger = logging.getLogger(__name__)
+
+SHARDS_PER_WORKER = 4  # more shards than workers evens out skewed item sizes
+MIN_SHARD_BYTES = 64 * 1024 * 1024  # below this, a shard is not worth a process
+
+
+class Shard(NamedTuple):
+    start: int  # uncompressed offset of the first item
+    end: int  # uncompressed offset just past the last item
+    items: int
+
+
+class ShardPlan(NamedTuple):
+    source: str
+    source_size: int
+    checkpoints: Optional[str]  # exported gzip checkpoint file, if any
+    sections: Dict[str, List[int]]  # top-level array -> [start, end]
+    shards: List[Shard]
+
+    def save(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({**self._asdict(), "shards": [list(s) for s in self.shards]}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ShardPlan":
+        with open(path) as f:
+            data = json.load(f)
+        data["shards"] = [Shard(*s) for s in data["shards"]]
+        return cls(**data)
+
+
+def can_shard(source: Union[str, Path]) -> bool:
+    """
+    Whether shards of `source` can be read without decompressing from the start.
+    """
+    return not is_gzip_file(source) or indexed_gzip is not None
+
+
+def split_spans(spans: List[Tuple[int, int]], n_shards: int, min_bytes: int = MIN_SHARD_BYTES) -> List[Shard]:
+    """
+    Group consecutive item spans into at most `n_shards` shards of similar byte size.
+    """
+    if not spans:
+        return []
+    total = spans[-1][1] - spans[0][0]
+    target = max(total // max(n_shards, 1), min_bytes, 1)
+    shards = []
+    first = 0
+    for i, (start, end) in enumerate(spans):
+        if end - spans[first][0] >= target or i == len(spans) - 1:
+            shards.append(Shard(spans[first][0], end, i - first + 1))
+            first = i + 1
+    return shards
+
+
+def build_shard_plan(source: Union[str, Path], checkpoints_path: Union[str, Path], workers: int,
+                     shards_per_worker: int = SHARDS_PER_WORKER,
+                     min_shard_bytes: Optional[int] = None) -> ShardPlan:
+    """
+    Scan a local MRF once and split its in_network array into shards.
+
+    Args:
+        source: Local path of a .json or .json.gz MRF
+        checkpoints_path: Where gzip checkpoints are exported (gzip files only)
+        workers: Number of processes the shards are meant for
+        shards_per_worker: Shards per worker, for load balancing
+        min_shard_bytes: Smallest shard worth its own task (MIN_SHARD_BYTES by default)
+
+    Returns:
+        ShardPlan with section spans, shards and the checkpoint file
+    """
+    scanner = StructureScanner(item_sections=("in_network",))
+    checkpoints = None
+    with open_seekable_stream(source, build_checkpoints=True) as f:
+        reader = ScanningReader(f, scanner)
+        while reader.read(CHUNK_SIZE):
+            pass
+        if hasattr(f, "export_index"):
+            f.export_index(str(checkpoints_path))
+            checkpoints = str(checkpoints_path)
+
+    min_bytes = MIN_SHARD_BYTES if min_shard_bytes is None else min_shard_bytes
+    shards = split_spans(scanner.items, workers * shards_per_worker, min_bytes)
+    logger.info(f"Split {len(scanner.items)} in_network items of {source} into {len(shards)} shards")
+    return ShardPlan(str(source), os.path.getsize(source), checkpoints, scanner.sections, shards)
+
+
+class WrappedRangeReader:
+    """
+    Reader over `prefix + stream[start:end] + suffix`, making a byte range a JSON document.
+    """
+
+    def __init__(self, stream: BinaryIO, start: int, end: int, prefix: bytes, suffix: bytes):
+        self._parts = [prefix, RangeReader(stream, start, end), suffix]
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b""  # ijson probes the stream type with read(0)
+        while self._parts:
+            part = self._parts[0]
+            if isinstance(part, bytes):
+                self._parts.pop(0)
+                if part:
+                    return part
+                continue
+            data = part.read(size)
+            if data:
+                return data
+            self._parts.pop(0)
+        return b""
+
+
+@contextmanager
+def open_section(plan: ShardPlan, section: str) -> Iterator[Optional[BinaryIO]]:
+    """
+    Open a top-level array of the planned file as `{"<section>": [...]}`, or None if absent.
+    """
+    span = plan.sections.get(section)
+    if not span or span[1] is None:
+        yield None
+        return
+    with open_seekable_stream(plan.source, index_file=plan.checkpoints) as f:
+        # The span includes the array's own brackets
+        yield WrappedRangeReader(f, span[0], span[1], f'{{"{section}": '.encode(), b"}")
+
+
+@contextmanager
+def open_shard(plan: ShardPlan, shard: Shard) -> Iterator[BinaryIO]:
+    """
+    Open one shard as the document `{"in_network": [<its items>]}`.
+    """
+    with open_seekable_stream(plan.source, index_file=plan.checkpoints) as f:
+        yield WrappedRangeReader(f, shard.start, shard.end, b'{"in_network": [', b"]}")
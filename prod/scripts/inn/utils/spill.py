@@ -0,0 +1,68 @@
+# prod/inn/utils/spill.py
+"""
+Append-only buffer that spills to a temp file once it grows past a limit.
+"""
+
+import pickle
+import tempfile
+from typing import Any, Iterator, List, Optional
+
+SPILL_CHUNK = 50000
+
+
+class SpillBuffer:
+    """
+    Holds records in memory up to `max_items`, then pickles them to disk in chunks.
+
+    Iteration returns the records in insertion order, reading spilled chunks
+    back one at a time so memory stays bounded by `max_items`.
+    """
+
+    def __init__(self, max_items: int = SPILL_CHUNK, spill_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self._items: List[Any] = []
+        self._file = None
+        self._chunks = 0
+        self.count = 0
+
+    def append(self, record: Any) -> None:
+        self._items.append(record)
+        self.count += 1
+        if len(self._items) >= self.max_items:
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+        pickle.dump(self._items, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._chunks += 1
+        self._items = []
+
+    @property
+    def spilled(self) -> bool:
+        return self._chunks > 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._file is not None:
+            self._file.seek(0)
+            for _ in range(self._chunks):
+                yield from pickle.load(self._file)
+        yield from self._items
+
+    def clear(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._items = []
+        self._chunks = 0
+        self.count = 0
+
+    def __enter__(self) -> "SpillBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.clear()
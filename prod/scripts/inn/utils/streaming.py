@@ -0,0 +1,186 @@
+# prod/inn/utils/streaming.py
+"""
+Streaming helpers for reading (possibly gzipped) MRF files without holding them in memory.
+"""
+
+import gzip
+import io
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+import requests
+
+from . import metrics
+
+try:
+    import indexed_gzip
+except ImportError:  # optional: only needed for random access into cached .gz files
+    indexed_gzip = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 1024 * 1024  # 1 MiB read buffer for network and gunzip
+CHECKPOINT_SPACING = 32 * 1024 * 1024  # uncompressed bytes between gzip restart points
+
+
+class TeeReader(io.RawIOBase):
+    """
+    Raw reader that copies every byte it hands out into a sink file.
+
+    Used to spool the compressed HTTP body to local disk while it is being
+    parsed, so a second pass can read the local copy instead of re-downloading.
+    """
+
+    def __init__(self, source: BinaryIO, sink: BinaryIO):
+        self._source = source
+        self._sink = sink
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._source.readinto(b)
+        if n:
+            self._sink.write(memoryview(b)[:n])
+        return n
+
+    def drain(self) -> None:
+        """Copy whatever the consumer did not read into the sink."""
+        shutil.copyfileobj(self._source, self._sink, CHUNK_SIZE)
+
+
+class PrefixedReader(io.RawIOBase):
+    """
+    Raw reader that replays bytes already taken from a stream, then continues the stream.
+
+    Format detection reads a bounded prefix of an opened MRF; wrapping the
+    prefix and the rest of the stream lets the scraper read the document from
+    its first byte without opening or downloading it again.
+    """
+
+    def __init__(self, prefix: bytes, rest: BinaryIO, name: str = ""):
+        self._prefix = memoryview(prefix)
+        self._rest = rest
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        return self._rest.readinto(b)
+
+
+def is_remote(source: Union[str, Path]) -> bool:
+    return str(source).startswith("http")
+
+
+def is_gzip_file(path: Union[str, Path]) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+@contextmanager
+def open_seekable_stream(path: Union[str, Path], index_file: Optional[Union[str, Path]] = None,
+                         build_checkpoints: bool = False) -> Iterator[BinaryIO]:
+    """
+    Open a local MRF as a seekable decompressed stream.
+
+    For gzip files, `indexed_gzip` (if installed) keeps restart checkpoints
+    every CHECKPOINT_SPACING bytes, either loaded from `index_file` or built
+    while reading, so seeks decompress at most one spacing of data. Without
+    it, seeking falls back to decompressing from the start of the file.
+
+    Args:
+        path: Local path of a .json or .json.gz file
+        index_file: Previously exported gzip checkpoint index
+        build_checkpoints: Record checkpoints while reading so they can be exported
+
+    Yields:
+        Seekable binary file-like object producing the decompressed JSON bytes
+    """
+    if not is_gzip_file(path):
+        with open(path, "rb") as f:
+            yield f
+    elif indexed_gzip is not None and (index_file or build_checkpoints):
+        kwargs = {"index_file": str(index_file)} if index_file else {"spacing": CHECKPOINT_SPACING}
+        with indexed_gzip.IndexedGzipFile(str(path), **kwargs) as f:
+            yield f
+    else:
+        with gzip.open(path, "rb") as f:
+            yield f
+
+
+@contextmanager
+def open_raw_stream(source: Union[str, Path], session: Optional[requests.Session] = None) -> Iterator[BinaryIO]:
+    """
+    Open the raw (still compressed) byte stream of a URL or local file.
+
+    HTTP transfer encodings are undone here; file-level gzip is not.
+
+    Args:
+        source: URL or local path
+        session: Optional requests session to reuse pooled connections
+
+    Yields:
+        Binary file-like object positioned at the first byte
+    """
+    if is_remote(source):
+        getter = session.get if session is not None else requests.get
+        response = getter(str(source), stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise Exception(f"❌ Failed to fetch MRF: {response.status_code}")
+        response.raw.decode_content = True
+        # Keep the raw stream readable at EOF so gzip can probe for more members
+        response.raw.auto_close = False
+        try:
+            yield response.raw
+        finally:
+            response.close()
+    else:
+        with open(source, "rb") as f:
+            yield f
+
+
+@contextmanager
+def open_mrf_stream(source: Union[str, Path], spool_path: Optional[Union[str, Path]] = None,
+                    session: Optional[requests.Session] = None) -> Iterator[BinaryIO]:
+    """
+    Open an MRF as a decompressed binary stream suitable for ijson.
+
+    The body is pulled from the network (or disk) in fixed-size chunks and
+    gunzipped incrementally, so memory stays flat regardless of file size.
+
+    Args:
+        source: URL or local path of a .json or .json.gz file
+        spool_path: If given, the compressed bytes are also written here as they
+            are read, giving a local copy for later passes
+        session: Optional requests session to reuse pooled connections
+
+    Yields:
+        Binary file-like object producing the decompressed JSON bytes
+    """
+    with open_raw_stream(source, session=session) as raw:
+        if metrics.active():
+            raw = metrics.CountingReader(raw, "bytes_downloaded" if is_remote(source) else "bytes_read")
+        sink = open(spool_path, "wb") if spool_path else None
+        try:
+            reader = TeeReader(raw, sink) if sink else raw
+            buffered = io.BufferedReader(reader, CHUNK_SIZE)
+            if buffered.peek(2)[:2] == GZIP_MAGIC:
+                stream = gzip.GzipFile(fileobj=buffered, mode="rb")
+            else:
+                stream = buffered
+            yield metrics.CountingReader(stream, "bytes_decompressed") if metrics.active() else stream
+            if sink:
+                # Finish the spool even if the consumer stopped early
+                reader.drain()
+        finally:
+            if sink:
+                sink.close()
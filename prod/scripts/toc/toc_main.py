@@ -1,55 +1,61 @@
-import json
-import requests
-import gzip
+"""
+Stream a Table of Contents into an in-network manifest in a single pass.
+
+The TOC is downloaded once and parsed as a stream of ijson events: the
+format is detected from the first events, and each reporting_structure item
+is merged into the manifest as soon as it is complete. With a .jsonl or
+.parquet output the manifest is append-only, so memory stays flat however
+large the TOC is and `_main_relational --follow` can start on the first files
+while the TOC is still being read.
+"""
+
+import argparse
+import ijson
 from pathlib import Path
-from io import BytesIO
 
-from .utils.toc_format_check import detect_toc_format
+from .utils.toc_format_check import TocFormatDetector, iter_reporting_structures, smart_open
 from .utils import structure_level_inn
+from .utils.manifest import ManifestWriter
 
 
 TOC_INPUT = "https://tic-mrf.regence.com/mrf/current/2025-05-01_Regence%20BlueShield%20of%20Idaho,%20Inc.-ASO_index.json"
-OUTPUT_PATH = Path("prod/data/staging/staging_urls.json")
-
-def smart_load(source: str):
-    if source.startswith("http"):
-        print(f"🌐 Downloading: {source}")
-        r = requests.get(source)
-        r.raise_for_status()
-        content = r.content
-    else:
-        print(f"📂 Loading: {source}")
-        with open(source, "rb") as f:
-            content = f.read()
-
-    if content[:2] == b'\x1f\x8b':
-        with gzip.open(BytesIO(content), 'rt', encoding='utf-8') as f:
-            return json.load(f)
-    else:
-        return json.loads(content.decode("utf-8"))
+OUTPUT_PATH = Path("data/staging/in_network_manifest.jsonl")
+
+def stream_toc(source: str, output_path: Path = OUTPUT_PATH) -> tuple[str, ManifestWriter]:
+    """
+    Detect the TOC format and write its manifest in one streaming pass.
+
+    Args:
+        source: URL or local path of the TOC
+        output_path: Manifest path (.jsonl, .parquet directory or .json)
+
+    Returns:
+        Tuple of (detected format, closed manifest writer)
+    """
+    detector = TocFormatDetector()
+    with smart_open(source) as f, ManifestWriter(output_path) as writer:
+        for structure in iter_reporting_structures(ijson.parse(f), detector):
+            if detector.format == "structure_level_inn":
+                structure_level_inn.add_structure(writer, structure)
+    return detector.final_format(), writer
 
 def main():
-    print("🔎 Detecting TOC format...")
-    format_style = detect_toc_format(TOC_INPUT)
+    parser = argparse.ArgumentParser(description="Stream a TOC into an in-network manifest")
+    parser.add_argument("--source", default=TOC_INPUT, help="URL or local path of the TOC")
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH,
+                        help="Manifest path (.jsonl, .parquet directory or .json)")
+    args = parser.parse_args()
+
+    print(f"🌐 Streaming: {args.source}")
+    format_style, manifest = stream_toc(args.source, args.output)
     print(f"🧠 Detected: {format_style}")
 
-    toc_json = smart_load(TOC_INPUT)
-
     if format_style == "structure_level_inn":
-        manifest = structure_level_inn.extract_urls(toc_json)
-
-        print(f"\n🔗 Extracted {len(manifest)} in-network entries:")
-        for entry in manifest:
-            print("•", entry["location"])
-
-        OUTPUT_PATH = Path("data/staging/in_network_manifest.json")
-        OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with open(OUTPUT_PATH, "w") as f:
-            json.dump(manifest, f, indent=2)
-
-        print(f"\n✅ Manifest saved to: {OUTPUT_PATH}")
-
-    print(f"\n✅ Saved to: {OUTPUT_PATH}")
+        print(f"\n🔗 Extracted {manifest.count} in-network files "
+              f"({manifest.manifest.occurrences} listings, {len(manifest.manifest.plans)} plans)")
+        print(f"\n✅ Manifest saved to: {args.output}")
+    else:
+        print(f"❌ No manifest extractor for format: {format_style}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,486 @@
+"""
+Deduplicated in-network manifest.
+
+Real TOCs list the same in-network file under hundreds of reporting_structure
+entries, one per employer plan, often with a freshly signed URL each time.
+ManifestBuilder keys files by their normalized location (signed-URL query
+parameters stripped), interns every distinct plan into one plan table and
+keeps, per file, the references into that table. Each MRF therefore appears
+once in the manifest, however many plans point at it.
+
+A .json manifest is {"plans": [...], "files": [...]}, where each file
+carries "plan_refs" into "plans". load_manifest expands it back into the
+familiar list of entries with "reporting_plans" (sharing the interned plan
+dicts), and also accepts the legacy list layout, deduplicating it on the way.
+
+A .jsonl manifest, or a .parquet directory of part files, is append-only
+instead: ManifestWriter emits a "plan" row the first time a plan is seen, a
+"file" row the first time a file is seen, "link" rows when a later listing
+adds plans to a file, and an "end" row on close. Rows are written as the TOC
+is parsed, so iter_manifest can follow the manifest and hand files to
+consumers while the crawl is still running. While open, the writer flushes
+pending rows and touches the manifest every FLUSH_INTERVAL even when no new
+rows arrive; a follower that sees no update for FOLLOW_TIMEOUT assumes the
+writer died before its "end" row and raises TimeoutError.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Query parameters that only sign or expire a URL and do not identify the file
+SIGNED_URL_PARAMS = frozenset({
+    "expires", "signature", "key-pair-id", "policy",  # CloudFront
+    "awsaccesskeyid", "x-amz-security-token",  # S3 (v2)
+    "se", "sig", "sp", "spr", "sr", "st", "sv", "skoid", "sktid", "skt", "ske", "sks", "skv",  # Azure SAS
+    "token", "access_token",
+})
+SIGNED_URL_PREFIXES = ("x-amz-", "x-goog-")
+
+PLAN_FIELDS = ("plan_name", "plan_id", "plan_id_type", "plan_market_type")
+
+# Row layout of append-only manifests; JSONL rows may carry extra file fields
+MANIFEST_ROW_SCHEMA = pa.schema([
+    ("kind", pa.string()),  # plan | file | link | end
+    ("ref", pa.int32()),  # plan rows: index in the plan table
+    ("file_key", pa.string()),  # file and link rows: normalized location
+    ("location", pa.string()),
+    ("description", pa.string()),
+    ("reporting_entity", pa.string()),
+    ("reporting_entity_type", pa.string()),
+    ("last_updated", pa.string()),
+    ("toc_url", pa.string()),
+    ("plan_name", pa.string()),
+    ("plan_id", pa.string()),
+    ("plan_id_type", pa.string()),
+    ("plan_market_type", pa.string()),
+    ("plan_refs", pa.list_(pa.int32())),
+    ("occurrences", pa.int32()),
+])
+FLUSH_ROWS = 10_000  # rows per JSONL flush / Parquet part
+FLUSH_INTERVAL = 5.0  # seconds; pending rows are flushed (and the manifest touched) at least this often
+POLL_INTERVAL = 1.0  # seconds between checks when following a manifest
+FOLLOW_TIMEOUT = 60.0  # seconds without an update before a followed manifest's writer is presumed dead
+
+
+def normalize_location(location: str) -> str:
+    """
+    Key identifying the file behind a TOC location, ignoring URL signatures.
+
+    Scheme and host are lower-cased, the fragment and signing parameters are
+    dropped and the remaining query parameters are sorted.
+    """
+    parts = urlsplit(location.strip())
+    if not parts.scheme:
+        return location.strip()
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in SIGNED_URL_PARAMS and not k.lower().startswith(SIGNED_URL_PREFIXES)
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+class ManifestBuilder:
+    """
+    Merge manifest entries into one row per file with an interned plan table.
+
+    The first occurrence of a file supplies its location, description,
+    reporting entity and any other fields; last_updated is the latest seen.
+    Plans keep their first-seen order per file. Entries that are themselves
+    merged rows count with their own "occurrences".
+    """
+
+    def __init__(self):
+        self.plans: List[Dict] = []
+        self.files: Dict[str, Dict] = {}
+        self._plan_index: Dict[Tuple, int] = {}
+        self._refs: Dict[str, Dict[int, None]] = {}  # ordered set of plan refs per file
+        self.occurrences = 0
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, location: str) -> bool:
+        return normalize_location(location) in self.files
+
+    def intern_plan(self, plan: Dict) -> int:
+        """
+        Index of `plan` in the plan table, adding it if it is new.
+        """
+        key = tuple(plan.get(field) for field in PLAN_FIELDS)
+        ref = self._plan_index.get(key)
+        if ref is None:
+            ref = self._plan_index[key] = len(self.plans)
+            self.plans.append({field: plan.get(field) for field in PLAN_FIELDS})
+        return ref
+
+    def add(self, entry: Dict, plan_refs: Optional[Iterable[int]] = None) -> bool:
+        """
+        Merge one manifest entry.
+
+        Args:
+            entry: Entry with location, entity fields and reporting_plans
+            plan_refs: Already interned plan refs, used instead of entry["reporting_plans"]
+
+        Returns:
+            True if the entry introduced a new file
+        """
+        return self.merge(entry, plan_refs)[0]
+
+    def merge(self, entry: Dict, plan_refs: Optional[Iterable[int]] = None) -> Tuple[bool, str, List[int]]:
+        """
+        Merge one manifest entry and report what it changed.
+
+        Returns:
+            (is_new, file key, plan refs the file did not have before)
+        """
+        occurrences = entry.get("occurrences") or 1
+        self.occurrences += occurrences
+        key = normalize_location(entry["location"])
+        if plan_refs is None:
+            plan_refs = [self.intern_plan(plan) for plan in entry.get("reporting_plans", [])]
+        is_new = key not in self.files
+        if is_new:
+            self.files[key] = {k: v for k, v in entry.items() if k not in ("reporting_plans", "plan_refs")}
+            self.files[key].setdefault("last_updated", None)
+            self.files[key]["occurrences"] = 0
+            self._refs[key] = {}
+        else:
+            row = self.files[key]
+            if (entry.get("last_updated") or "") > (row["last_updated"] or ""):
+                row["last_updated"] = entry["last_updated"]
+        self.files[key]["occurrences"] += occurrences
+        refs = self._refs[key]
+        added = [ref for ref in dict.fromkeys(plan_refs) if ref not in refs]
+        refs.update(dict.fromkeys(added))
+        return is_new, key, added
+
+    def file_rows(self) -> List[Dict]:
+        """
+        Files with their plan_refs, in first-seen order.
+        """
+        return [{**row, "plan_refs": list(self._refs[key])} for key, row in self.files.items()]
+
+    def entries(self) -> List[Dict]:
+        """
+        Files as manifest entries with reporting_plans resolved from the plan table.
+        """
+        return [{**row, "reporting_plans": [self.plans[ref] for ref in self._refs[key]]}
+                for key, row in self.files.items()]
+
+    def to_dict(self) -> Dict:
+        return {"plans": self.plans, "files": self.file_rows()}
+
+    def save(self, path: Path) -> None:
+        """
+        Write the manifest atomically to `path`.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict]) -> "ManifestBuilder":
+        builder = cls()
+        for entry in entries:
+            builder.add(entry)
+        return builder
+
+
+def dedupe_entries(entries: Iterable[Dict]) -> List[Dict]:
+    """
+    One entry per file, with the plan lists of all its occurrences merged.
+    """
+    return ManifestBuilder.from_entries(entries).entries()
+
+
+def manifest_format(path: Path) -> str:
+    """
+    Manifest format implied by a path: "jsonl", "parquet" or "json".
+    """
+    suffix = Path(path).suffix.lower()
+    return {".jsonl": "jsonl", ".parquet": "parquet"}.get(suffix, "json")
+
+
+class ManifestWriter:
+    """
+    Thread-safe manifest writer, merging entries from any number of TOCs.
+
+    .json manifests are kept in a ManifestBuilder and written atomically on
+    close. .jsonl and .parquet manifests are written as rows while entries
+    arrive (see module docstring), so memory holds only the dedup index of
+    distinct files and plans and consumers can start before the crawl ends.
+    Listings that add nothing are only counted; their counts are written as
+    link rows on close. A manifest path is rewritten from scratch.
+
+    A background thread flushes pending rows every `flush_interval`, so a
+    row does not wait for the next entry, and touches the manifest as a
+    heartbeat for followers.
+
+    Args:
+        output_file: Manifest path (.json, .jsonl, or .parquet directory)
+        flush_rows: Rows per JSONL flush or Parquet part file, unless
+            `flush_interval` passes first
+        flush_interval: Seconds between background flushes
+    """
+
+    def __init__(self, output_file: Path, flush_rows: int = FLUSH_ROWS,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.output_file = Path(output_file)
+        self.format = manifest_format(self.output_file)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.manifest = ManifestBuilder()
+        self._lock = threading.Lock()
+        self._rows: List[Dict] = []
+        self._pending: Dict[str, int] = {}  # file key -> listings not yet written
+        self._parts = 0
+        self._f = None
+        self._closed = False
+        self._last_flush = time.monotonic()
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == "jsonl":
+            self._f = open(self.output_file, "w")
+        elif self.format == "parquet":
+            self.output_file.mkdir(exist_ok=True)
+            for part in self.output_file.glob("part-*.parquet"):
+                part.unlink()
+        self._stop = threading.Event()
+        self._timer = None
+        if self.format != "json":
+            self._timer = threading.Thread(target=self._flush_periodically, name="manifest-flush", daemon=True)
+            self._timer.start()
+
+    @property
+    def count(self) -> int:
+        return len(self.manifest)
+
+    def __enter__(self) -> "ManifestWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def intern_plan(self, plan: Dict) -> int:
+        with self._lock:
+            return self._intern_plan(plan)
+
+    def _intern_plan(self, plan: Dict) -> int:
+        known = len(self.manifest.plans)
+        ref = self.manifest.intern_plan(plan)
+        if ref >= known and self.format != "json":
+            self._emit({"kind": "plan", "ref": ref, **self.manifest.plans[ref]})
+        return ref
+
+    def write(self, entry: Dict, plan_refs: Optional[Iterable[int]] = None) -> None:
+        """
+        Merge one manifest entry, as ManifestBuilder.add.
+        """
+        with self._lock:
+            if plan_refs is None:
+                plan_refs = [self._intern_plan(plan) for plan in entry.get("reporting_plans", [])]
+            previous = self.manifest.files.get(normalize_location(entry["location"]), {}).get("last_updated")
+            is_new, key, added = self.manifest.merge(entry, plan_refs)
+            if self.format == "json":
+                return
+            row = self.manifest.files[key]
+            if is_new:
+                fields = {k: v for k, v in row.items() if k != "occurrences"}
+                self._emit({"kind": "file", "file_key": key, **fields, "plan_refs": added, "occurrences": 1})
+            elif added or row["last_updated"] != previous:
+                self._emit({"kind": "link", "file_key": key, "last_updated": row["last_updated"],
+                            "plan_refs": added, "occurrences": 1 + self._pending.pop(key, 0)})
+            else:
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+    add = write
+
+    def _emit(self, row: Dict) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                if self._closed:
+                    return
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush()
+                # Heartbeat: followers treat a manifest that stops changing as abandoned
+                os.utime(self.output_file)
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._rows:
+            return
+        if self.format == "jsonl":
+            self._f.write("".join(json.dumps(row) + "\n" for row in self._rows))
+            self._f.flush()
+        else:
+            columns = MANIFEST_ROW_SCHEMA.names
+            table = pa.Table.from_pylist([{k: row.get(k) for k in columns} for row in self._rows],
+                                         schema=MANIFEST_ROW_SCHEMA)
+            part = self.output_file / f"part-{self._parts:05d}.parquet"
+            tmp = part.with_name(f".{part.name}.tmp")
+            pq.write_table(table, tmp)
+            os.replace(tmp, part)  # readers only ever see complete parts
+            self._parts += 1
+        self._rows = []
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self.format == "json":
+                self.manifest.save(self.output_file)
+                return
+            for key, occurrences in self._pending.items():
+                self._emit({"kind": "link", "file_key": key, "plan_refs": [], "occurrences": occurrences})
+            self._pending = {}
+            self._emit({"kind": "end"})
+            self._flush()
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def _wait_for_writer(path: Path, since: float, timeout: Optional[float], poll_interval: float) -> None:
+    """
+    Sleep one poll interval, raising TimeoutError if `path` has not changed for `timeout` seconds.
+
+    Args:
+        since: Time (time.time()) the caller started waiting, for a manifest not created yet
+    """
+    if timeout is not None:
+        try:
+            updated = max(path.stat().st_mtime, since)
+        except FileNotFoundError:
+            updated = since
+        if time.time() - updated > timeout:
+            raise TimeoutError(f"❌ Manifest {path} not updated for {timeout:.0f}s; "
+                               f"its writer stopped before closing it")
+    time.sleep(poll_interval)
+
+
+def iter_manifest_rows(path: Path, follow: bool = False, poll_interval: float = POLL_INTERVAL,
+                       timeout: Optional[float] = FOLLOW_TIMEOUT) -> Iterator[Dict]:
+    """
+    Yield the rows of an append-only manifest, up to its "end" row.
+
+    Args:
+        path: .jsonl file or .parquet directory
+        follow: Keep waiting for rows until the writer closes the manifest
+        poll_interval: Seconds between checks for new rows when following
+        timeout: When following, raise TimeoutError once the manifest has not
+            changed for this many seconds (None waits forever); a live writer
+            touches it every FLUSH_INTERVAL
+    """
+    path = Path(path)
+    since = time.time()
+    if manifest_format(path) == "jsonl":
+        while follow and not path.exists():
+            _wait_for_writer(path, since, timeout, poll_interval)
+        with open(path) as f:
+            buffer = ""
+            while True:
+                line = f.readline()
+                if line.endswith("\n"):
+                    row = json.loads(buffer + line)
+                    buffer = ""
+                    if row["kind"] == "end":
+                        return
+                    yield row
+                elif not follow:
+                    return
+                else:
+                    buffer += line  # partial line; the rest is still being written
+                    _wait_for_writer(path, since, timeout, poll_interval)
+    else:
+        parts = 0
+        while True:
+            part = path / f"part-{parts:05d}.parquet"
+            if not part.exists():
+                if not follow:
+                    return
+                _wait_for_writer(path, since, timeout, poll_interval)
+                continue
+            for row in pq.read_table(part).to_pylist():
+                if row["kind"] == "end":
+                    return
+                yield {k: v for k, v in row.items() if v is not None}
+            parts += 1
+
+
+def iter_manifest(path: Path, follow: bool = False, poll_interval: float = POLL_INTERVAL,
+                  timeout: Optional[float] = FOLLOW_TIMEOUT) -> Iterator[Dict]:
+    """
+    Yield manifest entries with reporting_plans as soon as each file appears.
+
+    For append-only manifests an entry carries the plans known when its file
+    was first listed; plans linked later are only in load_manifest's result.
+    JSON manifests are read whole.
+
+    Args:
+        path: Manifest path
+        follow: For append-only manifests, wait for rows until the writer closes it
+        poll_interval: Seconds between checks for new rows when following
+        timeout: See iter_manifest_rows
+    """
+    if manifest_format(path) == "json":
+        yield from load_manifest(path)
+        return
+    plans: Dict[int, Dict] = {}
+    for row in iter_manifest_rows(path, follow, poll_interval, timeout):
+        if row["kind"] == "plan":
+            plans[row["ref"]] = {field: row.get(field) for field in PLAN_FIELDS}
+        elif row["kind"] == "file":
+            entry = {k: v for k, v in row.items() if k not in ("kind", "file_key", "plan_refs")}
+            entry["reporting_plans"] = [plans[ref] for ref in row.get("plan_refs") or []]
+            yield entry
+
+
+def load_manifest(path: Path) -> List[Dict]:
+    """
+    Read a manifest as a list of deduplicated entries with reporting_plans.
+
+    Accepts the {"plans", "files"} layout, a legacy list of entries and the
+    append-only .jsonl/.parquet layouts.
+    """
+    if manifest_format(path) != "json":
+        builder = ManifestBuilder()
+        refs: Dict[int, int] = {}
+        for row in iter_manifest_rows(path):
+            if row["kind"] == "plan":
+                refs[row["ref"]] = builder.intern_plan(row)
+            elif row["kind"] in ("file", "link"):
+                entry = {k: v for k, v in row.items() if k not in ("kind", "file_key", "plan_refs")}
+                entry["location"] = row["location"] if row["kind"] == "file" else row["file_key"]
+                builder.add(entry, [refs[ref] for ref in row.get("plan_refs") or []])
+        return builder.entries()
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return dedupe_entries(data)
+    plans = data.get("plans", [])
+    return [{**{k: v for k, v in row.items() if k != "plan_refs"},
+             "reporting_plans": [plans[ref] for ref in row.get("plan_refs", [])]}
+            for row in data.get("files", [])]
@@ -5,6 +5,8 @@ Utilities for extracting information from structure-level in-network files.
 from datetime import datetime
 from typing import List, Dict
 
+from .manifest import ManifestBuilder
+
 def extract_plan_info(plan: dict) -> dict:
     """
     Extract relevant plan information from a plan object.
@@ -25,6 +27,9 @@ def extract_plan_info(plan: dict) -> dict:
 def extract_urls(toc_json: dict) -> List[Dict]:
     """
     Extract URLs and associated metadata from a TOC JSON structure.
+
+    Each in-network file is returned once, keyed by its normalized location,
+    with the plans of every reporting_structure that lists it merged.
     
     Args:
         toc_json: Dictionary containing the TOC JSON structure
@@ -37,35 +42,59 @@ def extract_urls(toc_json: dict) -> List[Dict]:
             'reporting_entity': str,
             'reporting_entity_type': str,
             'last_updated': str,
+            'occurrences': int,
             'reporting_plans': List[Dict]
         }
     """
-    results = []
+    return build_manifest(toc_json).entries()
 
-    for group in toc_json.get("reporting_structure", []):
-        # Extract entity information
-        entity_info = {
-            "reporting_entity_name": group.get("reporting_entity_name", "Unknown"),
-            "reporting_entity_type": group.get("reporting_entity_type", "Unknown"),
-            "last_updated": group.get("last_updated", datetime.now().isoformat())
-        }
-        
-        # Extract plan information
-        reporting_plans = []
-        for plan in group.get("reporting_plans", []):
-            reporting_plans.append(extract_plan_info(plan))
+def build_manifest(toc_json: dict) -> ManifestBuilder:
+    """
+    Merge the in-network files of a TOC JSON structure into a ManifestBuilder.
+    
+    Args:
+        toc_json: Dictionary containing the TOC JSON structure
         
-        # Process in-network files
-        for entry in group.get("in_network_files", []):
-            location = entry.get("location")
-            if location:
-                results.append({
-                    "location": location,
-                    "description": entry.get("description", "N/A"),
-                    "reporting_entity": entity_info["reporting_entity_name"],
-                    "reporting_entity_type": entity_info["reporting_entity_type"],
-                    "last_updated": entity_info["last_updated"],
-                    "reporting_plans": reporting_plans
-                })
+    Returns:
+        ManifestBuilder holding one row per file and the interned plan table
+    """
+    builder = ManifestBuilder()
+    for group in toc_json.get("reporting_structure", []):
+        add_structure(builder, group)
+    return builder
 
-    return results
+def add_structure(manifest, group: dict) -> int:
+    """
+    Merge the in-network files of one reporting_structure item into a manifest.
+    
+    Args:
+        manifest: ManifestBuilder or ManifestWriter
+        group: reporting_structure item
+        
+    Returns:
+        Number of in-network files listed by the item
+    """
+    # Extract entity information
+    entity_info = {
+        "reporting_entity_name": group.get("reporting_entity_name", "Unknown"),
+        "reporting_entity_type": group.get("reporting_entity_type", "Unknown"),
+        "last_updated": group.get("last_updated", datetime.now().isoformat())
+    }
+    
+    # Intern plan information once per structure
+    plan_refs = [manifest.intern_plan(extract_plan_info(plan)) for plan in group.get("reporting_plans", [])]
+    
+    # Process in-network files
+    listed = 0
+    for entry in group.get("in_network_files", []):
+        location = entry.get("location")
+        if location:
+            manifest.add({
+                "location": location,
+                "description": entry.get("description", "N/A"),
+                "reporting_entity": entity_info["reporting_entity_name"],
+                "reporting_entity_type": entity_info["reporting_entity_type"],
+                "last_updated": entity_info["last_updated"]
+            }, plan_refs)
+            listed += 1
+    return listed
@@ -1,46 +1,92 @@
 import requests
 import gzip
 import ijson
-from io import BytesIO, TextIOWrapper
+import io
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, Tuple
 
-def smart_open(source: str):
+READ_BUFFER = 1024 * 1024
+REQUEST_TIMEOUT = (10, 300)  # (connect, read) seconds
+
+@contextmanager
+def smart_open(source: str, session: Optional[requests.Session] = None):
+    """
+    Open a local or remote TOC as a binary stream, gunzipping it on the fly if needed.
+
+    Nothing is buffered beyond READ_BUFFER, so a TOC of any size is read in
+    one pass at constant memory.
+    """
     if source.startswith("http"):
-        r = requests.get(source, stream=True)
-        content = BytesIO(r.content)
+        response = (session or requests).get(source, stream=True, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        response.raw.decode_content = True  # undo Content-Encoding, if any
+        response.raw.auto_close = False  # stay readable at EOF so gzip can probe for more members
+        raw, closer = response.raw, response
     else:
-        with open(source, "rb") as f:
-            content = BytesIO(f.read())
+        raw = closer = open(source, "rb")
 
-    # Check for gzip magic number
-    if content.getbuffer().nbytes >= 2 and content.read(2) == b'\x1f\x8b':
-        content.seek(0)
-        return gzip.open(content, 'rt', encoding='utf-8')
-    else:
-        content.seek(0)
-        return TextIOWrapper(content, encoding='utf-8')
+    with closer:
+        stream = io.BufferedReader(raw, READ_BUFFER)
+        # Check for gzip magic number
+        if stream.peek(2)[:2] == b'\x1f\x8b':
+            yield gzip.GzipFile(fileobj=stream)
+        else:
+            yield stream
 
-def detect_toc_format(source: str) -> str:
-    f = smart_open(source)
-    parser = ijson.parse(f)
+class TocFormatDetector:
+    """
+    Classify a TOC from its ijson parse events as they stream past.
+
+    `format` becomes "structure_level_inn" at the first in_network_files
+    array inside reporting_structure, usually within the first few events.
+    Until then, or if the document ends without one, `final_format()`
+    falls back to "plan_level_inn" when reporting_plans were seen.
+    """
 
-    found_in_network = False
-    found_plan_level = False
-    inside_structure = False
+    def __init__(self):
+        self.format: Optional[str] = None
+        self.inside_structure = False
+        self.found_plan_level = False
 
-    for prefix, event, value in parser:
+    def feed(self, prefix: str, event: str) -> Optional[str]:
         if prefix == "reporting_structure" and event == "start_array":
-            inside_structure = True
-        elif inside_structure and prefix.endswith(".in_network_files") and event == "start_array":
-            found_in_network = True
-        elif inside_structure and prefix.endswith(".reporting_plans") and event == "start_array":
-            found_plan_level = True
+            self.inside_structure = True
+        elif self.inside_structure and prefix.endswith(".in_network_files") and event == "start_array":
+            self.format = "structure_level_inn"
+        elif self.inside_structure and prefix.endswith(".reporting_plans") and event == "start_array":
+            self.found_plan_level = True
+        return self.format
 
-        # if we found what we need, break early
-        if found_in_network:
-            return "structure_level_inn"
+    def final_format(self) -> str:
+        if self.format:
+            return self.format
+        return "plan_level_inn" if self.found_plan_level else "unknown"
 
-    if found_plan_level:
-        return "plan_level_inn"
+def detect_toc_format(source: str) -> str:
+    detector = TocFormatDetector()
+    with smart_open(source) as f:
+        for prefix, event, value in ijson.parse(f):
+            # if we found what we need, break early
+            if detector.feed(prefix, event):
+                break
+    return detector.final_format()
 
-    return "unknown"
+def iter_reporting_structures(events: Iterable[Tuple[str, str, object]],
+                              detector: Optional[TocFormatDetector] = None) -> Iterator[dict]:
+    """
+    Build reporting_structure items from a stream of ijson parse events.
 
+    Every event is also fed to `detector`, so the format is known before the
+    first structure is complete, in the same pass that yields the structures.
+    """
+    builder = None
+    for prefix, event, value in events:
+        if detector is not None:
+            detector.feed(prefix, event)
+        if prefix == "reporting_structure.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == "reporting_structure.item" and event == "end_map":
+                yield builder.value
+                builder = None
@@ -0,0 +1,123 @@
+"""
+Shared fixtures: a local stand-in HTTP server for payer hosts.
+
+Run from prod/:
+    python -m pytest tests
+"""
+
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import pytest
+
+# Tests import the pipeline as `scripts.*`, as it is run from prod/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class StandInServer:
+    """
+    Serves files under `root`; a path in `routes` is answered by its callable instead.
+
+    Every request is recorded as (path, headers) in `requests`.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.routes: Dict[str, Callable] = {}
+        self.requests: List = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=str(root), **kwargs)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _record(self) -> None:
+                with server._lock:
+                    server.requests.append((self.path, dict(self.headers)))
+
+            def do_GET(self) -> None:
+                self._record()
+                route = server.routes.get(self.path.split("?")[0])
+                if route is not None:
+                    route(self)
+                else:
+                    super().do_GET()
+
+            def do_HEAD(self) -> None:
+                self._record()
+                route = server.routes.get(self.path.split("?")[0])
+                if route is not None:
+                    route(self)
+                else:
+                    super().do_HEAD()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def count(self, path: str) -> int:
+        with self._lock:
+            return sum(1 for p, _ in self.requests if p == "/" + path.lstrip("/"))
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def send_body(handler, body: bytes, status: int = 200, headers: Dict[str, str] = None) -> None:
+    """
+    Answer a stand-in request with `body`.
+    """
+    handler.send_response(status)
+    for name, value in {"Content-Length": str(len(body)), **(headers or {})}.items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    if handler.command != "HEAD":
+        handler.wfile.write(body)
+
+
+def write_synthetic_mrf(path: Path, **spec) -> Path:
+    """
+    Write a small seeded synthetic MRF (see bench.synthetic) with rates for the scraper's CPT codes.
+    """
+    from scripts.bench.synthetic import MRFSpec, write_mrf
+    from scripts.inn.scrapers.grouped_by_provider_reference import CPT_CODES
+
+    small = dict(provider_groups=40, max_group_size=20, billing_codes=30, rates_per_code=4, target_boost=3)
+    write_mrf(path, MRFSpec(**{**small, **spec}), target_codes=sorted(CPT_CODES))
+    return path
+
+
+def flat_rows(table) -> List:
+    """
+    Rows of a flat rate table as sorted tuples, for order-insensitive comparison.
+    """
+    columns = ["cpt", "npi", "tin", "pos", "negotiated_rate"]
+    return sorted(zip(*[table[c].to_pylist() for c in columns]), key=repr)
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "www"
+    root.mkdir()
+    stand_in = StandInServer(root).start()
+    yield stand_in
+    stand_in.stop()
@@ -0,0 +1,41 @@
+from conftest import write_synthetic_mrf
+
+from scripts.inn.analyze_relational import RelationalQueryEngine
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_normalized_tables, stream_mrf_to_table
+from scripts.inn.transformers.relational import save_relational_dataset, save_relational_tables, transform_to_relational
+
+
+def _write_sources(tmp_path):
+    """Two scraped files in both layouts; returns each source's flat rates as pandas."""
+    flat = {}
+    for seed in (1, 2):
+        source = f"plan{seed}"
+        path = write_synthetic_mrf(tmp_path / f"{source}.json.gz", seed=seed)
+        url = f"http://example.test/{source}.json.gz"
+        flat[source] = stream_mrf_to_table(str(path)).to_pandas()
+        tables = transform_to_relational(stream_mrf_to_normalized_tables(str(path)), url, "Plan")
+        save_relational_tables(tables, str(tmp_path / "relational"), source)
+        save_relational_dataset(tables, str(tmp_path / "relational" / "dataset"), source, "Plan", "2025-05")
+    return flat
+
+
+def _expected_pairs(flat):
+    """(source, cpt) -> number of rate x provider rows in the flat scrape."""
+    return {(source, cpt): int(n)
+            for source, frame in flat.items()
+            for cpt, n in frame.groupby("cpt").size().items()}
+
+
+def test_sql_reports_match_pandas_over_the_scraped_rows(tmp_path):
+    flat = _write_sources(tmp_path)
+    expected = _expected_pairs(flat)
+
+    for dataset in (False, True):
+        engine = RelationalQueryEngine(tmp_path / "relational", dataset=dataset)
+        assert engine.has("negotiated_rates", "providers", "provider_groups")
+        counts = engine.query("""
+            SELECT source, cpt_code, count(*) AS n FROM rate_providers GROUP BY source, cpt_code
+        """)
+        actual = {(r.source, r.cpt_code): int(r.n) for r in counts.itertuples()}
+        assert actual == expected, f"dataset={dataset}"
+        assert engine.scalar("SELECT count(DISTINCT source) FROM negotiated_rates") == 2
@@ -0,0 +1,24 @@
+import json
+
+import pyarrow.compute as pc
+import pytest
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import (
+    CPT_CODES, extract_codes_from_index, stream_mrf_to_table,
+)
+
+
+@pytest.mark.parametrize("name", ["mrf.json", "mrf.json.gz"])
+def test_indexed_extract_matches_the_full_scrape(tmp_path, name):
+    path = write_synthetic_mrf(tmp_path / name, billing_codes=60)
+    index_path = tmp_path / "mrf.index.json"
+
+    full = stream_mrf_to_table(str(path), index_path=str(index_path))
+    index = json.loads(index_path.read_text())
+    assert set(CPT_CODES) <= set(index["codes"])
+
+    assert flat_rows(extract_codes_from_index(str(path), str(index_path), CPT_CODES)) == flat_rows(full)
+    code = sorted(CPT_CODES)[0]
+    one = extract_codes_from_index(str(path), str(index_path), [code])
+    assert flat_rows(one) == flat_rows(full.filter(pc.equal(full["cpt"], code)))
@@ -0,0 +1,82 @@
+import json
+from pathlib import Path
+
+from conftest import send_body
+
+from scripts.inn.utils.cache import MRFCache
+
+
+def test_body_without_validators_is_refetched(server, tmp_path):
+    bodies = [b'{"version": 1}', b'{"version": 2}', b'{"version": 2}']
+
+    def no_validators(handler):
+        send_body(handler, bodies.pop(0), headers={"Content-Type": "application/json"})
+
+    server.routes["/mrf.json"] = no_validators
+    cache = MRFCache(tmp_path / "cache")
+    url = server.url("mrf.json")
+
+    first = cache.fetch(url)
+    assert first.read_bytes() == b'{"version": 1}'
+
+    second = cache.fetch(url)
+    assert second.read_bytes() == b'{"version": 2}'
+    assert second != first and not first.exists()
+
+    # An unchanged body keeps its blob
+    assert cache.fetch(url) == second
+    assert server.count("mrf.json") == 3
+
+
+def test_etag_revalidation_is_a_cache_hit(server, tmp_path):
+    def with_etag(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            send_body(handler, b"", status=304)
+        else:
+            send_body(handler, b'{"version": 1}', headers={"ETag": '"v1"'})
+
+    server.routes["/mrf.json"] = with_etag
+    cache = MRFCache(tmp_path / "cache")
+    url = server.url("mrf.json")
+
+    first = cache.fetch(url)
+    assert cache.fetch(url) == first
+    assert first.read_bytes() == b'{"version": 1}'
+    assert server.requests[-1][1].get("If-None-Match") == '"v1"'
+
+
+def test_evict_reads_only_metadata_not_json_blobs(server, tmp_path, monkeypatch):
+    from scripts.inn.utils import cache as cache_module
+
+    # Uncompressed MRFs keep their .json suffix; a body shaped like a metadata record must stay a blob
+    for name in ("a.json", "b.json"):
+        (server.root / name).write_text(json.dumps({"blob": name, "last_access": 0, "pad": "x" * 1000}))
+    mrf_cache = MRFCache(tmp_path / "cache", max_bytes=1500)
+    first = mrf_cache.fetch(server.url("a.json"))
+
+    loaded = []
+    real_load = json.load
+    monkeypatch.setattr(cache_module.json, "load", lambda f: loaded.append(f.name) or real_load(f))
+    second = mrf_cache.fetch(server.url("b.json"))
+
+    assert not any(Path(name).parent == mrf_cache.root for name in loaded)
+    # The least recently used blob was evicted, the new one kept
+    assert not first.exists() and second.exists()
+    assert mrf_cache.lookup(server.url("a.json")) is None
+
+
+def test_resigned_url_revalidates_the_cached_copy(server, tmp_path):
+    def with_etag(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            send_body(handler, b"", status=304)
+        else:
+            send_body(handler, b'{"version": 1}', headers={"ETag": '"v1"'})
+
+    server.routes["/mrf.json"] = with_etag
+    cache = MRFCache(tmp_path / "cache")
+
+    first = cache.fetch(server.url("mrf.json?Expires=1&Signature=a"))
+    assert cache.fetch(server.url("mrf.json?Expires=2&Signature=b")) == first
+    # The request itself carries the new signature
+    assert server.requests[-1][0] == "/mrf.json?Expires=2&Signature=b"
+    assert server.requests[-1][1].get("If-None-Match") == '"v1"'
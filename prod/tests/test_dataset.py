@@ -0,0 +1,52 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from scripts.inn.transformers.relational import (
+    compact_relational_dataset, save_relational_dataset, transform_to_relational,
+)
+from scripts.inn.utils.columnar import FLAT_RATE_SCHEMA
+
+ROW = {"cpt": "99213", "npi": 1111111111, "tin": "111", "pos": "11", "negotiated_rate": 100.0}
+
+
+def _tables(source, rates):
+    rows = [dict(ROW, negotiated_rate=rate) for rate in rates]
+    flat = pa.Table.from_pylist(rows, schema=FLAT_RATE_SCHEMA)
+    return transform_to_relational(flat, f"http://example.test/{source}.json", "Payer")
+
+
+def _rates(root, source=None):
+    dataset = ds.dataset(root / "negotiated_rates", format="parquet", partitioning="hive")
+    table = dataset.to_table(filter=ds.field("source") == source if source else None)
+    return sorted(table["negotiated_rate"].to_pylist())
+
+
+def test_dataset_is_hive_partitioned_and_round_trips(tmp_path):
+    save_relational_dataset(_tables("plan", [100.0, 90.0]), str(tmp_path), "plan", "Payer", "2025-01")
+
+    files = list((tmp_path / "negotiated_rates").rglob("*.parquet"))
+    assert [p.relative_to(tmp_path / "negotiated_rates").parts[:-1] for p in files] == [
+        ("reporting_entity=Payer", "release_month=2025-01", "cpt_code=99213")
+    ]
+    assert _rates(tmp_path) == [90.0, 100.0]
+
+
+def test_rerunning_a_source_keeps_sources_sharing_its_prefix(tmp_path):
+    save_relational_dataset(_tables("plan", [100.0]), str(tmp_path), "plan", "Payer", "2025-01")
+    save_relational_dataset(_tables("plan-2", [200.0]), str(tmp_path), "plan-2", "Payer", "2025-01")
+    save_relational_dataset(_tables("plan-ab", [300.0]), str(tmp_path), "plan-ab", "Payer", "2025-01")
+
+    save_relational_dataset(_tables("plan", [110.0]), str(tmp_path), "plan", "Payer", "2025-01")
+
+    assert _rates(tmp_path, "plan") == [110.0]
+    assert _rates(tmp_path, "plan-2") == [200.0]
+    assert _rates(tmp_path, "plan-ab") == [300.0]
+
+
+def test_rerun_after_compaction_replaces_only_that_source(tmp_path):
+    for source, rate in (("plan", 100.0), ("plan-2", 200.0)):
+        save_relational_dataset(_tables(source, [rate]), str(tmp_path), source, "Payer", "2025-01")
+    compact_relational_dataset(str(tmp_path))
+
+    save_relational_dataset(_tables("plan", [110.0]), str(tmp_path), "plan", "Payer", "2025-01")
+    assert _rates(tmp_path) == [110.0, 200.0]
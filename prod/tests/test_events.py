@@ -0,0 +1,41 @@
+import io
+import json
+
+import ijson
+
+from scripts.inn.utils.events import SECTION_END, Skipped, iter_items
+
+
+def _doc():
+    return {
+        "in_network": [
+            {"billing_code": "99213", "negotiated_rates": [{"provider_references": [1]}]},
+            {"billing_code": "00000", "negotiated_rates": [{"provider_references": [2], "nested": {"a": [1, 2]}}]},
+            # billing_code after the bulky part: rejected only once it is read
+            {"negotiated_rates": [{"provider_references": [3]}], "billing_code": "11111"},
+            {"negotiated_rates": [{"provider_references": [4]}], "billing_code": "99213"},
+        ],
+        "provider_references": [{"provider_group_id": 1}],
+    }
+
+
+def test_filtered_items_are_skipped_and_the_rest_match_ijson():
+    raw = json.dumps(_doc()).encode()
+    prefixes = ["in_network.item", "provider_references.item"]
+
+    got = list(iter_items(io.BytesIO(raw), prefixes, {"in_network.item": ("billing_code", {"99213"})}))
+
+    kept = [(p, item) for p, item in got if item is not SECTION_END and not isinstance(item, Skipped)]
+    assert kept == [
+        ("in_network.item", _doc()["in_network"][0]),
+        ("in_network.item", _doc()["in_network"][3]),
+        ("provider_references.item", {"provider_group_id": 1}),
+    ]
+    assert [item for _, item in got if isinstance(item, Skipped)] == [Skipped("00000"), Skipped("11111")]
+    assert [p for p, item in got if item is SECTION_END] == prefixes
+
+
+def test_unfiltered_walk_builds_what_ijson_builds():
+    raw = json.dumps(_doc()).encode()
+    got = [item for p, item in iter_items(io.BytesIO(raw), ["in_network.item"]) if item is not SECTION_END]
+    assert got == list(ijson.items(io.BytesIO(raw), "in_network.item"))
@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+
+from conftest import send_body
+
+from scripts import fetch_from_toc
+from scripts.fetch_from_toc import crawl_tocs
+from scripts.toc.utils.manifest import iter_manifest_rows, load_manifest
+
+FILES = 1000  # large enough that the first half spans several of ijson's reads
+
+
+def _toc(name, files=FILES):
+    return json.dumps({
+        "reporting_entity_name": name,
+        "reporting_structure": [{
+            "reporting_plans": [{"plan_name": f"{name} plan {i % 3}", "plan_id": str(i % 3),
+                                 "plan_market_type": "group"}],
+            "in_network_files": [{"location": f"https://mrf.example/{name}/{i}.json.gz?Signature=s{i}",
+                                  "description": f"file {i}"}],
+        } for i in range(files)],
+    }).encode()
+
+
+def test_toc_dropped_mid_body_resumes_without_duplicates_or_gaps(server, tmp_path, monkeypatch, capsys):
+    # Small reads, so entries from before the drop are parsed and written
+    monkeypatch.setattr(fetch_from_toc, "READ_BUFFER", 4096)
+    body = _toc("payer")
+    attempts = []
+
+    def drops_once(handler):
+        attempts.append(len(attempts))
+        if len(attempts) > 1:
+            send_body(handler, body)
+            return
+        # Promise the whole body, send half of it and hang up
+        handler.send_response(200)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body[:len(body) // 2])
+        handler.wfile.flush()
+        handler.close_connection = True
+
+    server.routes["/toc.json"] = drops_once
+    output = tmp_path / "manifest.jsonl"
+    results = crawl_tocs([server.url("toc.json")], output, backoff_factor=0)
+
+    assert results[server.url("toc.json")] == {"status": "ok", "entries": FILES, "error": None}
+    assert len(attempts) == 2
+    assert "🔁 Retrying" in capsys.readouterr().out
+    files = [row["file_key"] for row in iter_manifest_rows(output) if row["kind"] == "file"]
+    assert files == [f"https://mrf.example/payer/{i}.json.gz" for i in range(FILES)]
+    assert all(entry["occurrences"] == 1 for entry in load_manifest(output))
+
+
+def test_per_host_limit_caps_concurrent_requests(server, tmp_path):
+    in_flight, peak = {}, {}
+    lock = threading.Lock()
+
+    def slow(handler):
+        host = handler.headers["Host"].split(":")[0]
+        with lock:
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+        time.sleep(0.2)
+        with lock:
+            in_flight[host] -= 1
+        send_body(handler, _toc(handler.path.strip("/"), files=2))
+
+    urls = []
+    for i in range(6):
+        server.routes[f"/toc{i}.json"] = slow
+        urls.append(server.url(f"toc{i}.json"))
+        # Same server under a second host name, which gets its own limit
+        urls.append(server.url(f"toc{i}.json").replace("127.0.0.1", "localhost"))
+
+    results = crawl_tocs(urls, tmp_path / "manifest.jsonl", workers=12, per_host=2)
+
+    assert all(result["status"] == "ok" for result in results.values())
+    assert peak == {"127.0.0.1": 2, "localhost": 2}
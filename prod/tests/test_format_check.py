@@ -0,0 +1,77 @@
+import gzip
+import io
+
+import pytest
+from conftest import write_synthetic_mrf
+
+from scripts.inn import format_check
+from scripts.inn.format_check import FORMAT_SIGNATURES, detect_format, detect_format_from_stream, open_detected
+from scripts.inn.scrapers import SCRAPERS
+from scripts.inn.utils.events import PARSE_BUF_SIZE
+
+LAYOUTS = [
+    ("refs_first.json.gz", {}, "grouped_by_provider_reference"),
+    ("refs_last.json.gz", {"refs_first": False}, "grouped_by_provider_reference"),
+    ("inline.json.gz", {"inline_groups": True}, "inline_provider_groups"),
+]
+
+
+class CountingStream(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+        self.read_bytes = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._data.readinto(b)
+        self.read_bytes += n
+        return n
+
+
+@pytest.mark.parametrize("name, spec, expected", LAYOUTS)
+def test_layouts_are_detected_locally_and_remotely(server, tmp_path, name, spec, expected):
+    path = write_synthetic_mrf(tmp_path / "www" / name, **spec)
+    assert detect_format(str(path)) == expected
+    assert detect_format(server.url(name)) == expected
+    assert expected in SCRAPERS
+
+
+@pytest.mark.parametrize("name, spec, expected", LAYOUTS)
+def test_detection_reads_a_bounded_prefix(tmp_path, name, spec, expected):
+    mrf = write_synthetic_mrf(tmp_path / name, provider_groups=2000, billing_codes=300, **spec)
+    document = gzip.decompress(mrf.read_bytes())
+    assert len(document) > 2 * PARSE_BUF_SIZE
+    stream = CountingStream(document)
+    format_style, prefix = detect_format_from_stream(stream)
+
+    # The signature is in the first parser buffer, so nothing past it is read
+    assert format_style == expected
+    assert stream.read_bytes == len(prefix) <= PARSE_BUF_SIZE
+
+
+def test_undetected_document_stops_at_the_limit():
+    document = b'{"reporting_entity_name": "' + b"x" * 100_000 + b'", "in_network": []}'
+    stream = CountingStream(document)
+    assert detect_format_from_stream(stream, limit=10_000) == ("unknown", document[:10_000])
+    assert stream.read_bytes == 10_000
+
+
+def test_remote_detection_requests_only_the_head(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(format_check, "RANGE_BYTES", 4096)
+    write_synthetic_mrf(tmp_path / "www" / "mrf.json.gz", provider_groups=2000)
+    assert detect_format(server.url("mrf.json.gz")) == "grouped_by_provider_reference"
+    (_, headers), = server.requests
+    assert headers["Range"] == "bytes=0-4095"
+
+
+def test_open_detected_hands_on_the_whole_document(tmp_path):
+    path = write_synthetic_mrf(tmp_path / "mrf.json.gz")
+    with open_detected(str(path)) as (format_style, stream):
+        assert format_style == "grouped_by_provider_reference"
+        assert stream.read() == gzip.decompress(path.read_bytes())
+
+
+def test_every_signature_has_a_scraper():
+    assert {signature.format for signature in FORMAT_SIGNATURES} <= set(SCRAPERS)
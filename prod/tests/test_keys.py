@@ -0,0 +1,20 @@
+from collections import Counter
+
+import numpy as np
+
+from scripts.inn.utils.keys import KeyCounts, occurrence_index
+
+
+def test_occurrence_index_across_batches_matches_a_counter():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(-50, 50, size=5000).astype(np.int64)
+    seen = KeyCounts()
+    got = np.concatenate([occurrence_index(batch, seen) for batch in np.array_split(keys, 37)])
+
+    counter, expected = Counter(), []
+    for key in keys.tolist():
+        expected.append(counter[key])
+        counter[key] += 1
+    assert got.tolist() == expected
+    assert len(seen) >= len(counter)
+    assert seen.get(np.array(sorted(counter), dtype=np.int64)).tolist() == [counter[k] for k in sorted(counter)]
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from scripts.toc.utils.manifest import (
+    ManifestBuilder, ManifestWriter, iter_manifest, iter_manifest_rows, load_manifest, manifest_format, normalize_location,
+)
+
+
+def _entry(i):
+    return {"location": f"https://mrf.example/{i}.json.gz", "reporting_entity": "Payer",
+            "reporting_plans": [{"plan_name": "Plan", "plan_id": "1"}]}
+
+
+@pytest.mark.parametrize("name", ["manifest.jsonl", "manifest.parquet"])
+def test_rows_are_flushed_without_further_entries(tmp_path, name):
+    path = tmp_path / name
+    with ManifestWriter(path, flush_interval=0.1) as writer:
+        writer.write(_entry(0))
+        # No second entry arrives to trigger the flush, yet a follower sees the first
+        followed = iter_manifest(path, follow=True, poll_interval=0.05)
+        first = next(followed)
+        assert first["location"] == _entry(0)["location"]
+        writer.write(_entry(1))
+    assert [entry["location"] for entry in followed] == [_entry(1)["location"]]
+
+
+def test_follow_times_out_when_writer_dies(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text('{"kind": "plan", "ref": 0, "plan_name": "Plan"}\n')  # a writer that never wrote "end"
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(iter_manifest_rows(path, follow=True, poll_interval=0.05, timeout=0.3))
+    assert time.monotonic() - started < 5
+
+
+def test_heartbeat_keeps_an_idle_writer_alive(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    writer = ManifestWriter(path, flush_interval=0.05)
+    writer.write(_entry(0))
+    threading.Timer(0.6, writer.close).start()  # idle for longer than the follower's timeout
+
+    rows = list(iter_manifest_rows(path, follow=True, poll_interval=0.05, timeout=0.3))
+    assert [row["kind"] for row in rows] == ["plan", "file"]
+
+
+def _listing(signature, plans, last_updated="2025-01-01"):
+    return {"location": f"https://MRF.example/in_network/a.json.gz?Expires=1&Signature={signature}&v=2",
+            "reporting_entity": "Payer", "last_updated": last_updated,
+            "reporting_plans": [{"plan_name": p, "plan_id": p} for p in plans]}
+
+
+@pytest.mark.parametrize("name", ["manifest.json", "manifest.jsonl", "manifest.parquet"])
+def test_signed_listings_of_one_file_merge_into_one_entry(tmp_path, name):
+    listings = [_listing("x", ["A", "B"]), _listing("y", ["B", "C"], "2025-02-01"), _entry(0), _listing("z", ["A"])]
+    path = tmp_path / name
+    if manifest_format(path) == "json":
+        ManifestBuilder.from_entries(listings).save(path)
+    else:
+        with ManifestWriter(path) as writer:
+            for listing in listings:
+                writer.write(listing)
+
+    entries = load_manifest(path)
+    assert len(entries) == 2
+    merged = entries[0]
+    assert normalize_location(merged["location"]) == "https://mrf.example/in_network/a.json.gz?v=2"
+    assert [plan["plan_name"] for plan in merged["reporting_plans"]] == ["A", "B", "C"]
+    assert merged["occurrences"] == 3
+    assert merged["last_updated"] == "2025-02-01"
+    assert entries[1]["location"] == _entry(0)["location"]
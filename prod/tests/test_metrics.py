@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+from scripts.inn.utils import metrics
+
+
+def test_peak_rss_is_per_tracked_url():
+    with metrics.track("big") as big:
+        with metrics.stage("load"):
+            data = np.ones(200 * 1024 ** 2 // 8)
+            time.sleep(0.05)
+            del data
+    with metrics.track("small") as small:
+        with metrics.stage("load"):
+            time.sleep(0.05)
+
+    # The second URL does not inherit the first one's peak
+    assert big.peak_rss - small.peak_rss > 100 * 1024 ** 2
+    assert small.stages["load"]["peak_rss"] <= small.peak_rss
+
+
+def test_streamed_save_counts_each_row_once(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from scripts.inn.transformers.relational import stream_relational_tables
+    from scripts.inn.utils.columnar import FLAT_RATE_SCHEMA
+
+    batch = pa.RecordBatch.from_pylist([
+        {"cpt": "99213", "npi": 1111111111, "tin": "111", "pos": "11", "negotiated_rate": 100.0},
+        {"cpt": "99213", "npi": 2222222222, "tin": "111", "pos": "11", "negotiated_rate": 90.0},
+    ], schema=FLAT_RATE_SCHEMA)
+    with metrics.track("mrf") as run:
+        paths = stream_relational_tables(iter([batch, batch]), "http://example.test/mrf.json", "Plan",
+                                         str(tmp_path), "mrf")
+
+    written = sum(pq.read_metadata(p).num_rows for p in paths)
+    assert run.totals()["rows_emitted"] == written
+
+
+def test_run_report_is_the_progress_channel(server, tmp_path, monkeypatch, capfd):
+    import pyarrow.parquet as pq
+    from conftest import write_synthetic_mrf
+
+    from scripts.inn import _main_relational as main
+    from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_table
+
+    path = write_synthetic_mrf(tmp_path / "www" / "mrf.json.gz")
+    monkeypatch.setattr(main, "OUTPUT_DIR", tmp_path / "relational")
+    monkeypatch.setattr(main, "ROLLUP_DIR", tmp_path / "rollup")
+    monkeypatch.setattr(main, "REPORT_DIR", tmp_path / "reports")
+    capfd.readouterr()
+
+    result = main.run_entry(server.url("mrf.json.gz"), {"location": server.url("mrf.json.gz")}, str(tmp_path / "cache"))
+    assert result["status"] == "ok", result["error"]
+    assert capfd.readouterr().out == ""  # nothing printed alongside the metrics
+
+    rows = pq.read_table(metrics.write_report([result], tmp_path / "report.parquet"))
+    assert rows.schema.equals(metrics.REPORT_SCHEMA)
+    assert {"detect_format", "fetch", "scrape", "save"} <= set(rows["stage"].to_pylist())
+    totals = {c: sum(rows[c].to_pylist()) for c in metrics.COUNTERS}
+    assert totals["rows_scraped"] == stream_mrf_to_table(str(path)).num_rows
+    tables = [p for p in result["outputs"] if p.startswith(str(tmp_path / "relational"))]
+    assert totals["rows_emitted"] == sum(pq.read_metadata(p).num_rows for p in tables) > 0
@@ -0,0 +1,43 @@
+import json
+
+import pyarrow as pa
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_normalized_tables, stream_mrf_to_table
+
+
+def _write_mrf(path):
+    mrf = {
+        "reporting_entity_name": "Test Plan",
+        "provider_references": [
+            {"provider_group_id": "A1", "provider_groups": [{"npi": [1111111111, 2222222222],
+                                                             "tin": {"type": "ein", "value": "111"}}]},
+            {"provider_group_id": "B2", "provider_groups": [{"npi": [3333333333], "tin": {"type": "ein", "value": "222"}}]},
+        ],
+        "in_network": [{
+            "billing_code": "99213",
+            "negotiated_rates": [{
+                "provider_references": ["A1", "B2"],
+                "negotiated_prices": [{"negotiated_rate": 100.0, "place_of_service": "11"},
+                                      {"negotiated_rate": 80.0, "place_of_service": "22"}],
+            }],
+        }],
+    }
+    path.write_text(json.dumps(mrf))
+
+
+def test_string_group_ids_join_the_provider_groups_table(tmp_path):
+    path = tmp_path / "mrf.json"
+    _write_mrf(path)
+
+    tables = stream_mrf_to_normalized_tables(str(path))
+    rates, groups = tables["negotiated_rates"], tables["provider_groups"]
+
+    assert rates.num_rows == 4
+    assert set(rates["provider_group_id"].to_pylist()) == set(groups["provider_group_id"].to_pylist())
+
+    # Joining back to NPIs gives what the flat scraper produces
+    joined = rates.join(groups, "provider_group_id")
+    flat = stream_mrf_to_table(str(path))
+    key = ["npi", "pos", "negotiated_rate"]
+    assert sorted(zip(*[joined[c].to_pylist() for c in key])) == sorted(zip(*[flat[c].to_pylist() for c in key]))
+    assert joined.schema.field("provider_group_id").type == pa.int64()
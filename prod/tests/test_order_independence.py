@@ -0,0 +1,24 @@
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_normalized_tables, stream_mrf_to_table
+
+
+def test_section_order_does_not_change_the_rows(tmp_path):
+    refs_first = write_synthetic_mrf(tmp_path / "refs_first.json", refs_first=True)
+    rates_first = write_synthetic_mrf(tmp_path / "rates_first.json", refs_first=False)
+
+    expected = stream_mrf_to_table(str(refs_first))
+    assert expected.num_rows > 0
+    assert flat_rows(stream_mrf_to_table(str(rates_first))) == flat_rows(expected)
+
+
+def test_section_order_does_not_change_the_normalized_tables(tmp_path):
+    refs_first = write_synthetic_mrf(tmp_path / "refs_first.json.gz", refs_first=True)
+    rates_first = write_synthetic_mrf(tmp_path / "rates_first.json.gz", refs_first=False)
+
+    def rows(path):
+        tables = stream_mrf_to_normalized_tables(str(path))
+        return {name: sorted(map(tuple, (r.values() for r in table.to_pylist())), key=repr)
+                for name, table in tables.items()}
+
+    assert rows(rates_first) == rows(refs_first)
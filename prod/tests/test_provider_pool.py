@@ -0,0 +1,67 @@
+import pickle
+
+import numpy as np
+
+from scripts.inn.utils.columnar import UNKNOWN_RANGE, ProviderPool, group_keys
+from scripts.inn.utils.disk_pool import DiskProviderPool
+
+BIG_NPI = 2 ** 32 + 5  # does not fit the uint32 NPI buffer
+
+
+def _groups():
+    """(group_id, [(npi, tin), ...]) definitions, with a redefined id and a string id."""
+    groups = [(g, [(1_000_000_000 + g * 10 + i, f"{g % 3:09d}") for i in range(g % 4 + 1)]) for g in range(1, 40)]
+    groups.append(("group-a", [(1_999_999_999, "123456789")]))
+    groups.append((7, [(1_777_777_777, "777777777")]))  # later definition wins
+    groups.append((41, [(BIG_NPI, "000000001"), (1_000_000_001, "000000001")]))
+    groups.append((42, []))
+    return groups
+
+
+def fill(pool):
+    for group_id, providers in _groups():
+        pool.add_group(group_id, providers)
+    return pool
+
+
+def members(pool, group_ids):
+    """group_id -> [(npi, tin), ...] resolved through the pool; unknown groups give None."""
+    starts, lengths = pool.lookup_many(group_keys(group_ids))
+    out = {}
+    for group_id, start, length in zip(group_ids, starts, lengths):
+        if (start, length) == UNKNOWN_RANGE:
+            out[group_id] = None
+            continue
+        npis, tins = pool.take(np.arange(start, start + length))
+        out[group_id] = list(zip(npis.to_pylist(), tins.to_pylist()))
+    return out
+
+
+def test_pool_resolves_groups_like_a_dict():
+    expected = dict(_groups())
+    pool = fill(ProviderPool(capacity=4))
+    queries = list(expected) + [999, "missing"]
+
+    assert members(pool, queries) == {**expected, 999: None, "missing": None}
+    assert members(pool.freeze(), queries) == members(pool, queries)
+
+
+def test_npis_past_uint32_promote_the_buffer():
+    pool = fill(ProviderPool())
+    assert pool._npis.dtype == np.int64
+    assert members(pool, [41])[41][0] == (BIG_NPI, "000000001")
+    assert BIG_NPI in pool.to_table()["npi"].to_pylist()
+
+
+def test_disk_pool_equals_in_memory_pool(tmp_path):
+    queries = [group_id for group_id, _ in _groups()] + [999, "missing"]
+    expected = fill(ProviderPool())
+    # A tiny buffer flushes to disk often, so the big NPI promotes an already written file
+    with DiskProviderPool(str(tmp_path), buffer_slots=3) as pool:
+        fill(pool)
+        assert members(pool, queries) == members(expected, queries)
+        assert pool.to_table().equals(expected.to_table())
+
+        copy = pickle.loads(pickle.dumps(pool))  # what a shard worker receives
+        assert members(copy, queries) == members(expected, queries)
+    assert not any(tmp_path.iterdir())
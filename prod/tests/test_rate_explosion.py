@@ -0,0 +1,34 @@
+import gzip
+import json
+
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import CPT_CODES, stream_mrf_to_table
+
+
+def _naive_rows(path):
+    """One row per (rate, referenced provider, price), built the way the dict-per-row scraper did."""
+    with gzip.open(path) as f:
+        mrf = json.load(f)
+    groups = {ref["provider_group_id"]: ref["provider_groups"] for ref in mrf["provider_references"]}
+    rows = []
+    for item in mrf["in_network"]:
+        if item["billing_code"] not in CPT_CODES:
+            continue
+        for rate in item["negotiated_rates"]:
+            for ref in rate["provider_references"]:
+                for group in groups[ref]:
+                    for npi in group["npi"]:
+                        for price in rate["negotiated_prices"]:
+                            rows.append((item["billing_code"], npi, group["tin"]["value"],
+                                         price["place_of_service"], float(price["negotiated_rate"])))
+    return sorted(rows, key=repr)
+
+
+def test_columnar_explosion_matches_the_row_by_row_cross_product(tmp_path):
+    path = write_synthetic_mrf(tmp_path / "mrf.json.gz", refs_per_rate=3, prices_per_rate=3)
+
+    table = stream_mrf_to_table(str(path))
+
+    assert table.num_rows > 0
+    assert flat_rows(table) == _naive_rows(path)
@@ -0,0 +1,72 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from conftest import write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_normalized_tables, stream_mrf_to_table
+from scripts.inn.transformers.relational import (
+    FLAT_RATES_SCHEMA, PROVIDER_SCHEMA, stream_relational_tables, transform_to_relational,
+)
+from scripts.inn.utils.columnar import FLAT_RATE_SCHEMA
+from scripts.inn.utils.keys import hash_key
+
+URL = "http://example.test/plan.json"
+ROW = {"cpt": "99213", "npi": 1111111111, "tin": "111", "pos": "11", "negotiated_rate": 100.0}
+
+
+def _rate_ids(rows):
+    table = pa.Table.from_pylist(rows, schema=FLAT_RATE_SCHEMA)
+    return transform_to_relational(table, URL, "Plan")["negotiated_rates"]["rate_id"].to_pylist()
+
+
+def test_rate_id_is_unique_for_repeated_rates():
+    rate_ids = _rate_ids([ROW, ROW, dict(ROW, negotiated_rate=90.0), ROW])
+    assert len(set(rate_ids)) == 4
+
+
+def test_rate_id_is_stable_across_runs():
+    rows = [ROW, ROW, dict(ROW, negotiated_rate=90.0)]
+    assert _rate_ids(rows) == _rate_ids(rows)
+
+
+def test_unrelated_earlier_rate_leaves_ids_unchanged():
+    rows = [ROW, dict(ROW, negotiated_rate=90.0), ROW]
+    other = dict(ROW, cpt="99214")
+
+    assert _rate_ids([other, other] + rows)[2:] == _rate_ids(rows)
+
+
+def test_rate_ids_do_not_depend_on_batching(tmp_path):
+    rows = [ROW, dict(ROW, negotiated_rate=90.0), ROW, ROW, dict(ROW, npi=2222222222)]
+    table = pa.Table.from_pylist(rows, schema=FLAT_RATE_SCHEMA)
+    paths = stream_relational_tables(iter(table.to_batches(max_chunksize=2)), URL, "Plan", str(tmp_path), "plan")
+    rates = pq.read_table(next(p for p in paths if p.endswith("negotiated_rates.parquet")))
+    assert rates["rate_id"].to_pylist() == _rate_ids(rows)
+
+
+def test_provider_dimension_has_each_provider_once_across_batches(tmp_path):
+    rows = [dict(ROW, npi=1000000000 + i % 7, tin=str(i % 3)) for i in range(100)]
+    table = pa.Table.from_pylist(rows, schema=FLAT_RATE_SCHEMA)
+    paths = stream_relational_tables(iter(table.to_batches(max_chunksize=9)), URL, "Plan", str(tmp_path), "plan")
+    providers = pq.read_table(next(p for p in paths if p.endswith("providers.parquet")))
+
+    expected = {(r["npi"], r["tin"]) for r in rows}
+    assert providers.num_rows == len(expected)
+    assert set(zip(providers["npi"].to_pylist(), providers["tin"].to_pylist())) == expected
+
+
+def test_flat_and_normalized_transforms_describe_the_same_rates(tmp_path):
+    path = write_synthetic_mrf(tmp_path / "mrf.json.gz")
+    flat = transform_to_relational(stream_mrf_to_table(str(path)), URL, "Plan")
+    normalized = transform_to_relational(stream_mrf_to_normalized_tables(str(path)), URL, "Plan")
+
+    rates, providers = flat["negotiated_rates"], flat["providers"]
+    assert rates.schema == FLAT_RATES_SCHEMA and providers.schema == PROVIDER_SCHEMA
+    assert providers.num_rows == len(set(providers["provider_id"].to_pylist()))
+    row = rates.slice(0, 1).to_pylist()[0]
+    assert row["provider_id"] == hash_key("provider", row["npi"], row["tin"])
+
+    # provider_groups -> providers resolves group-keyed rates to the flat rows
+    joined = normalized["negotiated_rates"].join(normalized["provider_groups"], "provider_group_id") \
+        .join(normalized["providers"], "provider_id")
+    key = ["cpt_code", "npi", "tin", "place_of_service", "negotiated_rate"]
+    assert sorted(zip(*[joined[c].to_pylist() for c in key])) == sorted(zip(*[rates[c].to_pylist() for c in key]))
@@ -0,0 +1,85 @@
+import gzip
+import json
+import threading
+import time
+
+from conftest import send_body
+
+from scripts.inn.utils import remote_refs
+from scripts.inn.utils.remote_refs import RemoteReferences
+
+
+def _document(npi):
+    return {"provider_groups": [{"npi": [npi], "tin": {"type": "ein", "value": str(npi)[:3]}}]}
+
+
+def test_concurrent_fetch_downloads_each_location_once(server, tmp_path):
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow(handler):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.2)
+        npi = int(handler.path.strip("/").split(".")[0])
+        body = gzip.compress(json.dumps(_document(npi)).encode())
+        with lock:
+            in_flight[0] -= 1
+        send_body(handler, body)
+
+    urls = [server.url(f"{npi}.json.gz") for npi in range(1000000001, 1000000005)]
+    for url in urls:
+        server.routes["/" + url.rsplit("/", 1)[1]] = slow
+
+    with RemoteReferences(tmp_path / "refs", workers=4) as refs:
+        futures = [refs.submit(url) for url in urls for _ in range(3)]
+        results = [future.result() for future in futures]
+
+    assert results[0] == results[1] == results[2] == _document(1000000001)["provider_groups"]
+    assert all(server.count(url.rsplit("/", 1)[1]) == 1 for url in urls)
+    assert refs.downloads == 4
+    assert peak[0] == 4
+
+
+def test_cache_is_shared_across_instances(server, tmp_path):
+    (server.root / "refs.json").write_text(json.dumps(_document(1111111111)))
+    url = server.url("refs.json")
+
+    with RemoteReferences(tmp_path / "refs") as first:
+        groups = first.get(url)
+    with RemoteReferences(tmp_path / "refs") as second:
+        assert second.get(url) == groups
+
+    assert server.count("refs.json") == 1
+    assert (first.downloads, second.downloads, second.hits) == (1, 0, 1)
+
+
+def test_transient_errors_are_retried(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote_refs, "BACKOFF_FACTOR", 0)
+    statuses = [503, 502]
+
+    def flaky(handler):
+        if statuses:
+            send_body(handler, b"", status=statuses.pop(0))
+        else:
+            send_body(handler, json.dumps(_document(2222222222)).encode())
+
+    server.routes["/refs.json"] = flaky
+    with RemoteReferences(tmp_path / "refs") as refs:
+        assert refs.get(server.url("refs.json")) == _document(2222222222)["provider_groups"]
+
+    assert server.count("refs.json") == 3
+
+
+def test_failed_fetch_resolves_none_and_is_not_cached(server, tmp_path):
+    url = server.url("missing.json")
+
+    with RemoteReferences(tmp_path / "refs") as refs:
+        assert refs.get(url) is None
+        assert not refs.path(url).exists()
+        # The next request tries again instead of reading a cached failure
+        assert refs.get(url) is None
+
+    assert server.count("missing.json") == 2
+    assert refs.downloads == 0
@@ -0,0 +1,51 @@
+import json
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_table
+from scripts.inn.utils.remote_refs import RemoteReferences
+
+
+def _write_mrf(path, location):
+    path.write_text(json.dumps({
+        "reporting_entity_name": "Test Plan",
+        "provider_references": [
+            {"provider_group_id": 1, "location": location},
+            {"provider_group_id": 2, "provider_groups": [{"npi": [2222222222], "tin": {"type": "ein", "value": "222"}}]},
+        ],
+        "in_network": [{
+            "billing_code": "99213",
+            "negotiated_rates": [
+                {"provider_references": [1], "negotiated_prices": [{"negotiated_rate": 100.0, "place_of_service": "11"}]},
+                {"provider_references": [2], "negotiated_prices": [{"negotiated_rate": 90.0, "place_of_service": "11"}]},
+                {"provider_references": [3], "negotiated_prices": [{"negotiated_rate": 80.0, "place_of_service": "11"}]},
+            ],
+        }],
+    }))
+
+
+def _rows(table):
+    return sorted(zip(table["negotiated_rate"].to_pylist(), table["npi"].to_pylist(), table["tin"].to_pylist()))
+
+
+def test_unfetchable_location_falls_back_to_the_unknown_provider(server, tmp_path):
+    path = tmp_path / "mrf.json"
+    _write_mrf(path, server.url("missing.json"))
+
+    with RemoteReferences(tmp_path / "refs") as references:
+        table = stream_mrf_to_table(str(path), references=references)
+
+    # The 404 group (1) is treated like the reference that does not exist at all (3)
+    assert _rows(table) == [(80.0, None, "unknown"), (90.0, 2222222222, "222"), (100.0, None, "unknown")]
+    assert server.count("missing.json") == 1
+
+
+def test_fetched_location_resolves_its_providers(server, tmp_path):
+    (server.root / "group.json").write_text(json.dumps(
+        {"provider_groups": [{"npi": [1111111111], "tin": {"type": "ein", "value": "111"}}]}
+    ))
+    path = tmp_path / "mrf.json"
+    _write_mrf(path, server.url("group.json"))
+
+    with RemoteReferences(tmp_path / "refs") as references:
+        table = stream_mrf_to_table(str(path), references=references)
+
+    assert (100.0, 1111111111, "111") in _rows(table)
@@ -0,0 +1,61 @@
+import numpy as np
+import pyarrow as pa
+from conftest import write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_table
+from scripts.inn.transformers import rollup as rollup_module
+from scripts.inn.transformers.rollup import (
+    RELATIVE_ACCURACY, RateRollup, load_rollup, refresh_rollup, rollup_stats, update_rollup,
+)
+
+
+def _write_partial(rollup_dir, source, rates):
+    partial = RateRollup("Payer")
+    n = len(rates)
+    partial.add(pa.array(["99213"] * n), pa.array(["11"] * n), pa.array(["111"] * n), pa.array(rates))
+    partial.write(str(rollup_dir), source)
+
+
+def test_refreshed_sources_rebuild_the_cube_once(tmp_path, monkeypatch):
+    for source in ("a", "b", "c"):
+        _write_partial(tmp_path, source, [100.0, 200.0])
+        update_rollup(str(tmp_path), source)
+
+    rebuilds = []
+    real_rebuild = rollup_module.rebuild_rollup
+    monkeypatch.setattr(rollup_module, "rebuild_rollup", lambda d: rebuilds.append(d) or real_rebuild(d))
+    for source in ("a", "b"):
+        _write_partial(tmp_path, source, [50.0])
+        update_rollup(str(tmp_path), source, defer_rebuild=True)
+    assert rebuilds == []
+
+    assert refresh_rollup(str(tmp_path))
+    assert not refresh_rollup(str(tmp_path))
+    assert len(rebuilds) == 1
+
+    stats = rollup_stats(*load_rollup(str(tmp_path)), by=["cpt_code"])
+    assert stats.loc["99213", "count"] == 4
+    assert stats.loc["99213", "min"] == 50.0
+    assert stats.loc["99213", "max"] == 200.0
+
+
+def test_rollup_matches_exact_stats_within_sketch_accuracy(tmp_path):
+    path = write_synthetic_mrf(tmp_path / "mrf.json.gz")
+    flat = stream_mrf_to_table(str(path))
+    partial = RateRollup("Payer")
+    for batch in flat.to_batches(max_chunksize=100):
+        partial.add_flat(batch)
+    partial.write(str(tmp_path / "rollup"), "mrf")
+    update_rollup(str(tmp_path / "rollup"), "mrf")
+
+    stats = rollup_stats(*load_rollup(str(tmp_path / "rollup")), by=["cpt_code"])
+    exact = flat.to_pandas().groupby("cpt")["negotiated_rate"]
+    assert stats["count"].to_dict() == exact.size().to_dict()
+    np.testing.assert_allclose(stats["mean"], exact.mean().sort_index())
+    np.testing.assert_allclose(stats["std"].fillna(0), exact.std().fillna(0).sort_index(), atol=1e-6)
+    assert (stats["min"] == exact.min().sort_index()).all()
+    assert (stats["max"] == exact.max().sort_index()).all()
+    for cpt, rates in exact:
+        # The sketch reports a bucket value within RELATIVE_ACCURACY of the order statistic it picks
+        median = np.sort(rates.to_numpy())[int(0.5 * (len(rates) - 1))]
+        assert abs(stats.loc[cpt, "p50"] - median) <= RELATIVE_ACCURACY * median + 1e-9
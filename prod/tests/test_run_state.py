@@ -0,0 +1,26 @@
+from scripts.inn.utils.run_state import RunState
+
+SIGNED = "https://mrf.example/in-network.json.gz?Expires=1&Signature=abc"
+RESIGNED = "https://mrf.example/in-network.json.gz?Expires=2&Signature=def"
+FINGERPRINT = {"etag": '"v1"', "last_modified": None, "content_length": 10, "manifest_last_updated": None}
+
+
+def test_resigned_url_is_unchanged(tmp_path):
+    output = tmp_path / "out.parquet"
+    output.write_bytes(b"")
+    state = RunState(tmp_path / "state.json")
+    state.mark_running(SIGNED, FINGERPRINT)
+    state.mark_finished(SIGNED, FINGERPRINT, "ok", [str(output)])
+
+    reloaded = RunState(tmp_path / "state.json")
+    assert reloaded.is_unchanged(RESIGNED, FINGERPRINT)
+    assert reloaded.record(RESIGNED)["url"] == SIGNED
+    assert not reloaded.is_unchanged(RESIGNED, dict(FINGERPRINT, etag='"v2"'))
+
+
+def test_interrupted_entry_is_found_under_a_new_signature(tmp_path):
+    state = RunState(tmp_path / "state.json")
+    state.mark_running(SIGNED, FINGERPRINT)
+
+    assert state.interrupted() == ["https://mrf.example/in-network.json.gz"]
+    assert state.record(RESIGNED)["status"] == "running"
@@ -0,0 +1,25 @@
+import pyarrow as pa
+import pytest
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import iter_mrf_batches_parallel, stream_mrf_to_table
+from scripts.inn.utils import shards
+from scripts.inn.utils.columnar import FLAT_RATE_SCHEMA
+
+
+@pytest.mark.parametrize("name", ["mrf.json", "mrf.json.gz"])
+@pytest.mark.parametrize("spill_provider_map", [False, True])
+def test_sharded_parse_equals_sequential(tmp_path, monkeypatch, name, spill_provider_map):
+    monkeypatch.setattr(shards, "MIN_SHARD_BYTES", 1)  # split even a small file
+    path = write_synthetic_mrf(tmp_path / name, billing_codes=60)
+    plan_path = tmp_path / "mrf.shards.json"
+
+    sequential = stream_mrf_to_table(str(path))
+    for _ in range(2):  # the second run reuses the saved shard plan
+        batches = list(iter_mrf_batches_parallel(str(path), workers=3, plan_path=str(plan_path),
+                                                 spill_dir=str(tmp_path),
+                                                 spill_provider_map=spill_provider_map))
+        sharded = pa.Table.from_batches(batches, FLAT_RATE_SCHEMA)
+        assert sharded.num_rows == sequential.num_rows
+        assert flat_rows(sharded) == flat_rows(sequential)
+    assert len(shards.ShardPlan.load(plan_path).shards) > 1
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import pyarrow.parquet as pq
+from conftest import write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import iter_mrf_batches, stream_mrf_to_table
+from scripts.inn.transformers.relational import save_relational_tables, stream_relational_tables, transform_to_relational
+
+URL = "http://example.test/mrf.json.gz"
+
+
+def _read(paths):
+    return {Path(p).name: pq.read_table(p) for p in paths}
+
+
+def test_streamed_tables_equal_the_whole_table_transform(tmp_path):
+    path = write_synthetic_mrf(tmp_path / "mrf.json.gz")
+
+    streamed = _read(stream_relational_tables(iter_mrf_batches(str(path)), URL, "Plan",
+                                              str(tmp_path / "streamed"), "mrf"))
+    whole = _read(save_relational_tables(transform_to_relational(stream_mrf_to_table(str(path)), URL, "Plan"),
+                                         str(tmp_path / "whole"), "mrf"))
+
+    assert set(streamed) == set(whole)
+    for name, table in whole.items():
+        # Entity rows are stamped with the time they were written
+        key = [c for c in table.column_names if c != "last_updated"]
+        table = table.select(key)
+        streamed[name] = streamed[name].select(key)
+        assert streamed[name].num_rows == table.num_rows, name
+        assert streamed[name].sort_by([(c, "ascending") for c in key]).equals(
+            table.sort_by([(c, "ascending") for c in key])), name
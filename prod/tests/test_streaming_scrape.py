@@ -0,0 +1,16 @@
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.inn.scrapers.grouped_by_provider_reference import stream_mrf_to_table
+
+
+def test_remote_gzipped_mrf_streams_like_the_local_file(server, tmp_path):
+    path = write_synthetic_mrf(server.root / "mrf.json.gz")
+    spool = tmp_path / "spool.json.gz"
+
+    remote = stream_mrf_to_table(server.url("mrf.json.gz"), spool_path=str(spool))
+    local = stream_mrf_to_table(str(path))
+
+    assert remote.num_rows > 0
+    assert flat_rows(remote) == flat_rows(local)
+    # The spool keeps the compressed bytes as served
+    assert spool.read_bytes() == path.read_bytes()
@@ -0,0 +1,45 @@
+import gzip
+import json
+
+import pyarrow as pa
+from conftest import flat_rows, write_synthetic_mrf
+
+from scripts.bench.synthetic import MRFSpec, TOCSpec, write_mrf, write_toc
+from scripts.inn.scrapers import SCRAPERS
+from scripts.inn.scrapers.grouped_by_provider_reference import CPT_CODES, stream_mrf_to_table
+from scripts.inn.utils.columnar import FLAT_RATE_SCHEMA
+
+SPEC = MRFSpec(provider_groups=30, max_group_size=10, billing_codes=20, rates_per_code=3, target_boost=2, seed=5)
+
+
+def test_same_seed_writes_the_same_bytes(tmp_path):
+    for name in ("a", "b"):
+        write_mrf(tmp_path / f"{name}.json.gz", SPEC, sorted(CPT_CODES))
+        write_toc(tmp_path / f"{name}.toc.json.gz", "https://mrf.example", TOCSpec(reporting_structures=20, seed=5))
+    write_mrf(tmp_path / "c.json.gz", SPEC._replace(seed=6), sorted(CPT_CODES))
+
+    assert (tmp_path / "a.json.gz").read_bytes() == (tmp_path / "b.json.gz").read_bytes()
+    assert (tmp_path / "a.toc.json.gz").read_bytes() == (tmp_path / "b.toc.json.gz").read_bytes()
+    assert (tmp_path / "a.json.gz").read_bytes() != (tmp_path / "c.json.gz").read_bytes()
+
+
+def test_reported_counts_match_the_file(tmp_path):
+    stats = write_mrf(tmp_path / "mrf.json.gz", SPEC, sorted(CPT_CODES))
+    with gzip.open(tmp_path / "mrf.json.gz") as f:
+        mrf = json.load(f)
+
+    assert stats["json_bytes"] == len(gzip.decompress((tmp_path / "mrf.json.gz").read_bytes()))
+    assert stats["in_network_items"] == len(mrf["in_network"]) == SPEC.billing_codes
+    assert stats["negotiated_rates"] == sum(len(item["negotiated_rates"]) for item in mrf["in_network"])
+    assert stats["providers"] == sum(len(g["npi"]) for ref in mrf["provider_references"] for g in ref["provider_groups"])
+    assert stats["target_rates"] == sum(len(item["negotiated_rates"]) for item in mrf["in_network"]
+                                        if item["billing_code"] in CPT_CODES)
+
+
+def test_layouts_of_one_seed_describe_the_same_rates(tmp_path):
+    referenced = stream_mrf_to_table(str(write_synthetic_mrf(tmp_path / "refs.json.gz", seed=2)))
+    inline_path = write_synthetic_mrf(tmp_path / "inline.json.gz", seed=2, inline_groups=True)
+    inline = pa.Table.from_batches(SCRAPERS["inline_provider_groups"].flat(str(inline_path)), FLAT_RATE_SCHEMA)
+
+    assert referenced.num_rows > 0
+    assert flat_rows(inline) == flat_rows(referenced)
@@ -0,0 +1,37 @@
+import gzip
+import json
+
+from scripts.bench.synthetic import TOCSpec, write_toc
+from scripts.toc.toc_main import stream_toc
+from scripts.toc.utils.manifest import load_manifest, normalize_location
+
+SPEC = TOCSpec(reporting_structures=60, plans_per_structure=2, files_per_structure=3, distinct_files=25, seed=3)
+
+
+def _expected_plans(toc_path):
+    """Location -> plan names, from the whole TOC loaded at once."""
+    with gzip.open(toc_path) as f:
+        toc = json.load(f)
+    expected = {}
+    for structure in toc["reporting_structure"]:
+        for file in structure["in_network_files"]:
+            plans = expected.setdefault(normalize_location(file["location"]), [])
+            plans += [p["plan_name"] for p in structure["reporting_plans"] if p["plan_name"] not in plans]
+    return expected
+
+
+def _manifest_plans(path):
+    return {normalize_location(e["location"]): [p["plan_name"] for p in e["reporting_plans"]]
+            for e in load_manifest(path)}
+
+
+def test_streamed_manifest_matches_the_loaded_toc(server, tmp_path):
+    toc_path = tmp_path / "www" / "index.json.gz"
+    write_toc(toc_path, "https://mrf.example/files", SPEC)
+    expected = _expected_plans(toc_path)
+
+    for name in ("manifest.jsonl", "manifest.parquet", "manifest.json"):
+        format_style, writer = stream_toc(server.url("/index.json.gz"), tmp_path / name)
+        assert format_style == "structure_level_inn"
+        assert writer.count == len(expected)
+        assert _manifest_plans(tmp_path / name) == expected, name